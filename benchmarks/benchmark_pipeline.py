@@ -0,0 +1,236 @@
+"""
+Benchmark the cost processing pipeline on synthetic Cost Explorer data
+
+Each stage is timed, then run again under tracemalloc to measure its peak memory.
+Results can be saved as JSON and compared against a baseline, in which case the
+exit code is 1 if any stage is slower or uses more memory than the baseline
+multiplied by --tolerance.
+
+    python benchmarks/benchmark_pipeline.py --periods 365 --cardinality1 50 \\
+      --cardinality2 500 --density 0.05 --baseline benchmarks/baseline.json
+
+Use --replay to benchmark the Cost Explorer responses in a bundle recorded with
+aws-costs --record, e.g. production-sized data.
+"""
+
+import copy
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.bundle import Bundle
+from hic_aws_costing_tools.frame import CostFrame
+from hic_aws_costing_tools.synthetic import generate_results
+
+# Ignore differences smaller than this, to avoid noise from very fast stages
+MIN_DIFFERENCE = {"seconds": 0.005, "peak_bytes": 65536}
+
+
+def _stages(data):
+    """
+    :return: List of (name, setup, run). setup() returns the arguments for run so
+      that input preparation isn't measured.
+    """
+    results, all_values1, all_values2, value_map1 = data
+    frame = CostFrame.from_results(results)
+
+    def table(results=results):
+        return aws_costs.costs_to_table(
+            results=results,
+            group1="AccountName",
+            all_values1=all_values1,
+            all_values2=all_values2,
+            cost_type="UnblendedCost",
+        )
+
+    return [
+        (
+            "_apply_value_mappings",
+            # Mappings are applied in place so each run needs a copy
+            lambda: (copy.deepcopy(results),),
+            lambda r: aws_costs._apply_value_mappings(
+                results=r,
+                all_values1=all_values1,
+                all_values2=all_values2,
+                value_map1=value_map1,
+                value_map2={},
+            ),
+        ),
+        ("costs_to_table", lambda: (), table),
+        ("CostFrame.from_results", lambda: (), lambda: CostFrame.from_results(results)),
+        ("CostFrame.relabel", lambda: (), lambda: frame.relabel(value_map1)),
+        ("costs_to_table(CostFrame)", lambda: (), lambda: table(frame)),
+        (
+            "costs_to_flat",
+            lambda: (),
+            lambda: aws_costs.costs_to_flat(
+                results=results,
+                group1="Account",
+                group2="Service",
+                cost_type="UnblendedCost",
+            ),
+        ),
+        (
+            "format_message_summarise",
+            lambda: table(),
+            lambda header, costs: aws_costs.format_message_summarise(
+                header, "AccountName", costs
+            ),
+        ),
+        (
+            "format_message_all",
+            lambda: table(),
+            lambda header, costs: aws_costs.format_message_all(
+                header, costs, "AccountName", "Service", exclude_zero=True
+            ),
+        ),
+        (
+            "costs_to_csv",
+            lambda: table(),
+            lambda header, costs: aws_costs.costs_to_csv(header, costs),
+        ),
+    ]
+
+
+def bundle_results(path):
+    """
+    :return: (results, all_values1, all_values2, value_map1) from all
+      get_cost_and_usage and LINKED_ACCOUNT get_dimension_values responses in a bundle
+    """
+    bundle = Bundle(path)
+    results = []
+    for response in bundle.responses("get_cost_and_usage"):
+        results.extend(response["ResultsByTime"])
+    all_values1 = {g["Keys"][0] for r in results for g in r["Groups"]}
+    all_values2 = {g["Keys"][1] for r in results for g in r["Groups"]}
+    value_map1 = {}
+    for response in bundle.responses("get_dimension_values"):
+        for dv in response["DimensionValues"]:
+            if "description" in dv.get("Attributes", {}):
+                value_map1[dv["Value"]] = dv["Attributes"]["description"]
+    return results, all_values1, all_values2, value_map1
+
+
+def run_benchmarks(*, repeat=3, replay=None, **generator_args):
+    if replay:
+        data = bundle_results(replay)
+        generator_args = {"replay": replay}
+    else:
+        data = generate_results(**generator_args)
+    ngroups = sum(len(r["Groups"]) for r in data[0])
+    stages = {}
+    for name, setup, run in _stages(data):
+        times = []
+        for _ in range(repeat):
+            args = setup()
+            start = time.perf_counter()
+            run(*args)
+            times.append(time.perf_counter() - start)
+
+        args = setup()
+        tracemalloc.start()
+        run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stages[name] = {"seconds": min(times), "peak_bytes": peak}
+
+    return {
+        "parameters": dict(generator_args, repeat=repeat),
+        "groups": ngroups,
+        "python": platform.python_version(),
+        "stages": stages,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: List of regression descriptions
+    """
+    regressions = []
+    for name, stage in results["stages"].items():
+        base = baseline["stages"].get(name)
+        if not base:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if (
+                stage[metric] > base[metric] * tolerance
+                and stage[metric] - base[metric] > MIN_DIFFERENCE[metric]
+            ):
+                regressions.append(
+                    f"{name} {metric}: {stage[metric]:.4g} > {base[metric]:.4g} x {tolerance}"
+                )
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--periods", type=int, default=90, help="Number of periods")
+    parser.add_argument("--granularity", choices=["DAILY", "MONTHLY"], default="DAILY")
+    parser.add_argument(
+        "--cardinality1", type=int, default=50, help="Number of accounts"
+    )
+    parser.add_argument(
+        "--cardinality2", type=int, default=200, help="Number of services/tag values"
+    )
+    parser.add_argument(
+        "--density", type=float, default=0.05, help="Fraction of non-zero cells"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--replay",
+        metavar="BUNDLE",
+        help="Benchmark the responses in this bundle instead of synthetic data",
+    )
+    parser.add_argument("--output", help="Save results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="Regression threshold as a multiple of the baseline (default %(default)s)",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        periods=args.periods,
+        granularity=args.granularity,
+        cardinality1=args.cardinality1,
+        cardinality2=args.cardinality2,
+        density=args.density,
+        seed=args.seed,
+        repeat=args.repeat,
+        replay=args.replay,
+    )
+
+    print(f"{results['groups']} groups")
+    for name, stage in results["stages"].items():
+        print(
+            f"{name:28} {stage['seconds'] * 1000:10.1f} ms "
+            f"{stage['peak_bytes'] / 1e6:10.1f} MB"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["parameters"] != results["parameters"]:
+            print("Warning: baseline parameters differ", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark startup time: importing the package and running aws-costs --help
+
+Each command is run in a new Python process and the fastest of --repeat runs is
+reported. boto3 and botocore are checked to not be imported by the commands
+that don't call AWS. Results can be saved as JSON and compared against a
+baseline, in which case the exit code is 1 if any command is slower than the
+baseline multiplied by --tolerance, or imports a lazily imported module.
+
+    python benchmarks/benchmark_startup.py --baseline benchmarks/baseline_startup.json
+"""
+
+import json
+import platform
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+# Modules that must only be imported when they're used
+LAZY_MODULES = ("boto3", "botocore", "numpy", "pyarrow", "yaml")
+# Ignore differences smaller than this, to avoid noise from process startup
+MIN_DIFFERENCE = 0.02
+
+_REPORT_MODULES = (
+    "import sys, json; "
+    f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+)
+
+COMMANDS = {
+    "python": "pass",
+    "import main": "import hic_aws_costing_tools.main",
+    "import handler": "import hic_aws_costing_tools.handler",
+    "aws-costs --help": (
+        "import sys\n"
+        "from hic_aws_costing_tools.main import main\n"
+        "try:\n"
+        "    main(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass"
+    ),
+    # For reference, this is the cost avoided by lazy imports
+    "import boto3": "import boto3",
+}
+# Commands that are allowed to import LAZY_MODULES
+EXPECTED_IMPORTS = {"import boto3": ["boto3", "botocore"]}
+
+
+def _run(code):
+    """
+    :return: (seconds, imported lazy modules)
+    """
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", f"{code}\n{_REPORT_MODULES}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    seconds = time.perf_counter() - start
+    return seconds, json.loads(output.splitlines()[-1])
+
+
+def run_benchmarks(*, repeat=5):
+    commands = {}
+    for name, code in COMMANDS.items():
+        times = []
+        for _ in range(repeat):
+            seconds, imported = _run(code)
+            times.append(seconds)
+        commands[name] = {"seconds": min(times), "imported": imported}
+    return {
+        "parameters": {"repeat": repeat},
+        "python": platform.python_version(),
+        "commands": commands,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: List of regression descriptions
+    """
+    regressions = []
+    for name, command in results["commands"].items():
+        unexpected = set(command["imported"]) - set(EXPECTED_IMPORTS.get(name, []))
+        if unexpected:
+            regressions.append(f"{name} imports {', '.join(sorted(unexpected))}")
+        base = baseline["commands"].get(name)
+        if not base or name in EXPECTED_IMPORTS:
+            continue
+        new, old = command["seconds"], base["seconds"]
+        if new > old * tolerance and new - old > MIN_DIFFERENCE:
+            regressions.append(f"{name} seconds: {old:.3f} -> {new:.3f}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Save results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="Regression threshold as a multiple of the baseline (default %(default)s)",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(repeat=args.repeat)
+    for name, command in results["commands"].items():
+        imported = ", ".join(command["imported"])
+        print(f"{name:20} {command['seconds'] * 1000:10.1f} ms  {imported}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    baseline = {"commands": {}}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for r in regressions:
+        print(f"REGRESSION {r}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
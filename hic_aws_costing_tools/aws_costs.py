@@ -1,8 +1,28 @@
+import asyncio
 import csv
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import partial, wraps
 from io import StringIO
-
-import boto3
+from itertools import repeat
+
+from .catalogue import get_default_catalogue
+from .clients import get_default_client_pool
+from .export import EXPORT_FORMATS, write_export
+from .frame import CostFrame
+from .instrument import timed
+from .pivot import CostPivot
+from .render import RENDERERS, get_renderer, write_all, write_budgeted, write_summary
+from .rollup import (
+    DEFAULT_FISCAL_YEAR_START,
+    DEFAULT_WEEK_START,
+    ROLLUP_GRANULARITIES,
+    _add_months,
+    rollup,
+)
 
 DEFAULT_COST_TYPE = "UnblendedCost"
 DEFAULT_GRANULARITY = "MONTHLY"
@@ -20,40 +40,137 @@ DEFAULT_EXCLUDE_RECORD_TYPES = [
 # https://docs.aws.amazon.com/awsaccountbilling/latest/aboutv2/manage-cost-categories.html#cost-categories-terms
 DEFAULT_INCLUDE_RECORD_TYPES = ["Usage"]
 EXPECTED_UNIT = "USD"
+# https://docs.aws.amazon.com/aws-cost-management/latest/APIReference/API_GetCostAndUsage.html
+METRICS = [
+    "AmortizedCost",
+    "BlendedCost",
+    "NetAmortizedCost",
+    "NetUnblendedCost",
+    "NormalizedUsageAmount",
+    "UnblendedCost",
+    "UsageQuantity",
+]
+# These aren't in EXPECTED_UNIT
+USAGE_METRICS = ["NormalizedUsageAmount", "UsageQuantity"]
+# Maximum number of concurrent Cost Explorer queries when a time period is split
+# or multiple roles are queried
+DEFAULT_MAX_WORKERS = 4
+# Cost Explorer only allows HOURLY queries of up to 14 days
+HOURLY_WINDOW_DAYS = 14
+# Size budget of auto messages, Teams messages are limited to about 28 KB
+DEFAULT_MAX_MESSAGE_BYTES = 28000
+
+log = logging.getLogger(__name__)
 
 
-def _get_group_by(ce, time_period, dimension):
+def _run(coro):
     """
-    Get the group by query for the given dimension
-    :return (group by query, all values for the dimension, optional mapping of values to display names)
+    Run a coroutine from synchronous code, even if this thread has a running event loop
     """
-    value_map = {}
-    if dimension[-1] == "$":
-        dim = dimension[:-1]
-        group_by = {"Type": "TAG", "Key": dim}
-        r = ce.get_tags(TimePeriod=time_period, TagKey=dim)
-        all_values = set(f"{dim}${t}" for t in r["Tags"])
-        return group_by, all_values, value_map
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
 
-    dim = dimension.upper()
 
+def _sync(async_func, name):
+    """
+    Create a synchronous version of an async function
+    """
+
+    @wraps(async_func)
+    def wrapper(*args, **kwargs):
+        return _run(async_func(*args, **kwargs))
+
+    wrapper.__name__ = wrapper.__qualname__ = name
+    wrapper.__doc__ = f"Synchronous version of {async_func.__name__}"
+    return wrapper
+
+
+async def _in_thread(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+
+def _cache_namespace(pool, role_arn):
+    """
+    :return: The role ARN, or the account of the default credentials, so cached
+      responses and dimension values are never shared between identities
+    """
+    return role_arn or pool.account_id()
+
+
+def _group_by_definition(dimension):
+    if dimension[-1] == "$":
+        return {"Type": "TAG", "Key": dimension[:-1]}
+    dim = dimension.upper()
     if dim in ("ACCOUNT", "ACCOUNTNAME"):
-        group_by = {"Type": "DIMENSION", "Key": "LINKED_ACCOUNT"}
-        r = ce.get_dimension_values(TimePeriod=time_period, Dimension="LINKED_ACCOUNT")
-        all_values = set(dv["Value"] for dv in r["DimensionValues"])
-        if dim == "ACCOUNTNAME":
-            value_map = dict(
-                (dv["Value"], dv["Attributes"]["description"])
-                for dv in r["DimensionValues"]
-            )
-        return group_by, all_values, value_map
+        return {"Type": "DIMENSION", "Key": "LINKED_ACCOUNT"}
+    return {"Type": "DIMENSION", "Key": dim}
 
-    else:
-        group_by = {"Type": "DIMENSION", "Key": dim}
-        r = ce.get_dimension_values(TimePeriod=time_period, Dimension=dim)
-        all_values = set(dv["Value"] for dv in r["DimensionValues"])
+
+def _get_dimension_values(ce, time_period, dimension):
+    # All DimensionValues, following NextPageToken
+    values = []
+    kwargs = dict(TimePeriod=time_period, Dimension=dimension)
+    while True:
+        r = ce.get_dimension_values(**kwargs)
+        values.extend(r["DimensionValues"])
+        if not r.get("NextPageToken"):
+            return values
+        kwargs["NextPageToken"] = r["NextPageToken"]
+
+
+def _get_tags(ce, time_period, tag_key):
+    # All Tags, following NextPageToken
+    tags = []
+    kwargs = dict(TimePeriod=time_period, TagKey=tag_key)
+    while True:
+        r = ce.get_tags(**kwargs)
+        tags.extend(r["Tags"])
+        if not r.get("NextPageToken"):
+            return tags
+        kwargs["NextPageToken"] = r["NextPageToken"]
+
+
+def _is_account_name(dimension):
+    return dimension[-1] != "$" and dimension.upper() == "ACCOUNTNAME"
+
+
+@timed("get_group_by")
+def _get_group_by(ce, time_period, dimension, catalogue=None, namespace=None):
+    """
+    Get the group by query for the given dimension
+    :param catalogue: Optional DimensionCatalogue to cache the values in
+    :param namespace: Catalogue namespace, e.g. the role ARN
+    :return (group by query, all values for the dimension, optional mapping of values to display names)
+    """
+    value_map = {}
+    group_by = _group_by_definition(dimension)
+    period = (time_period["Start"], time_period["End"])
+
+    def cached(fetch, *args):
+        if not catalogue:
+            return fetch(*args)
+        key = (namespace, group_by["Type"], group_by["Key"]) + period
+        return catalogue.get(key, partial(fetch, *args))
+
+    if group_by["Type"] == "TAG":
+        dim = group_by["Key"]
+        tags = cached(_get_tags, ce, time_period, dim)
+        all_values = set(f"{dim}${t}" for t in tags)
         return group_by, all_values, value_map
 
+    dimension_values = cached(_get_dimension_values, ce, time_period, group_by["Key"])
+    all_values = set(dv["Value"] for dv in dimension_values)
+    if _is_account_name(dimension):
+        value_map = dict(
+            (dv["Value"], dv["Attributes"]["description"]) for dv in dimension_values
+        )
+    return group_by, all_values, value_map
+
 
 def _get_filter(regions, exclude_types, include_types):
     filter_count = 0
@@ -101,7 +218,84 @@ def _get_filter(regions, exclude_types, include_types):
     return filter
 
 
-def costs_for_regions(
+def split_time_period(time_period, *, months=None, days=None):
+    """
+    Split a time period into consecutive windows
+
+    :param months: Split on calendar month boundaries, every this many months
+    :param days: Split every this many days
+    :return: List of time periods covering the original period in order
+    """
+    if bool(months) == bool(days):
+        raise ValueError("Exactly one of months or days is required")
+    start = datetime.fromisoformat(time_period["Start"]).date()
+    end = datetime.fromisoformat(time_period["End"]).date()
+
+    windows = []
+    while start < end:
+        if months:
+            window_end = _add_months(start, months)
+        else:
+            window_end = start + timedelta(days=days)
+        window_end = min(window_end, end)
+        windows.append({"Start": start.isoformat(), "End": window_end.isoformat()})
+        start = window_end
+    return windows
+
+
+def _hourly_time_period(time_period):
+    # HOURLY queries need times as well as dates
+    return {k: v if "T" in v else f"{v}T00:00:00Z" for (k, v) in time_period.items()}
+
+
+def iter_cost_and_usage(ce, **kwargs):
+    """
+    Call get_cost_and_usage, following NextPageToken
+
+    :return: Iterator over ResultsByTime, yielded as each page is received.
+      A period may be split over more than one page.
+    """
+    while True:
+        # print(f"get_cost_and_usage({kwargs})")
+        r = ce.get_cost_and_usage(**kwargs)
+        yield from r["ResultsByTime"]
+        if not r.get("NextPageToken"):
+            break
+        kwargs = dict(kwargs, NextPageToken=r["NextPageToken"])
+
+
+def _get_cost_and_usage_results(ce, kwargs):
+    return list(iter_cost_and_usage(ce, **kwargs))
+
+
+def _iter_window_results(ce, kwargs, windows, max_workers):
+    # Query up to max_workers windows concurrently, yielding results in order
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for tp in windows:
+            pending.append(
+                executor.submit(
+                    _get_cost_and_usage_results, ce, dict(kwargs, TimePeriod=tp)
+                )
+            )
+            if len(pending) >= max_workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+@timed("fetch")
+def _fetch_results(results):
+    return list(results)
+
+
+@timed("fetch")
+def _fetch_frame(results):
+    # Lazy results are fetched as the frame is built
+    return CostFrame.from_results(results)
+
+
+async def costs_for_regions_async(
     *,
     time_period,
     granularity,
@@ -111,21 +305,54 @@ def costs_for_regions(
     group2,
     exclude_types,
     include_types,
+    cache=None,
+    cache_namespace=None,
+    window_months=None,
+    window_days=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    lazy=False,
+    ce=None,
+    catalogue=None,
+    metrics=None,
 ):
-    if session:
-        ce = session.client("ce")
-    else:
-        ce = boto3.client("ce")
+    """
+    Query Cost Explorer
+
+    The dimension lookups and the cost query are independent so they run
+    concurrently in threads.
 
-    group_by1, all_values1, value_map1 = _get_group_by(ce, time_period, group1)
-    group_by2, all_values2, value_map2 = _get_group_by(ce, time_period, group2)
+    :param ce: Cost Explorer client, if not set one is created from session, or
+      taken from the default clients.ClientPool
+    :param catalogue: DimensionCatalogue for caching dimension values and tags
+    :param metrics: Metrics to get, default [DEFAULT_COST_TYPE]
+
+    If window_months or window_days is set the time period is split into windows
+    which are queried concurrently, and the results joined in order.
+    Daily windows don't align with monthly results so they require DAILY granularity.
+    HOURLY queries are always split into windows of at most HOURLY_WINDOW_DAYS.
+
+    If lazy is True results is an iterator that fetches pages as they are consumed
+    instead of a list.
+    """
+    if window_days and granularity == "MONTHLY":
+        raise ValueError("window_days can't be used with MONTHLY granularity")
+    if granularity == "HOURLY":
+        if window_months:
+            raise ValueError("window_months can't be used with HOURLY granularity")
+        window_days = min(window_days or HOURLY_WINDOW_DAYS, HOURLY_WINDOW_DAYS)
+
+    if ce is None:
+        if session:
+            ce = session.client("ce")
+        else:
+            ce = get_default_client_pool().client("ce")
+    if cache:
+        ce = cache.wrap(ce, namespace=cache_namespace)
 
-    r = None
-    results = []
     kwargs = dict(
         Granularity=granularity,
-        GroupBy=[group_by1, group_by2],
-        Metrics=["UnblendedCost"],
+        GroupBy=[_group_by_definition(group1), _group_by_definition(group2)],
+        Metrics=list(metrics or [DEFAULT_COST_TYPE]),
         TimePeriod=time_period,
     )
 
@@ -133,65 +360,204 @@ def costs_for_regions(
     if filter:
         kwargs["Filter"] = filter
 
-    while not r or "NextPageToken" in r:
-        # print(f"get_cost_and_usage({kwargs})")
-        r = ce.get_cost_and_usage(**kwargs)
-        results.extend(r["ResultsByTime"])
+    if window_months or window_days:
+        windows = split_time_period(time_period, months=window_months, days=window_days)
+    else:
+        windows = [time_period]
+    if granularity == "HOURLY":
+        windows = [_hourly_time_period(tp) for tp in windows]
+
+    if len(windows) > 1:
+        results = _iter_window_results(ce, kwargs, windows, max_workers)
+    else:
+        results = iter_cost_and_usage(ce, **dict(kwargs, TimePeriod=windows[0]))
+
+    tasks = [
+        _in_thread(_get_group_by, ce, time_period, group1, catalogue, cache_namespace),
+        _in_thread(_get_group_by, ce, time_period, group2, catalogue, cache_namespace),
+    ]
+    if not lazy:
+        tasks.append(_in_thread(_fetch_results, results))
+    outputs = await asyncio.gather(*tasks)
+    _, all_values1, value_map1 = outputs[0]
+    _, all_values2, value_map2 = outputs[1]
+    if not lazy:
+        results = outputs[2]
 
     return results, all_values1, all_values2, value_map1, value_map2
 
 
-def costs_to_table(*, results, group1, all_values1, all_values2, cost_type):
-    # results will have one group per day/month
-    all_values2_sorted = sorted(all_values2)
+costs_for_regions = _sync(costs_for_regions_async, "costs_for_regions")
 
-    header = [group1] + all_values2_sorted + ["TOTAL"]
-    costs = [[0] * len(header) for _ in range(len(all_values1))]
 
-    for result in results:
-        g1_g2_map = {}
-        for g in result["Groups"]:
-            # [group1, group2]
-            if g["Metrics"][cost_type]["Unit"] != EXPECTED_UNIT:
-                raise RuntimeError(
-                    f"Unexpected unit: {g['Metrics'][cost_type]['Unit']}"
-                )
-            g1_g2_map[tuple(g["Keys"])] = g["Metrics"][cost_type]["Amount"]
+def _expected_unit(metric):
+    # Usage metrics are in the units of each service
+    if metric in USAGE_METRICS:
+        return None
+    return EXPECTED_UNIT
+
+
+@timed("pivot")
+def costs_to_table(
+    *, results, group1, all_values1, all_values2, cost_type, dense=False, metrics=None
+):
+    """
+    Pivot results into a table with one row per group1 value and one column per group2 value
 
-        for g1_i, g1 in enumerate(sorted(all_values1)):
-            if costs[g1_i][0]:
-                if costs[g1_i][0] != g1:
-                    raise Exception(f"Error: {costs[g1_i][0]} != {g1}")
+    The costs of merged multi-role results are summed over all payers, use
+    costs_to_flat(payer=True) to keep them apart.
+
+    :param results: ResultsByTime or a CostFrame
+    :param dense: Accumulate costs in a NumPy array instead of a sparse dict
+    :param metrics: If set there is a block of group2 and TOTAL columns for each
+      metric instead of just cost_type, with the metric in brackets in the header.
+      results must be a list or CostFrame.
+    :return: (header, costs)
+    """
+    if metrics:
+        header = [group1]
+        costs = None
+        for metric in metrics:
+            metric_header, metric_costs = costs_to_table(
+                results=results,
+                group1=group1,
+                all_values1=all_values1,
+                all_values2=all_values2,
+                cost_type=metric,
+                dense=dense,
+            )
+            header.extend(f"{h} ({metric})" for h in metric_header[1:])
+            if costs is None:
+                costs = metric_costs
             else:
-                costs[g1_i][0] = g1
-            for g2_i, g2 in enumerate(all_values2_sorted):
-                try:
-                    c = float(g1_g2_map[(g1, g2)])
-                    costs[g1_i][g2_i + 1] += c
-                    costs[g1_i][-1] += c
-                except KeyError:
-                    pass
+                for row, metric_row in zip(costs, metric_costs):
+                    row.extend(metric_row[1:])
+        return header, costs
 
-    return header, costs
+    pivot = CostPivot(all_values1, all_values2, dense=dense)
+    if isinstance(results, CostFrame):
+        pivot.add_frame(results, cost_type, _expected_unit(cost_type))
+    else:
+        pivot.add_results(results, cost_type, _expected_unit(cost_type))
+    return pivot.to_table(group1)
+
+
+def _frame_to_table(header, costs, group1):
+    # format_message_* and costs_to_csv accept a CostFrame instead of a table
+    if not isinstance(costs, CostFrame):
+        return header, costs
+    cost_type = DEFAULT_COST_TYPE
+    if cost_type not in costs.amounts:
+        cost_type = next(iter(costs.amounts), cost_type)
+    return costs_to_table(
+        results=costs,
+        group1=group1,
+        all_values1=costs.labels1,
+        all_values2=costs.labels2,
+        cost_type=cost_type,
+    )
 
 
-def costs_to_flat(*, results, group1, group2, cost_type):
-    # Unpivoted/flat table with columns, no aggregation is done
-    header = ["START", "END", group1, group2, "COST"]
-    flat_costs = []
+def _iter_frame_flat(frame, metrics, payer):
+    for metric in metrics:
+        expected_unit = _expected_unit(metric)
+        unit = expected_unit and frame.unit(metric)
+        if unit is not None and unit != expected_unit:
+            raise RuntimeError(f"Unexpected unit: {unit}")
+    periods = frame.periods
+    labels1 = frame.labels1
+    labels2 = frame.labels2
+    amounts = zip(*(frame.iter_amounts(m) for m in metrics))
+    rows = zip(frame.period, frame.key1, frame.key2, amounts)
+    if payer:
+        payers = frame.payers or [None]
+        codes = frame.payer if frame.payer is not None else repeat(0)
+        for c, (p, k1, k2, costs) in zip(codes, rows):
+            yield (payers[c],) + periods[p] + (labels1[k1], labels2[k2]) + costs
+    else:
+        for p, k1, k2, costs in rows:
+            yield periods[p] + (labels1[k1], labels2[k2]) + costs
+
 
+def iter_costs_flat(
+    *, results, cost_type, payer=False, metrics=None, amount_type=float
+):
+    """
+    Iterate over unpivoted rows (start, end, group1, group2, cost) as results are consumed
+
+    :param results: ResultsByTime or a CostFrame
+    :param payer: Prefix each row with the payer of merged multi-role results
+    :param metrics: If set rows end with a value for each metric instead of cost_type
+    :param amount_type: Converts each Amount string, e.g. decimal.Decimal to keep
+      every digit. A CostFrame already holds floats so it's ignored.
+    """
+    metrics = metrics or [cost_type]
+    if isinstance(results, CostFrame):
+        yield from _iter_frame_flat(results, metrics, payer)
+        return
+    if len(metrics) > 1:
+        yield from _iter_results_flat(results, metrics, payer, amount_type)
+        return
+    metric = metrics[0]
+    expected_unit = _expected_unit(metric)
     for result in results:
+        start = result["TimePeriod"]["Start"]
+        end = result["TimePeriod"]["End"]
+        prefix = (result.get("Payer"),) if payer else ()
         for g in result["Groups"]:
-            if g["Metrics"][cost_type]["Unit"] != EXPECTED_UNIT:
-                raise RuntimeError(
-                    f"Unexpected unit: {g['Metrics'][cost_type]['Unit']}"
-                )
+            m = g["Metrics"][metric]
+            if expected_unit and m["Unit"] != expected_unit:
+                raise RuntimeError(f"Unexpected unit: {m['Unit']}")
+            g1, g2 = g["Keys"]
+            yield prefix + (start, end, g1, g2, amount_type(m["Amount"]))
+
+
+def _iter_results_flat(results, metrics, payer, amount_type):
+    expected_units = [_expected_unit(m) for m in metrics]
+    for result in results:
+        start = result["TimePeriod"]["Start"]
+        end = result["TimePeriod"]["End"]
+        prefix = (result.get("Payer"),) if payer else ()
+        for g in result["Groups"]:
+            costs = []
+            for metric, expected_unit in zip(metrics, expected_units):
+                m = g["Metrics"][metric]
+                if expected_unit and m["Unit"] != expected_unit:
+                    raise RuntimeError(f"Unexpected unit: {m['Unit']}")
+                costs.append(amount_type(m["Amount"]))
             g1, g2 = g["Keys"]
-            start = result["TimePeriod"]["Start"]
-            end = result["TimePeriod"]["End"]
-            cost = float(g["Metrics"][cost_type]["Amount"])
-            flat_costs.append((start, end, g1, g2, cost))
+            yield prefix + (start, end, g1, g2) + tuple(costs)
 
+
+def costs_to_flat(
+    *,
+    results,
+    group1,
+    group2,
+    cost_type,
+    lazy=False,
+    payer=False,
+    metrics=None,
+    amount_type=float,
+):
+    """
+    Unpivoted/flat table with columns, no aggregation is done
+
+    :param metrics: If set there is a column for each metric instead of COST
+    :param amount_type: See iter_costs_flat
+    """
+    header = ["START", "END", group1, group2] + (metrics or ["COST"])
+    if payer:
+        header = ["PAYER"] + header
+    flat_costs = iter_costs_flat(
+        results=results,
+        cost_type=cost_type,
+        payer=payer,
+        metrics=metrics,
+        amount_type=amount_type,
+    )
+    if not lazy:
+        flat_costs = list(flat_costs)
     return header, flat_costs
 
 
@@ -201,77 +567,108 @@ def _assert_header(header):
 
 
 def _assert_output(output):
-    if output not in ("md", "html"):
+    if output not in RENDERERS:
         raise ValueError(f"Invalid output type: {output}")
 
 
-def format_message_summarise(header, group1, costs, output_format="md"):
+@timed("render")
+def write_message_summarise(
+    file, header, group1, costs, output_format="md", max_bytes=None
+):
+    """
+    Write the total cost for each group1 value to file as it's rendered
+
+    :param output_format: md, html or csv
+    :param max_bytes: If set only the highest totals that fit in this many bytes
+      are written, the rest are combined into an "Other (k items)" row
+    """
     _assert_output(output_format)
+    header, costs = _frame_to_table(header, costs, group1)
     _assert_header(header)
-    costs_dsc = sorted(costs, key=lambda r: r[-1], reverse=True)
-
-    sum_total = 0
-    md_rows = ""
-    for row in costs_dsc:
-        sum_total += row[-1]
-        if output_format == "md":
-            r = f"|{row[0]}|{row[-1]:.2f}|\n"
-        else:
-            r = f"<tr><td>{row[0]}</td><td>{row[-1]:.2f}</td></tr>\n"
-        md_rows += r
-    if output_format == "md":
-        msg = (
-            f"## Totals: {EXPECTED_UNIT} {sum_total:.2f}\n\n"
-            f"|{group1}|Total|\n|-|-|\n{md_rows}"
-        )
-    else:
-        msg = (
-            f"<h2>Totals: {EXPECTED_UNIT} {sum_total:.2f}</h2>\n"
-            "<table>\n"
-            f"<tr><th>{group1}</th><th>Total</th></tr>\n"
-            f"{md_rows}"
-            "</table>\n"
-        )
-    return msg
+    write_summary(
+        get_renderer(output_format, file),
+        header,
+        group1,
+        costs,
+        EXPECTED_UNIT,
+        max_bytes,
+    )
 
 
-def format_message_all(header, costs, group1, group2, exclude_zero, output_format="md"):
+@timed("render")
+def write_message_all(
+    file, header, costs, group1, group2, exclude_zero, output_format="md"
+):
+    """
+    Write the group2 costs for each group1 value to file as they're rendered
+
+    :param output_format: md, html or csv
+    """
     _assert_output(output_format)
+    header, costs = _frame_to_table(header, costs, group1)
     _assert_header(header)
+    write_all(
+        get_renderer(output_format, file), header, costs, group1, group2, exclude_zero
+    )
 
-    costs_g1 = sorted(costs, key=lambda r: r[0])
 
-    m = ""
-    for row in costs_g1:
-        if output_format == "md":
-            m += f"## {row[0]}\n\n"
-            m += f"|{group2}|Cost|\n|-|-|\n"
-        else:
-            m += f"<h2>{row[0]}</h2>\n"
-            m += "<table>\n"
-            m += f"<tr><th>{group2}</th><th>Cost</th></tr>\n"
-        for g2, cost in zip(header[1:-1], row[1:-1]):
-            if not (exclude_zero and cost == 0):
-                if output_format == "md":
-                    m += f"|{g2}|{cost:.2f}|\n"
-                else:
-                    m += f"<tr><td>{g2}</td><td>{cost:.2f}</td></tr>\n"
-        if output_format == "md":
-            m += "\n"
-        else:
-            m += "</table>\n"
-    return m
+@timed("render")
+def write_message_budgeted(
+    file, header, costs, group1, group2, max_bytes, output_format="md"
+):
+    """
+    Write the summary, then the group2 costs of the highest cost group1 values
+    until the message is max_bytes long
+
+    :param output_format: md, html or csv
+    """
+    _assert_output(output_format)
+    header, costs = _frame_to_table(header, costs, group1)
+    _assert_header(header)
+    write_budgeted(
+        get_renderer(output_format, file),
+        header,
+        costs,
+        group1,
+        group2,
+        EXPECTED_UNIT,
+        max_bytes,
+    )
 
 
-def costs_to_csv(header, costs):
+def format_message_summarise(header, group1, costs, output_format="md", max_bytes=None):
     s = StringIO()
+    write_message_summarise(s, header, group1, costs, output_format, max_bytes)
+    return s.getvalue()
+
+
+def format_message_all(header, costs, group1, group2, exclude_zero, output_format="md"):
+    s = StringIO()
+    write_message_all(s, header, costs, group1, group2, exclude_zero, output_format)
+    return s.getvalue()
+
+
+@timed("write_csv")
+def costs_to_csv(header, costs, file=None):
+    """
+    Convert costs to CSV
+
+    :param costs: Rows, can be an iterator, or a CostFrame which is pivoted using
+      header[0] as the group1 name
+    :param file: If set write rows to this file as they are produced and return None,
+      otherwise return a string
+    """
+    if isinstance(costs, CostFrame):
+        header, costs = _frame_to_table(None, costs, header[0] if header else "")
+    s = file or StringIO()
     writer = csv.writer(s)
     writer.writerow(header)
     writer.writerows(costs)
-    return s.getvalue()
+    if not file:
+        return s.getvalue()
 
 
-def get_raw_cost_data(
+async def get_raw_cost_data_async(
     *,
     time_period,
     granularity,
@@ -282,30 +679,128 @@ def get_raw_cost_data(
     exclude_types,
     include_types,
     apply_value_mappings,
+    cache=None,
+    window_months=None,
+    window_days=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    lazy=False,
+    ledger=None,
+    client_pool=None,
+    catalogue=None,
+    frame=False,
+    local_rollup=False,
+    week_start=DEFAULT_WEEK_START,
+    fiscal_year_start=DEFAULT_FISCAL_YEAR_START,
+    metrics=None,
 ):
-    session = None
-    if role_arn:
-        # print(f"Assuming role {role_arn}")
-        sts = boto3.client("sts")
-        credentials = sts.assume_role(
-            RoleArn=role_arn, RoleSessionName="MsTeamsCostBot"
-        )["Credentials"]
-        session = boto3.Session(
-            aws_access_key_id=credentials["AccessKeyId"],
-            aws_secret_access_key=credentials["SecretAccessKey"],
-            aws_session_token=credentials["SessionToken"],
+    """
+    Get costs from Cost Explorer, or from ledger if set
+
+    :param granularity: HOURLY, DAILY or MONTHLY, or one of rollup.ROLLUP_GRANULARITIES
+      which are calculated from DAILY costs and returned as a CostFrame
+    :param role_arn: Role to assume, or a list of roles which are queried concurrently
+      and merged. A failure for one role is logged, the others are still returned.
+    :param client_pool: clients.ClientPool for reusing credentials and clients,
+      default is the shared pool
+    :param catalogue: catalogue.DimensionCatalogue for caching dimension values and tags,
+      default is the shared catalogue
+    :param frame: Return results as a CostFrame, built as pages are received
+      so the raw responses aren't all held in memory
+    :param local_rollup: Calculate MONTHLY costs from DAILY costs, e.g. to reuse
+      cached daily costs
+    :param week_start: First day of the week for WEEKLY, 0 is Monday
+    :param fiscal_year_start: First month of the fiscal year for FISCAL_YEARLY
+    :param metrics: Metrics to get in the same query, default [DEFAULT_COST_TYPE].
+      The ledger only has DEFAULT_COST_TYPE.
+    """
+    if isinstance(role_arn, (list, tuple)):
+        data, errors = await get_raw_cost_data_for_roles_async(
+            role_arns=role_arn,
+            time_period=time_period,
+            granularity=granularity,
+            regions=regions,
+            group1=group1,
+            group2=group2,
+            exclude_types=exclude_types,
+            include_types=include_types,
+            apply_value_mappings=apply_value_mappings,
+            cache=cache,
+            window_months=window_months,
+            window_days=window_days,
+            max_workers=max_workers,
+            ledger=ledger,
+            client_pool=client_pool,
+            catalogue=catalogue,
+            frame=frame,
+            local_rollup=local_rollup,
+            week_start=week_start,
+            fiscal_year_start=fiscal_year_start,
+            metrics=metrics,
+        )
+        for role, e in errors.items():
+            log.error(f"Failed to get costs for {role}: {e}")
+        if not data:
+            raise next(iter(errors.values()))
+        return merge_raw_cost_data(data)
+
+    rollup_granularity = None
+    if granularity in ROLLUP_GRANULARITIES or (
+        local_rollup and granularity == "MONTHLY"
+    ):
+        rollup_granularity = granularity
+        granularity = "DAILY"
+        frame = True
+
+    if ledger:
+        if metrics and list(metrics) != [DEFAULT_COST_TYPE]:
+            raise ValueError(f"The ledger only has {DEFAULT_COST_TYPE}")
+        results, all_values1, all_values2, value_map1, value_map2 = await _in_thread(
+            ledger.get_raw_cost_data,
+            time_period=time_period,
+            granularity=granularity,
+            role_arn=role_arn,
+            regions=regions,
+            group1=group1,
+            group2=group2,
+            exclude_types=exclude_types,
+            include_types=include_types,
+        )
+    else:
+        pool = client_pool or get_default_client_pool()
+        ce = await _in_thread(pool.client, "ce", role_arn=role_arn)
+        cache_namespace = await _in_thread(_cache_namespace, pool, role_arn)
+        results, all_values1, all_values2, value_map1, value_map2 = (
+            await costs_for_regions_async(
+                time_period=time_period,
+                granularity=granularity,
+                session=None,
+                ce=ce,
+                regions=regions,
+                group1=group1,
+                group2=group2,
+                exclude_types=exclude_types,
+                include_types=include_types,
+                cache=cache,
+                cache_namespace=cache_namespace,
+                window_months=window_months,
+                window_days=window_days,
+                max_workers=max_workers,
+                lazy=lazy or frame,
+                catalogue=catalogue or get_default_catalogue(),
+                metrics=metrics,
+            )
         )
 
-    results, all_values1, all_values2, value_map1, value_map2 = costs_for_regions(
-        time_period=time_period,
-        granularity=granularity,
-        session=session,
-        regions=regions,
-        group1=group1,
-        group2=group2,
-        exclude_types=exclude_types,
-        include_types=include_types,
-    )
+    if frame:
+        results = await _in_thread(_fetch_frame, results)
+    if rollup_granularity:
+        results = await _in_thread(
+            rollup,
+            results,
+            rollup_granularity,
+            week_start=week_start,
+            fiscal_year_start=fiscal_year_start,
+        )
 
     if apply_value_mappings:
         results, all_values1, all_values2 = _apply_value_mappings(
@@ -319,95 +814,268 @@ def get_raw_cost_data(
     return results, all_values1, all_values2, value_map1, value_map2
 
 
+get_raw_cost_data = _sync(get_raw_cost_data_async, "get_raw_cost_data")
+
+
+def payer_from_role_arn(role_arn):
+    """
+    Get the account ID from a role ARN, used to label merged multi-role results
+    """
+    if not role_arn:
+        return "default"
+    return role_arn.split(":")[4] or role_arn
+
+
+async def get_raw_cost_data_for_roles_async(
+    *, role_arns, max_workers=DEFAULT_MAX_WORKERS, **kwargs
+):
+    """
+    Call get_raw_cost_data concurrently for multiple roles
+
+    :param kwargs: Arguments for get_raw_cost_data
+    :return: (dict of role ARN to get_raw_cost_data output, dict of role ARN to exception)
+    """
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def get(role_arn):
+        async with semaphore:
+            return await get_raw_cost_data_async(
+                role_arn=role_arn, max_workers=max_workers, **kwargs
+            )
+
+    outputs = await asyncio.gather(
+        *(get(role_arn) for role_arn in role_arns), return_exceptions=True
+    )
+    data = {}
+    errors = {}
+    for role_arn, output in zip(role_arns, outputs):
+        if isinstance(output, Exception):
+            errors[role_arn] = output
+        else:
+            data[role_arn] = output
+    return data, errors
+
+
+get_raw_cost_data_for_roles = _sync(
+    get_raw_cost_data_for_roles_async, "get_raw_cost_data_for_roles"
+)
+
+
+def merge_raw_cost_data(data):
+    """
+    Merge the output of get_raw_cost_data_for_roles into a single get_raw_cost_data output
+
+    Each result is labelled with "Payer", the account ID of the role.
+    If the results are CostFrames they are concatenated into one CostFrame.
+    """
+    frames = [d[0] for d in data.values()]
+    if frames and all(isinstance(f, CostFrame) for f in frames):
+        results = CostFrame.concat(
+            f.with_payer(payer_from_role_arn(role_arn))
+            for (role_arn, f) in zip(data, frames)
+        )
+    else:
+        results = []
+    all_values1 = set()
+    all_values2 = set()
+    value_map1 = {}
+    value_map2 = {}
+    for role_arn, (r, v1, v2, m1, m2) in data.items():
+        if isinstance(results, list):
+            payer = payer_from_role_arn(role_arn)
+            for result in r:
+                result["Payer"] = payer
+                results.append(result)
+        all_values1.update(v1)
+        all_values2.update(v2)
+        value_map1.update(m1)
+        value_map2.update(m2)
+    return results, all_values1, all_values2, value_map1, value_map2
+
+
+@timed("apply_value_mappings")
 def _apply_value_mappings(*, results, all_values1, all_values2, value_map1, value_map2):
     """
     Apply value mappings to raw data
 
     This is mostly for accountname.
     The raw data will have the account number, so replace it with the account name (description).
+    If results is an iterator the mappings are applied as it's consumed.
+    If results is a CostFrame only its labels are mapped.
     """
-    if value_map1:
-        for result in results:
-            for g in result["Groups"]:
+
+    def map_keys(result):
+        for g in result["Groups"]:
+            if value_map1:
                 g["Keys"][0] = value_map1[g["Keys"][0]]
+            if value_map2:
+                g["Keys"][1] = value_map2[g["Keys"][1]]
+        return result
+
+    if isinstance(results, CostFrame):
+        results = results.relabel(value_map1, value_map2)
+    elif value_map1 or value_map2:
+        if isinstance(results, list):
+            for result in results:
+                map_keys(result)
+        else:
+            results = map(map_keys, results)
+    if value_map1:
         all_values1 = set(value_map1[v] for v in all_values1)
     if value_map2:
-        for result in results:
-            for g in result["Groups"]:
-                g["Keys"][1] = value_map2[g["Keys"][1]]
         all_values2 = set(value_map2[v] for v in all_values2)
     return results, all_values1, all_values2
 
 
-def create_costs_message(
+MESSAGE_OUTPUTS = ("auto", "summary", "full", "csv")
+
+
+def write_costs_message(
+    file,
     *,
-    time_period,
-    cost_type,
-    granularity,
-    role_arn,
-    regions,
-    title_prefix,
+    results,
     group1,
     group2,
-    exclude_types,
-    include_types,
+    all_values1,
+    all_values2,
+    cost_type,
     output,
     output_format,
+    metrics=None,
+    max_bytes=DEFAULT_MAX_MESSAGE_BYTES,
 ):
-    results, all_values1, all_values2, value_map1, value_map2 = get_raw_cost_data(
-        time_period=time_period,
-        granularity=granularity,
-        role_arn=role_arn,
-        regions=regions,
-        group1=group1,
-        group2=group2,
-        exclude_types=exclude_types,
-        include_types=include_types,
-        apply_value_mappings=True,
-    )
+    """
+    Write a message for results to file
 
+    :param results: ResultsByTime or a CostFrame, with value mappings applied
+    :param output: auto, summary, full or csv
+    :param metrics: For csv output, include columns for these metrics instead of cost_type
+    :param max_bytes: Size budget of auto output
+    """
+    if metrics and output != "csv":
+        raise ValueError(f"Multiple metrics aren't supported for {output} output")
     header, costs = costs_to_table(
         results=results,
         group1=group1,
         all_values1=all_values1,
         all_values2=all_values2,
         cost_type=cost_type,
+        metrics=metrics,
     )
 
-    summary = format_message_summarise(header, group1, costs, output_format)
-    full_costs_split = format_message_all(header, costs, group1, group2, output_format)
-
-    # Teams message length is limited, so default:
-    # - If this is a single AWS account show the summary and breakdown
-    # - If there are multiple AWS accounts and a tag is specified just show the tag breakdown combined over all accounts
-    # - Otherwise show the AWS account costs only
+    # Teams message length is limited, so show the summary and as many
+    # breakdowns of the highest cost group1 values as fit
     if output == "auto":
-        if len(all_values1) == 1 or len(all_values2) == 1:
-            message = summary + "\n---\n" + full_costs_split
-        else:
-            message = summary
+        write_message_budgeted(
+            file, header, costs, group1, group2, max_bytes, output_format
+        )
     elif output == "summary":
-        message = summary
+        write_message_summarise(file, header, group1, costs, output_format)
     elif output == "full":
-        message = full_costs_split
+        write_message_all(file, header, costs, group1, group2, True, output_format)
     elif output == "csv":
-        message = costs_to_csv(header, costs)
+        costs_to_csv(header, costs, file)
     else:
         raise ValueError(f"Invalid output: {output}")
 
+
+def costs_message_title(*, title_prefix, time_period, cost_type):
     days = (
         datetime.fromisoformat(time_period["End"])
         - datetime.fromisoformat(time_period["Start"])
     ).days
     if days > 1:
-        title = (
+        return (
             f"{title_prefix} {time_period['Start']} - {time_period['End']} {cost_type}"
         )
-    else:
-        weekday = datetime.strftime(datetime.fromisoformat(time_period["Start"]), "%A")
-        title = f"{title_prefix} {time_period['Start']} ({weekday}) {cost_type}"
+    weekday = datetime.strftime(datetime.fromisoformat(time_period["Start"]), "%A")
+    return f"{title_prefix} {time_period['Start']} ({weekday}) {cost_type}"
 
-    return message, title
+
+async def create_costs_message_async(
+    *,
+    time_period,
+    cost_type,
+    granularity,
+    role_arn,
+    regions,
+    title_prefix,
+    group1,
+    group2,
+    exclude_types,
+    include_types,
+    output,
+    output_format,
+    cache=None,
+    window_months=None,
+    window_days=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    ledger=None,
+    local_rollup=False,
+    week_start=DEFAULT_WEEK_START,
+    fiscal_year_start=DEFAULT_FISCAL_YEAR_START,
+    file=None,
+    max_bytes=DEFAULT_MAX_MESSAGE_BYTES,
+):
+    """
+    Create a markdown or HTML message
+
+    :param file: If set the message is written to this file as it's rendered and
+      None is returned in place of the message
+    :param max_bytes: Size budget of auto output
+    :return: (message, title)
+    """
+    if output not in MESSAGE_OUTPUTS:
+        raise ValueError(f"Invalid output: {output}")
+    _assert_output(output_format)
+
+    results, all_values1, all_values2, value_map1, value_map2 = (
+        await get_raw_cost_data_async(
+            time_period=time_period,
+            granularity=granularity,
+            role_arn=role_arn,
+            regions=regions,
+            group1=group1,
+            group2=group2,
+            exclude_types=exclude_types,
+            include_types=include_types,
+            apply_value_mappings=True,
+            cache=cache,
+            window_months=window_months,
+            window_days=window_days,
+            max_workers=max_workers,
+            ledger=ledger,
+            local_rollup=local_rollup,
+            week_start=week_start,
+            fiscal_year_start=fiscal_year_start,
+            frame=True,
+            metrics=[cost_type],
+        )
+    )
+
+    s = file or StringIO()
+    write_costs_message(
+        s,
+        results=results,
+        group1=group1,
+        group2=group2,
+        all_values1=all_values1,
+        all_values2=all_values2,
+        cost_type=cost_type,
+        output=output,
+        output_format=output_format,
+        max_bytes=max_bytes,
+    )
+
+    title = costs_message_title(
+        title_prefix=title_prefix, time_period=time_period, cost_type=cost_type
+    )
+    if file:
+        return None, title
+    return s.getvalue(), title
+
+
+create_costs_message = _sync(create_costs_message_async, "create_costs_message")
 
 
 def create_costs_plain_output(
@@ -422,7 +1090,30 @@ def create_costs_plain_output(
     exclude_types,
     include_types,
     output,
+    cache=None,
+    window_months=None,
+    window_days=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    ledger=None,
+    local_rollup=False,
+    week_start=DEFAULT_WEEK_START,
+    fiscal_year_start=DEFAULT_FISCAL_YEAR_START,
+    metrics=None,
+    file=None,
 ):
+    """
+    Create CSV output, or flat output in one of export.EXPORT_FORMATS
+
+    :param output: csv, flat, ndjson, parquet or arrow
+    :param metrics: If set get these metrics in one query and output columns for
+      each of them instead of cost_type
+    :param file: If set rows are written to this file as results are received
+      and None is returned, otherwise the output is returned as a string (bytes
+      for parquet and arrow). Parquet and arrow need a binary file.
+    """
+    if output not in ("csv", "flat") + EXPORT_FORMATS:
+        raise ValueError(f"Invalid output for plain output: {output}")
+
     results, all_values1, all_values2, value_map1, value_map2 = get_raw_cost_data(
         time_period=time_period,
         granularity=granularity,
@@ -433,6 +1124,18 @@ def create_costs_plain_output(
         exclude_types=exclude_types,
         include_types=include_types,
         apply_value_mappings=True,
+        cache=cache,
+        window_months=window_months,
+        window_days=window_days,
+        max_workers=max_workers,
+        ledger=ledger,
+        local_rollup=local_rollup,
+        week_start=week_start,
+        fiscal_year_start=fiscal_year_start,
+        lazy=True,
+        # The table is pivoted once per metric so it needs all the results
+        frame=bool(metrics) and output == "csv",
+        metrics=metrics or [cost_type],
     )
 
     if output == "csv":
@@ -442,18 +1145,25 @@ def create_costs_plain_output(
             all_values1=all_values1,
             all_values2=all_values2,
             cost_type=cost_type,
+            metrics=metrics,
         )
-    elif output == "flat":
+    else:
         header, costs = costs_to_flat(
             results=results,
             group1=group1,
             group2=group2,
             cost_type=cost_type,
+            lazy=True,
+            payer=isinstance(role_arn, (list, tuple)),
+            metrics=metrics,
+            # Exported amounts are decimals, so keep every digit of the Amount strings
+            amount_type=Decimal if output in EXPORT_FORMATS else float,
         )
-    else:
-        raise ValueError(f"Invalid output for plain output: {output}")
-    output = costs_to_csv(header, costs)
-    return output
+    if output in EXPORT_FORMATS:
+        return write_export(
+            file, header, costs, output, amounts=len(metrics or [cost_type])
+        )
+    return costs_to_csv(header, costs, file)
 
 
 def _str_to_date(s):
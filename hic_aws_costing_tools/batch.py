@@ -0,0 +1,338 @@
+"""
+Create multiple reports, querying Cost Explorer once for each distinct query
+
+Reports that differ only in how they're rendered (output, format, title) or in
+account vs account name grouping share the same get_cost_and_usage query.
+"""
+
+import asyncio
+import json
+import os
+from io import StringIO
+
+from .aws_costs import (
+    DEFAULT_COST_TYPE,
+    DEFAULT_EXCLUDE_RECORD_TYPES,
+    DEFAULT_GRANULARITY,
+    DEFAULT_INCLUDE_RECORD_TYPES,
+    DEFAULT_MAX_MESSAGE_BYTES,
+    DEFAULT_MAX_WORKERS,
+    MESSAGE_OUTPUTS,
+    _apply_value_mappings,
+    _assert_output,
+    _group_by_definition,
+    _is_account_name,
+    _sync,
+    costs_message_title,
+    costs_to_csv,
+    costs_to_flat,
+    get_raw_cost_data_async,
+    get_time_period,
+    write_costs_message,
+)
+from .export import EXPORT_FORMATS, EXPORT_WRITERS, write_export
+from .rollup import (
+    DEFAULT_FISCAL_YEAR_START,
+    DEFAULT_WEEK_START,
+    ROLLUP_GRANULARITIES,
+    parse_week_start,
+    rollup,
+)
+
+REPORT_DEFAULTS = {
+    "name": None,
+    "start": None,
+    "end": None,
+    "granularity": DEFAULT_GRANULARITY,
+    "group1": "accountname",
+    "group2": "service",
+    "assume_role": None,
+    "regions": None,
+    "exclude_types": DEFAULT_EXCLUDE_RECORD_TYPES,
+    "include_types": DEFAULT_INCLUDE_RECORD_TYPES,
+    "cost_type": DEFAULT_COST_TYPE,
+    "metrics": None,
+    "output": "auto",
+    "format": "md",
+    "max_bytes": DEFAULT_MAX_MESSAGE_BYTES,
+    "title_prefix": "AWS costs",
+    "file": None,
+    "week_start": DEFAULT_WEEK_START,
+    "fiscal_year_start": DEFAULT_FISCAL_YEAR_START,
+}
+
+
+# Outputs with a row for each period and group
+FLAT_OUTPUTS = ("flat",) + EXPORT_FORMATS
+
+
+def _is_binary(output):
+    return output in EXPORT_WRITERS and EXPORT_WRITERS[output].binary
+
+
+def load_config(path):
+    """
+    Load a batch config from a JSON or YAML (.yaml, .yml) file
+
+    YAML requires PyYAML.
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError(
+                    "PyYAML is required for YAML config files, "
+                    "install hic-aws-costing-tools[yaml]"
+                )
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def report_specs(config):
+    """
+    Normalise a batch config
+
+    :param config: List of report dicts, or a dict with "reports" and optional
+      "defaults" which apply to every report. See REPORT_DEFAULTS for the keys.
+    :return: List of report dicts with defaults applied
+    """
+    if isinstance(config, dict):
+        defaults = config.get("defaults", {})
+        reports = config["reports"]
+    else:
+        defaults = {}
+        reports = config
+
+    specs = []
+    for n, report in enumerate(reports):
+        unknown = (set(defaults) | set(report)) - set(REPORT_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown report keys: {sorted(unknown)}")
+        spec = dict(REPORT_DEFAULTS, **defaults, **report)
+        if spec["name"] is None:
+            spec["name"] = f"report-{n + 1}"
+        if spec["output"] not in MESSAGE_OUTPUTS + FLAT_OUTPUTS:
+            raise ValueError(f"Invalid output for {spec['name']}: {spec['output']}")
+        if _is_binary(spec["output"]) and not spec["file"]:
+            raise ValueError(f"{spec['output']} output requires a file: {spec['name']}")
+        _assert_output(spec["format"])
+        if spec["metrics"] and spec["output"] not in ("csv",) + FLAT_OUTPUTS:
+            raise ValueError(f"metrics requires csv or flat output: {spec['name']}")
+        spec["granularity"] = spec["granularity"].upper().replace("-", "_")
+        spec["week_start"] = parse_week_start(spec["week_start"])
+        if isinstance(spec["assume_role"], list):
+            spec["assume_role"] = tuple(spec["assume_role"])
+        spec["time_period"] = get_time_period(
+            startdate=spec["start"], enddate=spec["end"]
+        )
+        specs.append(spec)
+    return specs
+
+
+def _fetch_dimension(dimension):
+    # Account IDs and names come from the same query, always fetch the names
+    if _group_by_definition(dimension)["Key"] == "LINKED_ACCOUNT":
+        return "accountname"
+    return dimension
+
+
+def plan_queries(specs, *, merge_accounts=True):
+    """
+    Find the distinct Cost Explorer queries needed for a list of reports
+
+    Rollup granularities use a DAILY query, and MONTHLY reports are calculated
+    from a DAILY query if there is one for the same costs. Reports with different
+    metrics share a query which gets all of them.
+
+    :param specs: Output of report_specs
+    :param merge_accounts: Use the same query for account and accountname. Ledger
+      datasets are stored by group name so this must be False for a ledger.
+    :return: List of (get_raw_cost_data kwargs, list of indices of specs using it)
+    """
+    fetch_dimension = _fetch_dimension if merge_accounts else str
+    queries = {}
+    for n, spec in enumerate(specs):
+        granularity = spec["granularity"]
+        if granularity in ROLLUP_GRANULARITIES:
+            granularity = "DAILY"
+        query = dict(
+            time_period=spec["time_period"],
+            granularity=granularity,
+            role_arn=spec["assume_role"],
+            regions=spec["regions"],
+            group1=fetch_dimension(spec["group1"]),
+            group2=fetch_dimension(spec["group2"]),
+            exclude_types=spec["exclude_types"],
+            include_types=spec["include_types"],
+        )
+        metrics = spec["metrics"] or [spec["cost_type"]]
+        key = query
+        if merge_accounts:
+            key = dict(
+                query,
+                group1=_group_by_definition(query["group1"]),
+                group2=_group_by_definition(query["group2"]),
+            )
+        key = (json.dumps(dict(key, granularity=None), sort_keys=True), granularity)
+        if key not in queries:
+            queries[key] = (dict(query, metrics=[]), [])
+        _add_metrics(queries[key][0], metrics)
+        queries[key][1].append(n)
+
+    for key in list(queries):
+        daily = queries.get((key[0], "DAILY"))
+        if key[1] == "MONTHLY" and daily:
+            query, indices = queries.pop(key)
+            _add_metrics(daily[0], query["metrics"])
+            daily[1].extend(indices)
+            daily[1].sort()
+    return list(queries.values())
+
+
+def _add_metrics(query, metrics):
+    for m in metrics:
+        if m not in query["metrics"]:
+            query["metrics"].append(m)
+
+
+def _write_report(file, spec, data, query_granularity):
+    results, all_values1, all_values2, value_map1, value_map2 = data
+    # Periods are only shown in flat output, the other outputs are totals
+    if spec["output"] in FLAT_OUTPUTS and spec["granularity"] != query_granularity:
+        results = rollup(
+            results,
+            spec["granularity"],
+            week_start=spec["week_start"],
+            fiscal_year_start=spec["fiscal_year_start"],
+        )
+    # The query always fetches account names, only use them if requested
+    results, all_values1, all_values2 = _apply_value_mappings(
+        results=results,
+        all_values1=all_values1,
+        all_values2=all_values2,
+        value_map1=value_map1 if _is_account_name(spec["group1"]) else {},
+        value_map2=value_map2 if _is_account_name(spec["group2"]) else {},
+    )
+    if spec["output"] in FLAT_OUTPUTS:
+        header, costs = costs_to_flat(
+            results=results,
+            group1=spec["group1"],
+            group2=spec["group2"],
+            cost_type=spec["cost_type"],
+            lazy=True,
+            payer=isinstance(spec["assume_role"], tuple),
+            metrics=spec["metrics"],
+        )
+        if spec["output"] == "flat":
+            costs_to_csv(header, costs, file)
+        else:
+            metrics = spec["metrics"] or [spec["cost_type"]]
+            write_export(file, header, costs, spec["output"], amounts=len(metrics))
+    else:
+        write_costs_message(
+            file,
+            results=results,
+            group1=spec["group1"],
+            group2=spec["group2"],
+            all_values1=all_values1,
+            all_values2=all_values2,
+            cost_type=spec["cost_type"],
+            output=spec["output"],
+            output_format=spec["format"],
+            metrics=spec["metrics"],
+            max_bytes=spec["max_bytes"],
+        )
+
+
+def _write_report_file(spec, data, query_granularity):
+    # Written to a temporary file first so a failure doesn't leave a partial report
+    path = spec["file"]
+    if _is_binary(spec["output"]):
+        f = open(path + ".tmp", "wb")
+    else:
+        f = open(path + ".tmp", "w", newline="")
+    try:
+        with f:
+            _write_report(f, spec, data, query_granularity)
+        os.replace(path + ".tmp", path)
+    except BaseException:
+        os.remove(path + ".tmp")
+        raise
+
+
+async def run_batch_async(
+    config,
+    *,
+    cache=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    ledger=None,
+    client_pool=None,
+    catalogue=None,
+):
+    """
+    Create all reports in a batch config
+
+    Distinct queries are run concurrently, up to max_workers at a time. A failed
+    query only fails the reports that use it.
+
+    :param config: Batch config, see report_specs
+    :return: List of dicts with name, title, and either message (the report, or
+      None if it was written to the report's file) or error (the exception)
+    """
+    specs = report_specs(config)
+    queries = plan_queries(specs, merge_accounts=ledger is None)
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def fetch(query):
+        async with semaphore:
+            return await get_raw_cost_data_async(
+                **query,
+                apply_value_mappings=False,
+                cache=cache,
+                max_workers=max_workers,
+                ledger=ledger,
+                client_pool=client_pool,
+                catalogue=catalogue,
+                frame=True,
+            )
+
+    outputs = await asyncio.gather(
+        *(fetch(query) for (query, _) in queries), return_exceptions=True
+    )
+    data = {}
+    for (query, indices), output in zip(queries, outputs):
+        for n in indices:
+            data[n] = (output, query["granularity"])
+
+    reports = []
+    for n, spec in enumerate(specs):
+        report = {
+            "name": spec["name"],
+            "title": costs_message_title(
+                title_prefix=spec["title_prefix"],
+                time_period=spec["time_period"],
+                cost_type=spec["cost_type"],
+            ),
+        }
+        output, query_granularity = data[n]
+        if isinstance(output, Exception):
+            report["error"] = output
+            reports.append(report)
+            continue
+        # A report that fails to render doesn't stop the others
+        try:
+            if spec["file"]:
+                _write_report_file(spec, output, query_granularity)
+                report["message"] = None
+            else:
+                s = StringIO()
+                _write_report(s, spec, output, query_granularity)
+                report["message"] = s.getvalue()
+        except Exception as e:
+            report["error"] = e
+        reports.append(report)
+    return reports
+
+
+run_batch = _sync(run_batch_async, "run_batch")
@@ -0,0 +1,202 @@
+"""
+Record AWS API calls to a bundle file, and replay them without AWS access
+
+A bundle is a gzip compressed text file with a header line followed by one line
+per call:
+
+    <request key>\\t<operation>\\t<request JSON>\\t<response JSON>
+
+The request key is cache.request_key() of the operation and request, namespaced
+by the service, role ARN and region of the client. JSON never contains a raw tab
+so loading a bundle only splits each line, and responses are parsed when they're
+replayed. This keeps loading large bundles fast and memory bounded by the size of
+the response text.
+"""
+
+import gzip
+import json
+import threading
+from functools import partial
+
+from .cache import CACHED_OPERATIONS, request_key
+
+BUNDLE_FORMAT = "hic-aws-costing-tools-bundle"
+BUNDLE_VERSION = 1
+# AssumeRole isn't recorded so bundles never contain credentials
+RECORDED_OPERATIONS = CACHED_OPERATIONS
+
+
+def _namespace(service, role_arn, region):
+    return [service, role_arn, region]
+
+
+class BundleRecorder:
+    """
+    Thread-safe writer of calls to a bundle file
+    """
+
+    def __init__(self, path, *, compresslevel=6):
+        self.path = path
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._f = gzip.open(path, "wt", encoding="utf-8", compresslevel=compresslevel)
+        self._f.write(
+            json.dumps({"format": BUNDLE_FORMAT, "version": BUNDLE_VERSION}) + "\n"
+        )
+
+    def record(self, namespace, operation, request, response):
+        response = {k: v for (k, v) in response.items() if k != "ResponseMetadata"}
+        key = request_key(operation, request, namespace)
+        line = "\t".join(
+            (
+                key,
+                operation,
+                json.dumps(
+                    {
+                        "namespace": namespace,
+                        "operation": operation,
+                        "request": request,
+                    },
+                    default=str,
+                ),
+                json.dumps(response, default=str),
+            )
+        )
+        with self._lock:
+            self._f.write(line + "\n")
+            self.calls += 1
+
+    def call(self, method, namespace, operation, **kwargs):
+        response = method(**kwargs)
+        self.record(namespace, operation, kwargs, response)
+        return response
+
+    def wrap(self, client, *, service, role_arn=None, region=None):
+        return RecordingClient(client, self, _namespace(service, role_arn, region))
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+
+class RecordingClient:
+    """
+    Wraps a boto3 client, recording RECORDED_OPERATIONS to a BundleRecorder
+    """
+
+    def __init__(self, client, recorder, namespace):
+        self._client = client
+        self._recorder = recorder
+        self._namespace = namespace
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in RECORDED_OPERATIONS:
+            return partial(self._recorder.call, attr, self._namespace, name)
+        return attr
+
+
+class Bundle:
+    """
+    Recorded responses loaded from a bundle file
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Bundle file. A bundle truncated by an interrupted recording
+          is loaded up to the last complete call.
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._responses = {}
+        self._lock = threading.Lock()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("format") != BUNDLE_FORMAT:
+                raise ValueError(f"Not a bundle file: {path}")
+            if header["version"] > BUNDLE_VERSION:
+                raise ValueError(f"Unsupported bundle version: {header['version']}")
+            try:
+                for line in f:
+                    parts = line.split("\t")
+                    # The last line of a truncated bundle may be incomplete
+                    if len(parts) == 4 and line.endswith("\n"):
+                        self._responses[parts[0]] = (parts[1], parts[3][:-1])
+            except EOFError:
+                pass
+
+    def __len__(self):
+        return len(self._responses)
+
+    def get(self, namespace, operation, request):
+        """
+        :return: A new copy of the recorded response
+        """
+        recorded = self._responses.get(request_key(operation, request, namespace))
+        with self._lock:
+            if recorded is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if recorded is None:
+            raise LookupError(
+                f"{operation} not recorded in bundle {self.path} for "
+                f"{namespace}: {json.dumps(request, default=str)}"
+            )
+        return json.loads(recorded[1])
+
+    def responses(self, operation):
+        """
+        :return: Iterator of the recorded responses to operation
+        """
+        for recorded_operation, response in self._responses.values():
+            if recorded_operation == operation:
+                yield json.loads(response)
+
+    def call(self, namespace, operation, **kwargs):
+        return self.get(namespace, operation, kwargs)
+
+    def client(self, service, *, role_arn=None, region=None):
+        return ReplayClient(self, _namespace(service, role_arn, region))
+
+
+class ReplayClient:
+    """
+    Stand-in for a boto3 client that serves calls from a Bundle
+    """
+
+    def __init__(self, bundle, namespace):
+        self._bundle = bundle
+        self._namespace = namespace
+
+    def __getattr__(self, name):
+        if name not in RECORDED_OPERATIONS:
+            raise AttributeError(f"{name} can't be replayed")
+        return partial(self._bundle.call, self._namespace, name)
+
+
+class ReplayClientPool:
+    """
+    Replacement for clients.ClientPool that replays a Bundle
+
+    Roles aren't assumed, so no AWS credentials are needed.
+    """
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+
+    def client(self, service, *, role_arn=None, region=None):
+        return self.bundle.client(service, role_arn=role_arn, region=region)
+
+    def account_id(self):
+        return None
+
+    def rate_limit_stats(self):
+        return {}
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,172 @@
+"""
+Persistent on-disk cache for Cost Explorer responses
+
+Responses are stored in a SQLite database keyed on a hash of the full request,
+so the cache can be shared between processes (SQLite handles the locking).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+from functools import partial
+
+from . import instrument
+
+CACHED_OPERATIONS = ("get_cost_and_usage", "get_dimension_values", "get_tags")
+# Costs for recent days may be restated by AWS, so these are only cached for a
+# limited time. Anything that ended before this window is treated as permanent.
+DEFAULT_RESTATEMENT_DAYS = 3
+DEFAULT_RECENT_TTL_SECONDS = 6 * 3600
+CACHE_FILENAME = "responses.sqlite3"
+
+
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "hic-aws-costing-tools")
+
+
+def _strip_metadata(response):
+    return {k: v for (k, v) in response.items() if k != "ResponseMetadata"}
+
+
+def request_key(operation, request, namespace=None):
+    """
+    Content address for a request
+    :param namespace: Distinguishes identical requests made with different credentials, e.g. the role ARN
+    """
+    body = json.dumps(
+        {"namespace": namespace, "operation": operation, "request": request},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        cache_dir,
+        *,
+        refresh=False,
+        restatement_days=DEFAULT_RESTATEMENT_DAYS,
+        recent_ttl=DEFAULT_RECENT_TTL_SECONDS,
+    ):
+        """
+        :param cache_dir: Directory for the cache database, created if necessary
+        :param refresh: Ignore existing entries, but still store new responses
+        :param restatement_days: Days after the end of a month until its costs are
+          final. Requests ending before then, i.e. in an open billing month, expire
+          after recent_ttl seconds, other requests are cached permanently.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILENAME)
+        self.refresh = refresh
+        self.restatement_days = restatement_days
+        self.recent_ttl = recent_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, operation TEXT, expires REAL, response TEXT)"
+            )
+            db.execute(
+                "DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?",
+                (time.time(),),
+            )
+
+    @contextmanager
+    def _connect(self):
+        # A new connection per transaction so the cache can be used from multiple threads
+        with closing(sqlite3.connect(self.path, timeout=60)) as db:
+            with db:
+                yield db
+
+    def _expires(self, request, now, today=None):
+        try:
+            end = datetime.fromisoformat(request["TimePeriod"]["End"][:10]).date()
+        except (KeyError, TypeError, ValueError):
+            return now + self.recent_ttl
+        # Costs may be restated until the billing month is closed
+        today = today or datetime.now().date()
+        closed = (today - timedelta(days=self.restatement_days)).replace(day=1)
+        if end <= closed:
+            return None
+        return now + self.recent_ttl
+
+    def get(self, operation, request, namespace=None):
+        """
+        :return: The cached response, or None
+        """
+        if self.refresh:
+            return None
+        key = request_key(operation, request, namespace)
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT expires, response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        expires, response = row
+        if expires is not None and expires < time.time():
+            return None
+        return json.loads(response)
+
+    def put(self, operation, request, response, namespace=None):
+        key = request_key(operation, request, namespace)
+        response = _strip_metadata(response)
+        expires = self._expires(request, time.time())
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, operation, expires, json.dumps(response, default=str)),
+            )
+
+    def call(self, method, operation, namespace, **kwargs):
+        response = self.get(operation, kwargs, namespace)
+        if instrument.enabled():
+            instrument.emit(
+                {"event": "cache", "operation": operation, "hit": response is not None}
+            )
+        if response is not None:
+            with self._lock:
+                self.hits += 1
+            return response
+        with self._lock:
+            self.misses += 1
+        # Hits don't have the ResponseMetadata so misses don't either
+        response = _strip_metadata(method(**kwargs))
+        self.put(operation, kwargs, response, namespace)
+        return response
+
+    def wrap(self, client, namespace=None):
+        return CachingClient(client, self, namespace)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class CachingClient:
+    """
+    Wraps a boto3 Cost Explorer client, serving cacheable calls from a ResponseCache
+    """
+
+    def __init__(self, client, cache, namespace=None):
+        self._client = client
+        self._cache = cache
+        self._namespace = namespace
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in CACHED_OPERATIONS:
+            return partial(self._cache.call, attr, name, self._namespace)
+        return attr
@@ -0,0 +1,92 @@
+"""
+In-memory cache of Cost Explorer dimension values and tags
+
+Values such as the LINKED_ACCOUNT to account name mapping rarely change, so a
+long-running process can reuse them between reports instead of querying them
+again.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL_SECONDS = 6 * 3600
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class DimensionCatalogue:
+    """
+    Thread-safe LRU cache of dimension values or tags, keyed by
+    (namespace, type, dimension or tag key, time period)
+
+    Keys include the time period, so in a long-running process entries are
+    dropped when they expire, and the least recently used above max_entries.
+    """
+
+    def __init__(
+        self, ttl=DEFAULT_TTL_SECONDS, *, max_entries=DEFAULT_MAX_ENTRIES, clock=None
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock or time.monotonic
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch):
+        """
+        :param fetch: Called with no arguments to get the values if they aren't cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                if entry[0] > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+        values = fetch()
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, values)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return values
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_default_catalogue = None
+_default_catalogue_lock = threading.Lock()
+
+
+def get_default_catalogue():
+    """
+    Catalogue shared by all library calls that aren't given one
+    """
+    global _default_catalogue
+    with _default_catalogue_lock:
+        if _default_catalogue is None:
+            _default_catalogue = DimensionCatalogue()
+        return _default_catalogue
+
+
+def set_default_catalogue(catalogue):
+    """
+    Replace the shared catalogue. None resets it.
+    """
+    global _default_catalogue
+    with _default_catalogue_lock:
+        _default_catalogue = catalogue
@@ -0,0 +1,270 @@
+"""
+Cached assumed-role credentials and a pool of reusable boto3 clients
+
+boto3 is only imported when a client is created, since importing it is a large
+part of the startup time of offline and cached runs.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from .ratelimit import DEFAULT_MAX_RETRIES, DEFAULT_RATE, RateLimiter
+
+ROLE_SESSION_NAME = "MsTeamsCostBot"
+# Assumed-role credentials are refreshed this long before they expire
+DEFAULT_REFRESH_MARGIN = timedelta(minutes=5)
+DEFAULT_MAX_POOL_CONNECTIONS = 20
+# Throttling is retried by ratelimit.RateLimiter instead of botocore
+NO_RETRIES = {"retries": {"total_max_attempts": 1}}
+
+
+def client_config(**kwargs):
+    """
+    :return: botocore Config with NO_RETRIES and kwargs
+    """
+    from botocore.config import Config
+
+    return Config(**NO_RETRIES, **kwargs)
+
+
+class CredentialCache:
+    """
+    Assumes roles, caching the credentials in memory (and optionally on disk) until
+    shortly before they expire
+    """
+
+    def __init__(
+        self,
+        cache_dir=None,
+        *,
+        refresh_margin=DEFAULT_REFRESH_MARGIN,
+        session_name=ROLE_SESSION_NAME,
+        sts=None,
+        rate_limiter=None,
+    ):
+        """
+        :param cache_dir: If set credentials are also stored in this directory
+        :param sts: STS client, default boto3.client("sts")
+        :param rate_limiter: Optional ratelimit.RateLimiter for AssumeRole calls
+        """
+        self.cache_dir = cache_dir
+        self.rate_limiter = rate_limiter
+        self.refresh_margin = refresh_margin
+        self.session_name = session_name
+        self._sts = sts
+        self._credentials = {}
+        self._lock = threading.Lock()
+        self._role_locks = {}
+        if cache_dir:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    def _valid(self, credentials):
+        if not credentials:
+            return False
+        expires = credentials["Expiration"] - self.refresh_margin
+        return expires > datetime.now(timezone.utc)
+
+    def _path(self, role_arn):
+        name = hashlib.sha256(f"{role_arn}:{self.session_name}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def _load(self, role_arn):
+        try:
+            with open(self._path(role_arn)) as f:
+                credentials = json.load(f)
+        except (OSError, ValueError):
+            return None
+        credentials["Expiration"] = datetime.fromisoformat(credentials["Expiration"])
+        return credentials
+
+    def _save(self, role_arn, credentials):
+        path = self._path(role_arn)
+        fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                dict(credentials, Expiration=credentials["Expiration"].isoformat()), f
+            )
+        os.replace(path + ".tmp", path)
+
+    def _assume_role(self, role_arn):
+        with self._lock:
+            if not self._sts:
+                import boto3
+
+                self._sts = boto3.client("sts", config=client_config())
+        kwargs = dict(RoleArn=role_arn, RoleSessionName=self.session_name)
+        if self.rate_limiter:
+            return self.rate_limiter.call_operation(
+                "assume_role", self._sts.assume_role, **kwargs
+            )["Credentials"]
+        return self._sts.assume_role(**kwargs)["Credentials"]
+
+    def get(self, role_arn):
+        """
+        :return: Credentials dict with AccessKeyId, SecretAccessKey, SessionToken, Expiration
+        """
+        with self._lock:
+            credentials = self._credentials.get(role_arn)
+            if self._valid(credentials):
+                return credentials
+            role_lock = self._role_locks.setdefault(role_arn, threading.Lock())
+
+        # Only assume each role once if multiple threads need it
+        with role_lock:
+            credentials = self._credentials.get(role_arn)
+            if not self._valid(credentials) and self.cache_dir:
+                credentials = self._load(role_arn)
+            if not self._valid(credentials):
+                credentials = self._assume_role(role_arn)
+                if self.cache_dir:
+                    self._save(role_arn, credentials)
+            with self._lock:
+                self._credentials[role_arn] = credentials
+            return credentials
+
+
+class ClientPool:
+    """
+    Thread-safe pool of boto3 clients keyed by service, role and region
+
+    Clients for a role are recreated when the role's credentials are refreshed.
+    Calls to each service share a ratelimit.RateLimiter, including AssumeRole
+    calls made by the CredentialCache.
+    """
+
+    def __init__(
+        self,
+        *,
+        credentials=None,
+        max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        rate=DEFAULT_RATE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        recorder=None,
+    ):
+        """
+        :param credentials: CredentialCache for assumed roles
+        :param max_pool_connections: botocore HTTP connection pool size for each client
+        :param rate: Maximum requests per second to each service, None for no limit
+        :param max_retries: Maximum retries of each throttled call
+        :param recorder: Optional bundle.BundleRecorder to record calls to
+        """
+        self.credentials = credentials or CredentialCache()
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self._config = None
+        self.rate = rate
+        self.max_retries = max_retries
+        self.recorder = recorder
+        self._clients = {}
+        self._rate_limiters = {}
+        self._account_id = None
+        # boto3 sessions aren't thread-safe so clients are created under a lock
+        self._lock = threading.Lock()
+        if self.credentials.rate_limiter is None:
+            self.credentials.rate_limiter = self.rate_limiter("sts")
+
+    def rate_limiter(self, service):
+        """
+        :return: The RateLimiter shared by all clients for service
+        """
+        with self._lock:
+            if service not in self._rate_limiters:
+                self._rate_limiters[service] = RateLimiter(
+                    rate=self.rate, max_retries=self.max_retries
+                )
+            return self._rate_limiters[service]
+
+    def rate_limit_stats(self):
+        """
+        :return: Dict of service: RateLimiter.stats()
+        """
+        with self._lock:
+            limiters = dict(self._rate_limiters)
+        return {service: r.stats() for (service, r) in limiters.items()}
+
+    def client(self, service, *, role_arn=None, region=None):
+        credentials = None
+        if role_arn:
+            credentials = self.credentials.get(role_arn)
+        access_key = credentials and credentials["AccessKeyId"]
+
+        key = (service, role_arn, region)
+        rate_limiter = self.rate_limiter(service)
+        with self._lock:
+            cached = self._clients.get(key)
+            if cached and cached[0] == access_key:
+                return cached[1]
+            import boto3
+
+            if self._config is None:
+                self._config = client_config(
+                    max_pool_connections=self.max_pool_connections,
+                    tcp_keepalive=self.tcp_keepalive,
+                )
+            if credentials:
+                session = boto3.Session(
+                    aws_access_key_id=credentials["AccessKeyId"],
+                    aws_secret_access_key=credentials["SecretAccessKey"],
+                    aws_session_token=credentials["SessionToken"],
+                )
+                client = session.client(
+                    service, region_name=region, config=self._config
+                )
+            else:
+                client = boto3.client(service, region_name=region, config=self._config)
+            client = rate_limiter.wrap(client)
+            if self.recorder:
+                client = self.recorder.wrap(
+                    client, service=service, role_arn=role_arn, region=region
+                )
+            self._clients[key] = (access_key, client)
+            return client
+
+    def account_id(self):
+        """
+        :return: Account ID of the default credentials, from one STS
+          GetCallerIdentity call for the lifetime of the pool
+        """
+        if self._account_id is None:
+            sts = self.client("sts")
+            self._account_id = sts.get_caller_identity()["Account"]
+        return self._account_id
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def close(self):
+        """
+        Finish recording, if calls are being recorded
+        """
+        if self.recorder:
+            self.recorder.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_client_pool():
+    """
+    Client pool shared by all library calls that aren't given one
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ClientPool()
+        return _default_pool
+
+
+def set_default_client_pool(pool):
+    """
+    Replace the shared client pool, e.g. to change its configuration. None resets it.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        _default_pool = pool
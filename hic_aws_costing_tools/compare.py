@@ -0,0 +1,305 @@
+"""
+Compare costs between two periods, e.g. yesterday and the same day last week
+
+Both periods are fetched with one Cost Explorer query spanning them, and the
+results are split locally, so a comparison costs the same as a single report.
+This includes month to date against the previous month to date. Periods that are
+far apart, e.g. a day and the same day last year, are queried separately and
+concurrently instead, since the spanning query would fetch every day in between. Either way the response cache can serve repeated comparisons.
+"""
+
+import asyncio
+import calendar
+from datetime import date, datetime, timedelta
+from io import StringIO
+
+from .aws_costs import (
+    DEFAULT_COST_TYPE,
+    DEFAULT_MAX_WORKERS,
+    EXPECTED_UNIT,
+    _assert_output,
+    _expected_unit,
+    _in_thread,
+    _sync,
+    get_raw_cost_data_async,
+)
+from .instrument import timed
+from .render import get_renderer
+
+COMPARE_PERIODS = ("previous", "week", "month", "year")
+# DAILY queries spanning both periods up to this long are always used, longer
+# spans only if they're mostly days in the periods
+MAX_SPAN_DAYS = 35
+COMPARISON_COLUMNS = ["Previous", "Current", "Change", "Change %"]
+
+
+def _date(value):
+    return datetime.fromisoformat(value[:10]).date()
+
+
+def _shift_months(d, months):
+    month = d.month - 1 + months
+    year = d.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+
+def get_previous_period(time_period, compare):
+    """
+    Get the period to compare a time period with
+
+    :param compare: previous (the period of the same length immediately before),
+      week, month or year (the same period a week, month or year earlier)
+    :return: Time period dict
+    """
+    start = _date(time_period["Start"])
+    end = _date(time_period["End"])
+    if compare == "previous":
+        start, end = start - (end - start), start
+    elif compare == "week":
+        start, end = start - timedelta(days=7), end - timedelta(days=7)
+    elif compare in ("month", "year"):
+        months = 1 if compare == "month" else 12
+        start, end = _shift_months(start, -months), _shift_months(end, -months)
+    else:
+        raise ValueError(f"Invalid comparison: {compare}")
+    return {"Start": start.isoformat(), "End": end.isoformat()}
+
+
+def plan_comparison(time_period, previous_period):
+    """
+    Plan the Cost Explorer queries for a comparison
+
+    :return: List of (time_period, granularity). MONTHLY if both periods are whole
+      months, otherwise DAILY.
+    """
+    periods = [time_period, previous_period]
+    dates = [_date(tp[k]) for tp in periods for k in ("Start", "End")]
+    granularity = "MONTHLY" if all(d.day == 1 for d in dates) else "DAILY"
+    start = min(dates)
+    end = max(dates)
+    span = (end - start).days
+    # Days in neither period, which a spanning query fetches for nothing
+    gap = span - sum((_date(tp["End"]) - _date(tp["Start"])).days for tp in periods)
+    if granularity == "MONTHLY" or span <= MAX_SPAN_DAYS or gap <= span - gap:
+        return [({"Start": start.isoformat(), "End": end.isoformat()}, granularity)]
+    return [(tp, granularity) for tp in periods]
+
+
+def _within(period, time_period):
+    return (
+        time_period["Start"] <= period[0][:10] and period[1][:10] <= time_period["End"]
+    )
+
+
+@timed("compare")
+def compare_frames(frames, *, time_period, previous_period, cost_type):
+    """
+    Sum the costs of each group1/group2 cell in each period
+
+    :param frames: CostFrames covering both periods, periods outside them are ignored
+    :return: Rows of [group1 value, group2 value, previous, current, change,
+      percent change or None if previous is 0], biggest absolute change first
+    """
+    expected_unit = _expected_unit(cost_type)
+    cells = {}
+    for frame in frames:
+        if expected_unit:
+            unit = frame.unit(cost_type)
+            if unit is not None and unit != expected_unit:
+                raise RuntimeError(f"Unexpected unit: {unit}")
+        # Index of the previous and current amount each period is added to
+        sides = [
+            [
+                side
+                for (side, tp) in enumerate((previous_period, time_period))
+                if _within(period, tp)
+            ]
+            for period in frame.periods
+        ]
+        labels1 = frame.labels1
+        labels2 = frame.labels2
+        for p, k1, k2, amount in zip(
+            frame.period, frame.key1, frame.key2, frame.iter_amounts(cost_type)
+        ):
+            if not sides[p]:
+                continue
+            key = (labels1[k1], labels2[k2])
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0.0, 0.0]
+            for side in sides[p]:
+                cell[side] += amount
+
+    rows = []
+    for (value1, value2), (previous, current) in cells.items():
+        if previous == 0 and current == 0:
+            continue
+        # Cost Explorer amounts have 10 decimal places
+        change = round(current - previous, 10)
+        percent = round(change / previous * 100, 2) if previous else None
+        rows.append([value1, value2, previous, current, change, percent])
+    rows.sort(key=lambda r: (-abs(r[4]), r[0], r[1]))
+    return rows
+
+
+async def compare_costs_async(
+    *,
+    time_period,
+    previous_period,
+    role_arn,
+    regions,
+    group1,
+    group2,
+    exclude_types,
+    include_types,
+    cost_type=DEFAULT_COST_TYPE,
+    cache=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    ledger=None,
+    client_pool=None,
+    catalogue=None,
+):
+    """
+    Compare the costs of each group1/group2 cell between two periods
+
+    :param time_period: Current period
+    :param previous_period: Period to compare with, see get_previous_period()
+    :return: (header, rows), see compare_frames()
+    """
+    queries = plan_comparison(time_period, previous_period)
+    data = await asyncio.gather(
+        *(
+            get_raw_cost_data_async(
+                time_period=query_period,
+                granularity=granularity,
+                role_arn=role_arn,
+                regions=regions,
+                group1=group1,
+                group2=group2,
+                exclude_types=exclude_types,
+                include_types=include_types,
+                apply_value_mappings=True,
+                cache=cache,
+                max_workers=max_workers,
+                ledger=ledger,
+                client_pool=client_pool,
+                catalogue=catalogue,
+                frame=True,
+                metrics=[cost_type],
+            )
+            for (query_period, granularity) in queries
+        )
+    )
+    rows = await _in_thread(
+        compare_frames,
+        [d[0] for d in data],
+        time_period=time_period,
+        previous_period=previous_period,
+        cost_type=cost_type,
+    )
+    return [group1, group2] + COMPARISON_COLUMNS, rows
+
+
+compare_costs = _sync(compare_costs_async, "compare_costs")
+
+
+def _period_label(time_period):
+    start = _date(time_period["Start"])
+    end = _date(time_period["End"])
+    if (end - start).days > 1:
+        return f"{time_period['Start']} - {time_period['End']}"
+    return f"{time_period['Start']} ({start.strftime('%A')})"
+
+
+def comparison_title(*, title_prefix, time_period, previous_period, cost_type):
+    return (
+        f"{title_prefix} {_period_label(time_period)} vs "
+        f"{_period_label(previous_period)} {cost_type}"
+    )
+
+
+def _format_percent(percent):
+    if percent is None:
+        return "new"
+    return f"{percent:+.1f}%"
+
+
+def write_comparison(file, header, rows, output_format="md", unit=EXPECTED_UNIT):
+    """
+    Write a comparison table, with the totals as its heading
+
+    :param output_format: md, html or csv. Percent changes are formatted except in csv.
+    """
+    _assert_output(output_format)
+    previous = sum(r[2] for r in rows)
+    current = sum(r[3] for r in rows)
+    change = current - previous
+    percent = _format_percent(change / previous * 100 if previous else None)
+    if output_format != "csv":
+        rows = (r[:5] + [_format_percent(r[5])] for r in rows)
+    get_renderer(output_format, file).table(
+        f"Totals: {unit} {previous:.2f} -> {current:.2f} ({change:+.2f}, {percent})",
+        header,
+        rows,
+    )
+
+
+async def create_comparison_message_async(
+    *,
+    time_period,
+    previous_period,
+    role_arn,
+    regions,
+    title_prefix,
+    group1,
+    group2,
+    exclude_types,
+    include_types,
+    output_format,
+    cost_type=DEFAULT_COST_TYPE,
+    cache=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    ledger=None,
+    file=None,
+):
+    """
+    Create a markdown, HTML or CSV comparison
+
+    :param file: If set the message is written to this file and None is returned
+      in place of the message
+    :return: (message, title)
+    """
+    _assert_output(output_format)
+    header, rows = await compare_costs_async(
+        time_period=time_period,
+        previous_period=previous_period,
+        role_arn=role_arn,
+        regions=regions,
+        group1=group1,
+        group2=group2,
+        exclude_types=exclude_types,
+        include_types=include_types,
+        cost_type=cost_type,
+        cache=cache,
+        max_workers=max_workers,
+        ledger=ledger,
+    )
+    s = file or StringIO()
+    write_comparison(
+        s, header, rows, output_format, _expected_unit(cost_type) or cost_type
+    )
+    title = comparison_title(
+        title_prefix=title_prefix,
+        time_period=time_period,
+        previous_period=previous_period,
+        cost_type=cost_type,
+    )
+    if file:
+        return None, title
+    return s.getvalue(), title
+
+
+create_comparison_message = _sync(
+    create_comparison_message_async, "create_comparison_message"
+)
@@ -0,0 +1,223 @@
+"""
+Write flat costs as NDJSON, Parquet or Arrow IPC
+
+Rows are buffered into row groups of at most row_group_size rows which are
+written as soon as they're full, so memory use doesn't depend on the number of
+rows. Parquet and Arrow have typed columns: dates (or UTC times for HOURLY
+costs), dictionary encoded strings for the payer and group columns, and decimals
+for the amounts. They require pyarrow.
+
+Amounts should be decimal.Decimal, converted from the Cost Explorer Amount
+strings, since floats can't hold every digit. Floats are converted from their
+shortest representation so they don't gain binary rounding errors.
+"""
+
+import json
+from decimal import Context, Decimal
+from io import BytesIO, StringIO
+
+from .instrument import timed
+
+EXPORT_FORMATS = ("ndjson", "parquet", "arrow")
+DEFAULT_ROW_GROUP_SIZE = 65536
+# Cost Explorer costs have at most 10 decimal places, but usage quantities can be
+# smaller
+AMOUNT_PRECISION = 38
+AMOUNT_SCALE = 18
+_AMOUNT_EXPONENT = Decimal(1).scaleb(-AMOUNT_SCALE)
+_AMOUNT_CONTEXT = Context(prec=AMOUNT_PRECISION)
+PERIOD_COLUMNS = ("START", "END")
+
+
+def _to_decimal(value):
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(_AMOUNT_EXPONENT, context=_AMOUNT_CONTEXT)
+
+
+def _import_pyarrow(output_format):
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError(
+            f"pyarrow is required for {output_format} output, "
+            "install hic-aws-costing-tools[arrow]"
+        )
+    return pyarrow
+
+
+class ExportWriter:
+    """
+    Writes flat cost rows to a file-like object
+
+    Use as a context manager, or call close() after the last rows.
+    """
+
+    binary = True
+
+    def __init__(self, file, header, *, amounts=1, row_group_size=None):
+        """
+        :param header: Column names
+        :param amounts: Number of amount (metric) columns at the end of each row
+        :param row_group_size: Maximum rows in each row group
+        """
+        self.file = file
+        self.header = list(header)
+        self.amounts = amounts
+        self.row_group_size = row_group_size or DEFAULT_ROW_GROUP_SIZE
+
+    def write_rows(self, rows):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NdjsonWriter(ExportWriter):
+    """
+    One JSON object per line, written to a text file
+    """
+
+    binary = False
+
+    def write_rows(self, rows):
+        header = self.header
+        dumps = json.dumps
+        lines = []
+        for row in rows:
+            lines.append(dumps(dict(zip(header, row)), default=float))
+            if len(lines) >= self.row_group_size:
+                self.file.write("\n".join(lines) + "\n")
+                lines = []
+        if lines:
+            self.file.write("\n".join(lines) + "\n")
+
+
+class _ArrowWriter(ExportWriter):
+    def __init__(self, file, header, **kwargs):
+        super().__init__(file, header, **kwargs)
+        self.pa = _import_pyarrow(self.format)
+        self.schema = None
+        self.writer = None
+
+    def _open(self):
+        raise NotImplementedError()
+
+    def _create_schema(self, columns):
+        # Periods are dates, or UTC times for HOURLY
+        pa = self.pa
+        period_type = pa.date32()
+        if columns and "START" in self.header:
+            if "T" in columns[self.header.index("START")][0]:
+                period_type = pa.timestamp("s", tz="UTC")
+        n = len(self.header) - self.amounts
+        fields = []
+        for i, name in enumerate(self.header):
+            if name in PERIOD_COLUMNS:
+                fields.append(pa.field(name, period_type))
+            elif i < n:
+                fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+            else:
+                fields.append(
+                    pa.field(name, pa.decimal128(AMOUNT_PRECISION, AMOUNT_SCALE))
+                )
+        self.schema = pa.schema(fields)
+        self.writer = self._open()
+
+    def _write_batch(self, columns):
+        pa = self.pa
+        if self.writer is None:
+            self._create_schema(columns)
+        arrays = []
+        for values, field in zip(columns, self.schema):
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, pa.string()).dictionary_encode())
+            elif pa.types.is_decimal(field.type):
+                arrays.append(pa.array([_to_decimal(v) for v in values], field.type))
+            else:
+                arrays.append(pa.array(values, pa.string()).cast(field.type))
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def write_rows(self, rows):
+        columns = [[] for _ in self.header]
+        size = 0
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+            size += 1
+            if size >= self.row_group_size:
+                self._write_batch(columns)
+                columns = [[] for _ in self.header]
+                size = 0
+        if size:
+            self._write_batch(columns)
+
+    def close(self):
+        if self.writer is None:
+            self._create_schema(None)
+        self.writer.close()
+
+
+class ParquetWriter(_ArrowWriter):
+    format = "parquet"
+
+    def _open(self):
+        import pyarrow.parquet
+
+        # Each batch is written as a row group
+        return pyarrow.parquet.ParquetWriter(self.file, self.schema)
+
+
+class ArrowWriter(_ArrowWriter):
+    """
+    Arrow IPC stream format, each row group is a record batch
+    """
+
+    format = "arrow"
+
+    def _open(self):
+        return self.pa.ipc.new_stream(self.file, self.schema)
+
+
+EXPORT_WRITERS = {
+    "ndjson": NdjsonWriter,
+    "parquet": ParquetWriter,
+    "arrow": ArrowWriter,
+}
+
+
+def _writer_class(output_format):
+    try:
+        return EXPORT_WRITERS[output_format]
+    except KeyError:
+        raise ValueError(f"Invalid export format: {output_format}")
+
+
+def get_export_writer(output_format, file, header, **kwargs):
+    return _writer_class(output_format)(file, header, **kwargs)
+
+
+@timed("export")
+def write_export(file, header, rows, output_format, **kwargs):
+    """
+    Write rows as NDJSON, Parquet or Arrow
+
+    :param file: Text file for NDJSON, binary file for Parquet and Arrow. If None
+      the output is returned as a string or bytes.
+    :param rows: Iterable of rows, consumed one row group at a time
+    :param kwargs: ExportWriter arguments
+    """
+    cls = _writer_class(output_format)
+    s = file
+    if s is None:
+        s = BytesIO() if cls.binary else StringIO()
+    with cls(s, header, **kwargs) as writer:
+        writer.write_rows(rows)
+    if file is None:
+        return s.getvalue()
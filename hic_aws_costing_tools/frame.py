@@ -0,0 +1,353 @@
+"""
+Compact columnar storage for Cost Explorer results
+
+Raw ResultsByTime are nested dicts with a string Amount for every group. A
+CostFrame stores one row per group in typed arrays instead: key columns are
+dictionary-encoded (an array of integer codes into a list of interned labels),
+the period is an index into a list of (start, end) tuples, and each metric is an
+array of float64, or of int64 fixed-point values if decimals is set.
+"""
+
+import sys
+from array import array
+from itertools import repeat
+from operator import truediv
+
+# Typecodes for code columns and amount columns
+CODE_TYPE = "I"
+FLOAT_TYPE = "d"
+FIXED_TYPE = "q"
+
+
+class _Encoder:
+    # Dictionary-encode values to codes, interning string labels
+    def __init__(self, labels=None):
+        self.labels = list(labels or [])
+        self.codes = {v: i for (i, v) in enumerate(self.labels)}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.labels)
+            if isinstance(value, str):
+                value = sys.intern(value)
+            self.labels.append(value)
+            self.codes[value] = code
+        return code
+
+
+class CostFrame:
+    """
+    Array-backed table of (period, group1, group2, amount per metric) rows
+
+    Create with CostFrame.from_results(). Frames are treated as immutable,
+    relabel() and concat() return new frames which may share arrays.
+    """
+
+    def __init__(
+        self,
+        *,
+        periods,
+        period,
+        labels1,
+        key1,
+        labels2,
+        key2,
+        amounts,
+        units,
+        decimals=None,
+        payers=None,
+        payer=None,
+    ):
+        """
+        :param periods: List of (start, end) tuples
+        :param period: Array of indices into periods
+        :param labels1: List of group1 labels, key1 is an array of indices into this
+        :param labels2: List of group2 labels, key2 is an array of indices into this
+        :param amounts: Dict of metric name to array of amounts
+        :param units: Dict of metric name to unit, or a tuple of units if they're
+          mixed, e.g. UsageQuantity of different services
+        :param decimals: If set amounts are integers scaled by 10**decimals
+        :param payers: Optional list of payer labels, payer is an array of indices into this
+        """
+        self.periods = periods
+        self.period = period
+        self.labels1 = labels1
+        self.key1 = key1
+        self.labels2 = labels2
+        self.key2 = key2
+        self.amounts = amounts
+        self.units = units
+        self.decimals = decimals
+        self.payers = payers
+        self.payer = payer
+
+    @classmethod
+    def from_results(cls, results, *, metrics=None, decimals=None):
+        """
+        Build a frame from ResultsByTime, consuming them one at a time
+
+        :param results: ResultsByTime list or iterator, optionally labelled with "Payer"
+        :param metrics: Metrics to store, default all metrics in the results
+        :param decimals: Store amounts as fixed-point integers with this many decimal places
+        """
+        period = array(CODE_TYPE)
+        key1 = array(CODE_TYPE)
+        key2 = array(CODE_TYPE)
+        payer = array(CODE_TYPE)
+        encoder1 = _Encoder()
+        encoder2 = _Encoder()
+        payer_encoder = _Encoder()
+        periods = []
+        period_codes = {}
+        amounts = {}
+        units = {}
+        has_payer = False
+        scale = None
+        typecode = FLOAT_TYPE
+        if decimals is not None:
+            scale = 10**decimals
+            typecode = FIXED_TYPE
+
+        for result in results:
+            tp = (result["TimePeriod"]["Start"], result["TimePeriod"]["End"])
+            p = period_codes.get(tp)
+            if p is None:
+                p = period_codes[tp] = len(periods)
+                periods.append(tp)
+            payer_code = 0
+            if result.get("Payer") is not None:
+                has_payer = True
+                payer_code = payer_encoder.encode(result["Payer"])
+            for g in result["Groups"]:
+                if metrics is None:
+                    metrics = list(g["Metrics"])
+                if not amounts:
+                    amounts = {m: array(typecode) for m in metrics}
+                for m in metrics:
+                    metric = g["Metrics"][m]
+                    unit = units.setdefault(m, metric["Unit"])
+                    if metric["Unit"] != unit:
+                        units[m] = _mixed_units(unit, metric["Unit"])
+                    if scale is not None:
+                        amounts[m].append(round(float(metric["Amount"]) * scale))
+                    else:
+                        amounts[m].append(float(metric["Amount"]))
+                g1, g2 = g["Keys"]
+                period.append(p)
+                key1.append(encoder1.encode(g1))
+                key2.append(encoder2.encode(g2))
+                payer.append(payer_code)
+
+        for m in metrics or []:
+            amounts.setdefault(m, array(typecode))
+        return cls(
+            periods=periods,
+            period=period,
+            labels1=encoder1.labels,
+            key1=key1,
+            labels2=encoder2.labels,
+            key2=key2,
+            amounts=amounts,
+            units=units,
+            decimals=decimals,
+            payers=payer_encoder.labels if has_payer else None,
+            payer=payer if has_payer else None,
+        )
+
+    def __len__(self):
+        return len(self.key1)
+
+    @property
+    def nbytes(self):
+        """
+        Approximate size of the row arrays in bytes, excluding labels
+        """
+        columns = [self.period, self.key1, self.key2] + list(self.amounts.values())
+        if self.payer is not None:
+            columns.append(self.payer)
+        return sum(c.itemsize * len(c) for c in columns)
+
+    def unit(self, metric):
+        """
+        :return: Unit of a metric, None if the frame is empty
+        :raises RuntimeError: If the metric has mixed units
+        """
+        if metric not in self.amounts and len(self):
+            raise KeyError(f"Metric not in frame: {metric}")
+        unit = self.units.get(metric)
+        if isinstance(unit, tuple):
+            raise RuntimeError(f"Mixed units for {metric}: {' '.join(unit)}")
+        return unit
+
+    def iter_amounts(self, metric):
+        """
+        :return: Iterator of float amounts for a metric
+        """
+        if not len(self):
+            return iter(())
+        values = self.amounts[metric]
+        if self.decimals is None:
+            return iter(values)
+        return map(truediv, values, repeat(10**self.decimals))
+
+    def relabel(self, value_map1=None, value_map2=None):
+        """
+        Map group labels to new values, e.g. account IDs to names
+
+        Only the label dictionaries are rewritten, the row arrays are shared.
+        """
+
+        def mapped(labels, value_map):
+            if not value_map:
+                return labels
+            return [sys.intern(value_map.get(v, v)) for v in labels]
+
+        return CostFrame(
+            periods=self.periods,
+            period=self.period,
+            labels1=mapped(self.labels1, value_map1),
+            key1=self.key1,
+            labels2=mapped(self.labels2, value_map2),
+            key2=self.key2,
+            amounts=self.amounts,
+            units=self.units,
+            decimals=self.decimals,
+            payers=self.payers,
+            payer=self.payer,
+        )
+
+    def with_payer(self, payer):
+        """
+        :return: Frame with every row labelled with payer
+        """
+        return CostFrame(
+            periods=self.periods,
+            period=self.period,
+            labels1=self.labels1,
+            key1=self.key1,
+            labels2=self.labels2,
+            key2=self.key2,
+            amounts=self.amounts,
+            units=self.units,
+            decimals=self.decimals,
+            payers=[payer],
+            payer=array(CODE_TYPE, repeat(0, len(self))),
+        )
+
+    def aggregate_periods(self, period_map):
+        """
+        Sum rows into coarser periods
+
+        :param period_map: List of the new (start, end) period for each of self.periods
+        :return: Frame with one row per new period, group and payer
+        """
+        periods = _Encoder()
+        bucket = [periods.encode(tp) for tp in period_map]
+        typecode = FLOAT_TYPE if self.decimals is None else FIXED_TYPE
+        period = array(CODE_TYPE)
+        key1 = array(CODE_TYPE)
+        key2 = array(CODE_TYPE)
+        payer = array(CODE_TYPE)
+        amounts = {m: array(typecode) for m in self.amounts}
+        columns = [(self.amounts[m], amounts[m]) for m in self.amounts]
+        payer_codes = self.payer if self.payer is not None else repeat(0)
+        rows = {}
+
+        for n, (p, k1, k2, c) in enumerate(
+            zip(self.period, self.key1, self.key2, payer_codes)
+        ):
+            key = (bucket[p], k1, k2, c)
+            r = rows.get(key)
+            if r is None:
+                rows[key] = len(period)
+                period.append(key[0])
+                key1.append(k1)
+                key2.append(k2)
+                payer.append(c)
+                for values, out in columns:
+                    out.append(values[n])
+            else:
+                for values, out in columns:
+                    out[r] += values[n]
+
+        return CostFrame(
+            periods=periods.labels,
+            period=period,
+            labels1=self.labels1,
+            key1=key1,
+            labels2=self.labels2,
+            key2=key2,
+            amounts=amounts,
+            units=self.units,
+            decimals=self.decimals,
+            payers=self.payers,
+            payer=payer if self.payer is not None else None,
+        )
+
+    @classmethod
+    def concat(cls, frames):
+        """
+        Join frames with the same metrics and decimals, re-encoding their labels
+        """
+        frames = list(frames)
+        if not frames:
+            raise ValueError("No frames to concat")
+        decimals = frames[0].decimals
+        metrics = list(frames[0].amounts)
+        periods = _Encoder()
+        encoder1 = _Encoder()
+        encoder2 = _Encoder()
+        payer_encoder = _Encoder()
+        has_payer = any(f.payer is not None for f in frames)
+        period = array(CODE_TYPE)
+        key1 = array(CODE_TYPE)
+        key2 = array(CODE_TYPE)
+        payer = array(CODE_TYPE)
+        typecode = FLOAT_TYPE if decimals is None else FIXED_TYPE
+        amounts = {m: array(typecode) for m in metrics}
+        units = {}
+
+        for f in frames:
+            if f.decimals != decimals or list(f.amounts) != metrics:
+                raise ValueError("Frames have different metrics or decimals")
+            for m, unit in f.units.items():
+                if units.setdefault(m, unit) != unit:
+                    units[m] = _mixed_units(units[m], unit)
+            period.extend(_recode(f.period, f.periods, periods))
+            key1.extend(_recode(f.key1, f.labels1, encoder1))
+            key2.extend(_recode(f.key2, f.labels2, encoder2))
+            if f.payer is not None:
+                payer.extend(_recode(f.payer, f.payers, payer_encoder))
+            elif has_payer:
+                payer.extend(repeat(payer_encoder.encode(""), len(f)))
+            for m in metrics:
+                amounts[m].extend(f.amounts[m])
+
+        return cls(
+            periods=periods.labels,
+            period=period,
+            labels1=encoder1.labels,
+            key1=key1,
+            labels2=encoder2.labels,
+            key2=key2,
+            amounts=amounts,
+            units=units,
+            decimals=decimals,
+            payers=payer_encoder.labels if has_payer else None,
+            payer=payer if has_payer else None,
+        )
+
+
+def _mixed_units(*units):
+    # Units are a tuple if there's more than one
+    mixed = set()
+    for u in units:
+        mixed.update(u if isinstance(u, tuple) else [u])
+    return tuple(sorted(mixed))
+
+
+def _recode(codes, labels, encoder):
+    # Map codes for labels to codes in encoder
+    mapping = [encoder.encode(v) for v in labels]
+    return array(CODE_TYPE, [mapping[c] for c in codes])
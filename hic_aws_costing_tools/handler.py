@@ -0,0 +1,145 @@
+"""
+AWS Lambda entry point for the cost bot
+
+Set the function handler to ``hic_aws_costing_tools.handler.handler``. Clients,
+assumed-role credentials and dimension values are held by the default ClientPool
+and DimensionCatalogue at module scope, so warm invocations reuse them instead of
+assuming roles and creating clients again. In Lambda the clients are created
+when the module is loaded so the cold start cost is paid during initialisation.
+
+The event is a dict of create_costs_message arguments, all optional:
+
+    {
+        "start": "2023-06-01",
+        "end": "2023-07-01",
+        "role_arn": "arn:aws:iam::123456789012:role/costs",
+        "granularity": "MONTHLY",
+        "group1": "accountname",
+        "group2": "service",
+        "cost_type": "UnblendedCost",
+        "output": "auto",
+        "output_format": "md",
+        "max_bytes": 28000,
+        "title_prefix": "AWS costs"
+    }
+
+and the handler returns {"title": title, "message": message, "cold": bool,
+"seconds": float}, where cold is True for the first invocation of this process.
+
+If "compare" is set to previous, week, month or year the message compares each
+group1/group2 cost with that period instead, see compare.py.
+
+Environment variables:
+
+- AWS_COSTS_CACHE_DIR: Cache Cost Explorer responses in this directory, e.g. under /tmp
+- AWS_COSTS_PREWARM_ROLES: Space separated role ARNs to assume when the module is loaded
+"""
+
+import logging
+import os
+import time
+
+from .aws_costs import (
+    DEFAULT_COST_TYPE,
+    DEFAULT_EXCLUDE_RECORD_TYPES,
+    DEFAULT_GRANULARITY,
+    DEFAULT_INCLUDE_RECORD_TYPES,
+    DEFAULT_MAX_MESSAGE_BYTES,
+    create_costs_message,
+    get_time_period,
+)
+from .cache import ResponseCache
+from .clients import get_default_client_pool
+from .compare import create_comparison_message, get_previous_period
+
+DEFAULT_TITLE_PREFIX = "AWS costs"
+CACHE_DIR_ENV = "AWS_COSTS_CACHE_DIR"
+PREWARM_ROLES_ENV = "AWS_COSTS_PREWARM_ROLES"
+
+log = logging.getLogger(__name__)
+
+# (cache_dir, ResponseCache)
+_cache = (None, None)
+_invocations = 0
+
+
+def _get_cache():
+    global _cache
+    cache_dir = os.getenv(CACHE_DIR_ENV)
+    if not cache_dir:
+        return None
+    if _cache[0] != cache_dir:
+        _cache = (cache_dir, ResponseCache(cache_dir))
+    return _cache[1]
+
+
+def prewarm(role_arns=None):
+    """
+    Import boto3, assume roles and create Cost Explorer clients
+
+    The account of the default credentials, which cached responses and dimension
+    values are stored under, is also looked up.
+
+    :param role_arns: Role ARNs to assume, None uses the default credentials
+    """
+    pool = get_default_client_pool()
+    for role_arn in role_arns or [None]:
+        pool.client("ce", role_arn=role_arn)
+        if not role_arn:
+            pool.account_id()
+
+
+def handler(event, context=None):
+    """
+    :param event: Dict of report options, see the module docstring
+    :param context: Lambda context, unused
+    :return: {"title": title, "message": message, "cold": bool, "seconds": float}
+    """
+    global _invocations
+    start = time.perf_counter()
+    _invocations += 1
+    event = event or {}
+
+    time_period = get_time_period(
+        startdate=event.get("start"), enddate=event.get("end")
+    )
+    kwargs = dict(
+        time_period=time_period,
+        cost_type=event.get("cost_type", DEFAULT_COST_TYPE),
+        role_arn=event.get("role_arn"),
+        regions=event.get("regions"),
+        title_prefix=event.get("title_prefix", DEFAULT_TITLE_PREFIX),
+        group1=event.get("group1", "accountname"),
+        group2=event.get("group2", "service"),
+        exclude_types=event.get("exclude_types", DEFAULT_EXCLUDE_RECORD_TYPES),
+        include_types=event.get("include_types", DEFAULT_INCLUDE_RECORD_TYPES),
+        output_format=event.get("output_format", "md"),
+        cache=_get_cache(),
+    )
+    if event.get("compare"):
+        message, title = create_comparison_message(
+            previous_period=get_previous_period(time_period, event["compare"]),
+            **kwargs,
+        )
+    else:
+        message, title = create_costs_message(
+            granularity=event.get("granularity", DEFAULT_GRANULARITY).upper(),
+            output=event.get("output", "auto"),
+            max_bytes=event.get("max_bytes", DEFAULT_MAX_MESSAGE_BYTES),
+            **kwargs,
+        )
+    return {
+        "title": title,
+        "message": message,
+        "cold": _invocations == 1,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+if os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+    # A failure here would fail every cold start, the first invocation creates the
+    # clients instead
+    try:
+        prewarm(os.getenv(PREWARM_ROLES_ENV, "").split() or None)
+    except Exception:
+        log.exception("Prewarm failed")
@@ -0,0 +1,184 @@
+"""
+Instrumentation of AWS API calls and pipeline stages
+
+Hooks are callbacks that receive an event dict for every API call, retry, cache
+lookup and timed pipeline stage. Events are only created while a hook is
+registered. Profiler is a hook that aggregates events into a summary.
+
+Events have an "event" key:
+
+- stage: name, seconds
+- api_call: operation, seconds, bytes (response size), error (code or None)
+- retry: operation, throttled
+- cache: operation, hit
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Cost Explorer API requests are charged per paginated request
+CE_REQUEST_COST_USD = 0.01
+CE_OPERATIONS = ("get_cost_and_usage", "get_dimension_values", "get_tags")
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+def add_hook(callback):
+    """
+    Call callback(event) for every event, from any thread
+    """
+    global _hooks
+    with _hooks_lock:
+        _hooks = _hooks + [callback]
+
+
+def remove_hook(callback):
+    global _hooks
+    with _hooks_lock:
+        _hooks = [h for h in _hooks if h != callback]
+
+
+def enabled():
+    return bool(_hooks)
+
+
+def emit(event):
+    for hook in _hooks:
+        hook(event)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block of code as a pipeline stage
+    """
+    if not _hooks:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit({"event": "stage", "name": name, "seconds": time.perf_counter() - start})
+
+
+def timed(name):
+    """
+    Decorator to time each call of a function as a pipeline stage
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def response_size(response):
+    return len(json.dumps(response, default=str))
+
+
+class Profiler:
+    """
+    Hook that aggregates events
+
+    Use as a context manager, or call start() and stop(), to register and remove it.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.stages = {}
+        self.api_calls = {}
+        self.cache = {"hits": 0, "misses": 0}
+        self.retries = 0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            kind = event["event"]
+            if kind == "stage":
+                s = self.stages.setdefault(event["name"], {"calls": 0, "seconds": 0})
+                s["calls"] += 1
+                s["seconds"] += event["seconds"]
+            elif kind == "api_call":
+                a = self.api_calls.setdefault(
+                    event["operation"],
+                    {"calls": 0, "errors": 0, "seconds": 0, "bytes": 0},
+                )
+                a["calls"] += 1
+                a["errors"] += event["error"] is not None
+                a["seconds"] += event["seconds"]
+                a["bytes"] += event["bytes"]
+            elif kind == "retry":
+                self.retries += 1
+                self.throttles += event["throttled"]
+            elif kind == "cache":
+                self.cache["hits" if event["hit"] else "misses"] += 1
+
+    def start(self):
+        add_hook(self)
+        self.start_time = time.perf_counter()
+        return self
+
+    def stop(self):
+        remove_hook(self)
+        self.end_time = time.perf_counter()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def summary(self):
+        """
+        :return: JSON serialisable dict
+        """
+        end = self.end_time or time.perf_counter()
+        with self._lock:
+            ce_requests = sum(
+                a["calls"] - a["errors"]
+                for (op, a) in self.api_calls.items()
+                if op in CE_OPERATIONS
+            )
+            return {
+                "wall_seconds": end - self.start_time,
+                "stages": {k: dict(v) for (k, v) in self.stages.items()},
+                "api_calls": {k: dict(v) for (k, v) in self.api_calls.items()},
+                "cache": dict(self.cache),
+                "retries": self.retries,
+                "throttles": self.throttles,
+                "ce_requests": ce_requests,
+                "estimated_cost_usd": round(ce_requests * CE_REQUEST_COST_USD, 2),
+            }
+
+    def format_summary(self):
+        s = self.summary()
+        lines = [f"Wall time: {s['wall_seconds']:.3f}s"]
+        for name, stats in sorted(s["stages"].items()):
+            lines.append(f"  {name}: {stats['seconds']:.3f}s in {stats['calls']} calls")
+        lines.append("API calls:")
+        for name, stats in sorted(s["api_calls"].items()):
+            lines.append(
+                f"  {name}: {stats['calls']} calls ({stats['errors']} errors), "
+                f"{stats['seconds']:.3f}s, {stats['bytes'] / 1e6:.2f} MB"
+            )
+        lines.append(
+            f"Cache: {s['cache']['hits']} hits, {s['cache']['misses']} misses. "
+            f"Retries: {s['retries']} ({s['throttles']} throttled)"
+        )
+        lines.append(
+            f"Estimated Cost Explorer charge: ${s['estimated_cost_usd']:.2f} "
+            f"for {s['ce_requests']} requests"
+        )
+        return "\n".join(lines)
@@ -0,0 +1,306 @@
+"""
+Local ledger of daily costs, kept up to date with incremental syncs
+
+The ledger holds the flat records produced by costs_to_flat for each distinct
+query (role, groups and filters), so reports can be created without calling
+Cost Explorer.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from bisect import bisect_right
+from contextlib import closing, contextmanager
+from datetime import date, datetime, timedelta
+
+from .aws_costs import (
+    DEFAULT_COST_TYPE,
+    EXPECTED_UNIT,
+    _str_to_date,
+    get_raw_cost_data,
+    iter_costs_flat,
+    split_time_period,
+)
+
+# Recent daily costs may be restated, so they are fetched again on every sync
+DEFAULT_RESTATEMENT_DAYS = 3
+# The previous month is fetched again on every sync until this day of the month
+DEFAULT_FINALIZE_DAY = 5
+
+
+def default_ledger_path():
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "share"
+    )
+    return os.path.join(data_home, "hic-aws-costing-tools", "ledger.sqlite3")
+
+
+def _dataset_key(*, role_arn, regions, group1, group2, exclude_types, include_types):
+    return json.dumps(
+        {
+            "role_arn": role_arn,
+            "regions": sorted(regions or []),
+            "group1": group1,
+            "group2": group2,
+            "exclude_types": sorted(exclude_types or []),
+            "include_types": sorted(include_types or []),
+            "cost_type": DEFAULT_COST_TYPE,
+        },
+        sort_keys=True,
+    )
+
+
+class CostLedger:
+    def __init__(self, path):
+        """
+        :param path: SQLite database, created if necessary
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        with self._connect() as db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS datasets (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT UNIQUE,
+                    synced_from TEXT,
+                    synced_to TEXT,
+                    synced_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS costs (
+                    dataset INTEGER,
+                    start TEXT,
+                    end TEXT,
+                    group1 TEXT,
+                    group2 TEXT,
+                    cost REAL,
+                    PRIMARY KEY (dataset, start, group1, group2)
+                );
+                CREATE TABLE IF NOT EXISTS value_maps (
+                    dataset INTEGER,
+                    position INTEGER,
+                    value TEXT,
+                    name TEXT,
+                    PRIMARY KEY (dataset, position, value)
+                );
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.path, timeout=60)) as db:
+            with db:
+                yield db
+
+    def _dataset(self, db, key, create=False):
+        row = db.execute(
+            "SELECT id, synced_from, synced_to FROM datasets WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None and create:
+            db.execute("INSERT INTO datasets (key) VALUES (?)", (key,))
+            return self._dataset(db, key)
+        return row
+
+    def synced_range(self, **query):
+        """
+        :return: (first date, last date exclusive) synced for this query, or None
+        """
+        with self._connect() as db:
+            row = self._dataset(db, _dataset_key(**query))
+        if row is None or row[1] is None:
+            return None
+        return (
+            datetime.fromisoformat(row[1]).date(),
+            datetime.fromisoformat(row[2]).date(),
+        )
+
+    def update(self, *, time_period, rows, value_map1, value_map2, **query):
+        """
+        Replace all costs in time_period with rows
+
+        :param rows: Iterator of (start, end, group1, group2, cost) with daily periods
+        """
+        with self._connect() as db:
+            # Consuming rows may fetch them from Cost Explorer, so they're staged in
+            # a temporary table first and the ledger is only locked to replace them
+            db.execute(
+                "CREATE TEMP TABLE staged (start TEXT, end TEXT, group1 TEXT, group2 TEXT, cost REAL)"
+            )
+            db.executemany("INSERT INTO staged VALUES (?, ?, ?, ?, ?)", rows)
+            db.commit()
+
+            dataset, synced_from, synced_to = self._dataset(
+                db, _dataset_key(**query), create=True
+            )
+            db.execute(
+                "DELETE FROM costs WHERE dataset = ? AND start >= ? AND start < ?",
+                (dataset, time_period["Start"], time_period["End"]),
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO costs SELECT ?, * FROM staged", (dataset,)
+            )
+            for position, value_map in ((1, value_map1), (2, value_map2)):
+                db.executemany(
+                    "INSERT OR REPLACE INTO value_maps VALUES (?, ?, ?, ?)",
+                    ((dataset, position, k, v) for (k, v) in value_map.items()),
+                )
+            db.execute(
+                "UPDATE datasets SET synced_from = ?, synced_to = ?, synced_at = ? WHERE id = ?",
+                (
+                    min(filter(None, [synced_from, time_period["Start"]])),
+                    max(filter(None, [synced_to, time_period["End"]])),
+                    time.time(),
+                    dataset,
+                ),
+            )
+
+    def get_raw_cost_data(self, *, time_period, granularity, **query):
+        """
+        Get costs from the ledger in the same form as aws_costs.get_raw_cost_data
+
+        :return: (results, all_values1, all_values2, value_map1, value_map2)
+        """
+        synced = self.synced_range(**query)
+        start = datetime.fromisoformat(time_period["Start"]).date()
+        end = datetime.fromisoformat(time_period["End"]).date()
+        if not synced or start < synced[0] or end > synced[1]:
+            raise ValueError(
+                f"Ledger doesn't contain {time_period['Start']} - {time_period['End']}, "
+                f"synced: {synced}"
+            )
+
+        if granularity == "DAILY":
+            periods = split_time_period(time_period, days=1)
+        elif granularity == "MONTHLY":
+            periods = split_time_period(time_period, months=1)
+        else:
+            raise ValueError(f"Unsupported granularity for ledger: {granularity}")
+
+        with self._connect() as db:
+            dataset = self._dataset(db, _dataset_key(**query))[0]
+            value_maps = {1: {}, 2: {}}
+            for position, value, name in db.execute(
+                "SELECT position, value, name FROM value_maps WHERE dataset = ?",
+                (dataset,),
+            ):
+                value_maps[position][value] = name
+
+            results = [{"TimePeriod": p, "Groups": []} for p in periods]
+            period_starts = [p["Start"] for p in periods]
+            totals = {}
+            for start, g1, g2, cost in db.execute(
+                "SELECT start, group1, group2, SUM(cost) FROM costs "
+                "WHERE dataset = ? AND start >= ? AND start < ? "
+                "GROUP BY start, group1, group2",
+                (dataset, time_period["Start"], time_period["End"]),
+            ):
+                key = (bisect_right(period_starts, start) - 1, g1, g2)
+                totals[key] = totals.get(key, 0) + cost
+
+        all_values1 = set()
+        all_values2 = set()
+        for (i, g1, g2), cost in sorted(totals.items()):
+            all_values1.add(g1)
+            all_values2.add(g2)
+            results[i]["Groups"].append(
+                {
+                    "Keys": [g1, g2],
+                    "Metrics": {
+                        DEFAULT_COST_TYPE: {"Amount": repr(cost), "Unit": EXPECTED_UNIT}
+                    },
+                }
+            )
+
+        return results, all_values1, all_values2, value_maps[1], value_maps[2]
+
+
+def _month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def sync_time_period(
+    synced_range,
+    *,
+    today,
+    start=None,
+    restatement_days=DEFAULT_RESTATEMENT_DAYS,
+    finalize_day=DEFAULT_FINALIZE_DAY,
+):
+    """
+    Get the time period that should be fetched to bring the ledger up to date
+
+    :param synced_range: Result of CostLedger.synced_range
+    :param start: Start date for the first sync (default start of the previous month)
+    :return: Time period, or None if nothing needs to be fetched
+    """
+    previous_month = _month_start(_month_start(today) - timedelta(days=1))
+    if synced_range:
+        sync_start = synced_range[1] - timedelta(days=restatement_days)
+        if today.day <= finalize_day:
+            sync_start = min(sync_start, previous_month)
+        sync_start = max(sync_start, synced_range[0])
+    else:
+        sync_start = _str_to_date(start) or previous_month
+    if sync_start >= today:
+        return None
+    return {"Start": sync_start.isoformat(), "End": today.isoformat()}
+
+
+def sync(
+    *,
+    ledger,
+    role_arn,
+    regions,
+    group1,
+    group2,
+    exclude_types,
+    include_types,
+    start=None,
+    restatement_days=DEFAULT_RESTATEMENT_DAYS,
+    finalize_day=DEFAULT_FINALIZE_DAY,
+    today=None,
+    cache=None,
+):
+    """
+    Fetch daily costs since the last sync, including the restatement window, into the ledger
+
+    :param start: Start date for the first sync (default start of the previous month)
+    :return: The time period that was fetched, or None if the ledger is up to date
+    """
+    query = dict(
+        role_arn=role_arn,
+        regions=regions,
+        group1=group1,
+        group2=group2,
+        exclude_types=exclude_types,
+        include_types=include_types,
+    )
+    time_period = sync_time_period(
+        ledger.synced_range(**query),
+        today=today or datetime.now().date(),
+        start=start,
+        restatement_days=restatement_days,
+        finalize_day=finalize_day,
+    )
+    if not time_period:
+        return None
+
+    results, _, _, value_map1, value_map2 = get_raw_cost_data(
+        time_period=time_period,
+        granularity="DAILY",
+        apply_value_mappings=False,
+        cache=cache,
+        lazy=True,
+        **query,
+    )
+    ledger.update(
+        time_period=time_period,
+        rows=iter_costs_flat(results=results, cost_type=DEFAULT_COST_TYPE),
+        value_map1=value_map1,
+        value_map2=value_map2,
+        **query,
+    )
+    return time_period
@@ -1,24 +1,62 @@
+import json
+import os
+import sys
 from argparse import ArgumentParser
+from decimal import Decimal
+from threading import Thread
 
 from .aws_costs import (
     DEFAULT_COST_TYPE,
     DEFAULT_EXCLUDE_RECORD_TYPES,
     DEFAULT_GRANULARITY,
     DEFAULT_INCLUDE_RECORD_TYPES,
+    DEFAULT_MAX_MESSAGE_BYTES,
+    DEFAULT_MAX_WORKERS,
+    HOURLY_WINDOW_DAYS,
+    METRICS,
+    costs_message_title,
+    costs_to_csv,
     create_costs_message,
     create_costs_plain_output,
     get_time_period,
 )
+from .batch import load_config, plan_queries, report_specs, run_batch
+from .bundle import Bundle, BundleRecorder, ReplayClientPool
+from .cache import ResponseCache, default_cache_dir
+from .catalogue import set_default_catalogue
+from .clients import (
+    DEFAULT_MAX_POOL_CONNECTIONS,
+    ClientPool,
+    CredentialCache,
+    get_default_client_pool,
+    set_default_client_pool,
+)
+from .compare import (
+    COMPARE_PERIODS,
+    comparison_title,
+    create_comparison_message,
+    get_previous_period,
+)
+from .export import EXPORT_FORMATS, EXPORT_WRITERS, write_export
+from .instrument import Profiler
+from .ledger import (
+    DEFAULT_FINALIZE_DAY,
+    DEFAULT_RESTATEMENT_DAYS,
+    CostLedger,
+    default_ledger_path,
+    sync,
+)
+from .multigroup import costs_by_groups, plan_costs_by_groups
+from .ratelimit import DEFAULT_MAX_RETRIES, DEFAULT_RATE
+from .rollup import (
+    DEFAULT_FISCAL_YEAR_START,
+    DEFAULT_WEEK_START,
+    WEEKDAYS,
+    parse_week_start,
+)
 
 
-def main():
-    parser = ArgumentParser()
-    parser.add_argument(
-        "--start", help="Start date (YYYY-MM-DD, inclusive) (default yesterday)"
-    )
-    parser.add_argument(
-        "--end", help="End date (YYYY-MM-DD, exclusive) (default start+1 day)"
-    )
+def _add_query_arguments(parser):
     parser.add_argument(
         "--group1",
         default="accountname",
@@ -38,13 +76,18 @@ def main():
         ),
     )
     parser.add_argument(
-        "--assume-role", help="Optionally assume this role ARN to query Cost Explorer"
+        "--assume-role",
+        nargs="+",
+        help=(
+            "Optionally assume this role ARN to query Cost Explorer. "
+            "If multiple roles are given they are queried concurrently and merged. "
+            "The payer of each cost is only shown in flat output, "
+            "other outputs sum the costs of all payers."
+        ),
     )
     parser.add_argument(
-        "--granularity",
-        choices=["monthly", "daily"],
-        default=DEFAULT_GRANULARITY.lower(),
-        help="Fetch costs monthly or daily",
+        "--assume-role-file",
+        help="Read role ARNs to assume from this file, one per line",
     )
     parser.add_argument(
         "--exclude-types",
@@ -58,35 +101,684 @@ def main():
         default=DEFAULT_INCLUDE_RECORD_TYPES,
         help=f"Include these record types (default {DEFAULT_INCLUDE_RECORD_TYPES})",
     )
+
+
+def _get_role_arns(args):
+    """
+    :return: None, a single role ARN, or a list of role ARNs
+    """
+    role_arns = list(args.assume_role or [])
+    if args.assume_role_file:
+        with open(args.assume_role_file) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    role_arns.append(line)
+    if not role_arns:
+        return None
+    if len(role_arns) == 1:
+        return role_arns[0]
+    return role_arns
+
+
+def _add_cache_arguments(parser):
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help="Directory for cached Cost Explorer responses (default %(default)s)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Don't cache Cost Explorer responses"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached responses, but update the cache with new ones",
+    )
+    parser.add_argument(
+        "--cache-credentials",
+        action="store_true",
+        help="Store assumed role credentials in the cache directory until they expire",
+    )
+    parser.add_argument(
+        "--max-pool-connections",
+        type=int,
+        default=DEFAULT_MAX_POOL_CONNECTIONS,
+        help="HTTP connection pool size for each AWS client (default %(default)s)",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=DEFAULT_RATE,
+        help=(
+            "Maximum AWS API requests per second, reduced automatically when "
+            "throttled, 0 for no limit (default %(default)s)"
+        ),
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help="Maximum retries of each throttled AWS API call (default %(default)s)",
+    )
+    bundle = parser.add_mutually_exclusive_group()
+    bundle.add_argument(
+        "--record",
+        metavar="BUNDLE",
+        help=(
+            "Record every AWS API request and response to this compressed bundle file. "
+            "Cached responses are fetched again so they're recorded."
+        ),
+    )
+    bundle.add_argument(
+        "--replay",
+        metavar="BUNDLE",
+        help="Replay AWS API calls from a bundle file instead of calling AWS",
+    )
+
+
+def _configure_client_pool(args):
+    if args.replay:
+        set_default_client_pool(ReplayClientPool(Bundle(args.replay)))
+        return
+    credentials_dir = None
+    if args.cache_credentials:
+        credentials_dir = os.path.join(args.cache_dir, "credentials")
+    set_default_client_pool(
+        ClientPool(
+            credentials=CredentialCache(credentials_dir),
+            max_pool_connections=args.max_pool_connections,
+            rate=args.max_rate or None,
+            max_retries=args.max_retries,
+            recorder=BundleRecorder(args.record) if args.record else None,
+        )
+    )
+    if args.record:
+        # Start with an empty catalogue, dimension values already in it
+        # wouldn't be fetched and recorded
+        set_default_catalogue(None)
+
+
+def _close_client_pool(args):
+    get_default_client_pool().close()
+    if args.record:
+        print(f"Recorded AWS API calls to {args.record}", file=sys.stderr)
+
+
+def _get_cache(args):
+    if args.no_cache or args.replay:
+        return None
+    return ResponseCache(args.cache_dir, refresh=args.refresh or bool(args.record))
+
+
+def _print_cache_stats(cache):
+    if cache:
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
+    for service, stats in get_default_client_pool().rate_limit_stats().items():
+        if stats["throttles"]:
+            print(
+                f"{service}: throttled {stats['throttles']} times, "
+                f"{stats['retries']} retries, final rate {stats['rate']:.2f}/s",
+                file=sys.stderr,
+            )
+
+
+def _add_profile_arguments(parser):
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Print time spent in each stage, API calls, cache hits, retries and "
+            "the estimated Cost Explorer charge to stderr"
+        ),
+    )
+    parser.add_argument(
+        "--profile-json", metavar="FILE", help="Write the profile to this JSON file"
+    )
+
+
+def _start_profile(args):
+    if not (args.profile or args.profile_json):
+        return None
+    return Profiler().start()
+
+
+def _finish_profile(args, profiler):
+    if not profiler:
+        return
+    profiler.stop()
+    if args.profile:
+        print(profiler.format_summary(), file=sys.stderr)
+    if args.profile_json:
+        with open(args.profile_json, "w") as f:
+            json.dump(profiler.summary(), f, indent=2)
+
+
+def sync_main(argv):
+    parser = ArgumentParser(
+        prog="aws-costs sync",
+        description="Fetch daily costs since the last sync into a local ledger",
+    )
+    parser.add_argument(
+        "--ledger",
+        default=default_ledger_path(),
+        help="Ledger database (default %(default)s)",
+    )
+    parser.add_argument(
+        "--start",
+        help="Start date (YYYY-MM-DD) for the first sync (default start of previous month)",
+    )
+    parser.add_argument(
+        "--restatement-days",
+        type=int,
+        default=DEFAULT_RESTATEMENT_DAYS,
+        help="Fetch this many days before the last sync again (default %(default)s)",
+    )
+    parser.add_argument(
+        "--finalize-day",
+        type=int,
+        default=DEFAULT_FINALIZE_DAY,
+        help="Fetch the previous month again until this day of the month (default %(default)s)",
+    )
+    _add_query_arguments(parser)
+    _add_cache_arguments(parser)
+    _add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    _configure_client_pool(args)
+    profiler = _start_profile(args)
+    cache = _get_cache(args)
+    ledger = CostLedger(args.ledger)
+    role_arns = _get_role_arns(args)
+    if not isinstance(role_arns, list):
+        role_arns = [role_arns]
+    for role_arn in role_arns:
+        time_period = sync(
+            ledger=ledger,
+            role_arn=role_arn,
+            regions=None,
+            group1=args.group1,
+            group2=args.group2,
+            exclude_types=args.exclude_types,
+            include_types=args.include_types,
+            start=args.start,
+            restatement_days=args.restatement_days,
+            finalize_day=args.finalize_day,
+            cache=cache,
+        )
+        label = f"{role_arn}: " if role_arn else ""
+        if time_period:
+            print(f"{label}Synced {time_period['Start']} - {time_period['End']}")
+        else:
+            print(f"{label}Ledger is up to date")
+    _print_cache_stats(cache)
+    _close_client_pool(args)
+    _finish_profile(args, profiler)
+
+
+def batch_main(argv):
+    parser = ArgumentParser(
+        prog="aws-costs batch",
+        description=(
+            "Create multiple reports from a JSON or YAML config, "
+            "running each distinct Cost Explorer query once"
+        ),
+    )
+    parser.add_argument("config", help="Config file (.json, .yaml or .yml)")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the queries that would be run and the reports using them",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Maximum number of concurrent Cost Explorer queries (default %(default)s)",
+    )
+    parser.add_argument(
+        "--ledger",
+        help="Get costs from this ledger (see 'aws-costs sync') instead of Cost Explorer",
+    )
+    _add_cache_arguments(parser)
+    _add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.dry_run:
+        specs = report_specs(config)
+        for query, indices in plan_queries(specs, merge_accounts=not args.ledger):
+            print(json.dumps(query, sort_keys=True))
+            for n in indices:
+                print(f"  {specs[n]['name']}")
+        return
+
+    _configure_client_pool(args)
+    profiler = _start_profile(args)
+    cache = _get_cache(args)
+    ledger = None
+    if args.ledger:
+        ledger = CostLedger(args.ledger)
+    reports = run_batch(
+        config, cache=cache, max_workers=args.max_workers, ledger=ledger
+    )
+
+    failed = False
+    for report in reports:
+        if "error" in report:
+            print(f"{report['name']}: {report['error']}", file=sys.stderr)
+            failed = True
+        elif report["message"] is None:
+            print(f"{report['name']}: {report['title']}", file=sys.stderr)
+        else:
+            print(report["title"])
+            print(report["message"])
+    _print_cache_stats(cache)
+    _close_client_pool(args)
+    _finish_profile(args, profiler)
+    if failed:
+        sys.exit(1)
+
+
+def serve_main(argv):
+    # Imported here so other commands don't load http.server
+    from .serve import (
+        DEFAULT_HOST,
+        DEFAULT_MAX_ENTRIES,
+        DEFAULT_PORT,
+        DEFAULT_PREWARM_TIME,
+        DEFAULT_TTL_SECONDS,
+        CostService,
+        make_server,
+        prewarm_daily,
+    )
+    from .synthetic import SyntheticClientPool
+
+    parser = ArgumentParser(
+        prog="aws-costs serve",
+        description=(
+            "Serve reports over HTTP/JSON, caching query results in memory and "
+            "sharing concurrent identical queries. "
+            "POST /costs with a JSON object of options, e.g. "
+            '{"start": "2023-06-01", "end": "2023-07-01", "output": "summary"}. '
+            "GET /stats for cache statistics."
+        ),
+    )
+    parser.add_argument(
+        "--host", default=DEFAULT_HOST, help="Listen address (default %(default)s)"
+    )
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="Port (default %(default)s)"
+    )
+    _add_query_arguments(parser)
+    parser.add_argument(
+        "--granularity",
+        choices=["monthly", "daily"],
+        default=DEFAULT_GRANULARITY.lower(),
+        help="Default granularity of requests (default %(default)s)",
+    )
+    parser.add_argument(
+        "--max-entries",
+        type=int,
+        default=DEFAULT_MAX_ENTRIES,
+        help="Maximum number of query results held in memory (default %(default)s)",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        default=DEFAULT_TTL_SECONDS,
+        help="Seconds query results are held in memory (default %(default)s)",
+    )
+    parser.add_argument(
+        "--prewarm-at",
+        default=DEFAULT_PREWARM_TIME,
+        metavar="HH:MM",
+        help=(
+            "Fetch yesterday's and month to date costs at startup and every day "
+            "at this local time (default %(default)s)"
+        ),
+    )
+    parser.add_argument(
+        "--no-prewarm", action="store_true", help="Don't fetch costs in advance"
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Maximum number of concurrent Cost Explorer queries (default %(default)s)",
+    )
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="Serve generated costs instead of calling AWS, for trying out clients",
+    )
+    _add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+
+    _configure_client_pool(args)
+    if args.synthetic:
+        set_default_client_pool(SyntheticClientPool())
+    service = CostService(
+        defaults={
+            "role_arn": _get_role_arns(args),
+            "group1": args.group1,
+            "group2": args.group2,
+            "exclude_types": args.exclude_types,
+            "include_types": args.include_types,
+            "granularity": args.granularity,
+        },
+        cache=None if args.synthetic else _get_cache(args),
+        max_workers=args.max_workers,
+        max_entries=args.max_entries,
+        ttl=args.ttl,
+    )
+    if not args.no_prewarm:
+        Thread(
+            target=prewarm_daily, args=(service, args.prewarm_at), daemon=True
+        ).start()
+    server = make_server(service, args.host, args.port)
+    print(
+        f"Serving on http://{server.server_address[0]}:{server.server_address[1]}",
+        file=sys.stderr,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        _close_client_pool(args)
+
+
+def _output_file(output):
+    # Parquet and arrow are binary
+    if output in EXPORT_WRITERS and EXPORT_WRITERS[output].binary:
+        return sys.stdout.buffer
+    return sys.stdout
+
+
+def _groups_main(parser, args, time_period, granularity, role_arn, cache):
+    if args.ledger:
+        parser.error("--groups can't be used with --ledger")
+    if granularity not in ("DAILY", "MONTHLY"):
+        parser.error("--groups only supports daily and monthly granularity")
+    if args.dry_run:
+        plan = plan_costs_by_groups(
+            time_period=time_period,
+            groups=args.groups,
+            role_arn=role_arn,
+            cache=cache,
+        )
+        print(json.dumps(plan, indent=2))
+        return
+    header, rows = costs_by_groups(
+        time_period=time_period,
+        granularity=granularity,
+        groups=args.groups,
+        exclude_types=args.exclude_types,
+        include_types=args.include_types,
+        role_arn=role_arn,
+        cache=cache,
+        max_workers=args.max_workers,
+        metrics=args.metrics,
+        amount_type=Decimal if args.output in EXPORT_FORMATS else float,
+    )
+    if args.output in EXPORT_FORMATS:
+        write_export(
+            _output_file(args.output),
+            header,
+            rows,
+            args.output,
+            amounts=len(args.metrics or [DEFAULT_COST_TYPE]),
+        )
+    else:
+        costs_to_csv(header, rows, sys.stdout)
+
+
+def _compare_main(args, time_period, role_arn, cost_type, cache, ledger):
+    previous_period = get_previous_period(time_period, args.compare)
+    output_format = "csv" if args.output == "csv" else args.format
+    if output_format != "csv":
+        print(
+            comparison_title(
+                title_prefix="Command line test",
+                time_period=time_period,
+                previous_period=previous_period,
+                cost_type=cost_type,
+            )
+        )
+    create_comparison_message(
+        time_period=time_period,
+        previous_period=previous_period,
+        role_arn=role_arn,
+        regions=None,
+        title_prefix="Command line test",
+        group1=args.group1,
+        group2=args.group2,
+        exclude_types=args.exclude_types,
+        include_types=args.include_types,
+        output_format=output_format,
+        cost_type=cost_type,
+        cache=cache,
+        max_workers=args.max_workers,
+        ledger=ledger,
+        file=sys.stdout,
+    )
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == "sync":
+        return sync_main(argv[1:])
+    if argv and argv[0] == "batch":
+        return batch_main(argv[1:])
+    if argv and argv[0] == "serve":
+        return serve_main(argv[1:])
+
+    parser = ArgumentParser(
+        epilog=(
+            "Run 'aws-costs sync --help' for keeping a local ledger up to date, "
+            "'aws-costs batch --help' for creating multiple reports, "
+            "or 'aws-costs serve --help' for serving reports over HTTP"
+        )
+    )
+    parser.add_argument(
+        "--start", help="Start date (YYYY-MM-DD, inclusive) (default yesterday)"
+    )
+    parser.add_argument(
+        "--end", help="End date (YYYY-MM-DD, exclusive) (default start+1 day)"
+    )
+    _add_query_arguments(parser)
+    parser.add_argument(
+        "--granularity",
+        choices=[
+            "monthly",
+            "daily",
+            "hourly",
+            "weekly",
+            "quarterly",
+            "yearly",
+            "fiscal-yearly",
+        ],
+        default=DEFAULT_GRANULARITY.lower(),
+        help=(
+            "Fetch costs monthly, daily or hourly. "
+            "Hourly costs must be enabled in Cost Explorer, they are only available "
+            f"for the last 14 days and are fetched in windows of {HOURLY_WINDOW_DAYS} days. "
+            "Weekly, quarterly, yearly and fiscal-yearly costs are calculated from daily costs."
+        ),
+    )
+    parser.add_argument(
+        "--local-rollup",
+        action="store_true",
+        help="Calculate monthly costs from daily costs, e.g. to reuse cached daily costs",
+    )
+    parser.add_argument(
+        "--week-start",
+        type=str.lower,
+        choices=WEEKDAYS,
+        default=WEEKDAYS[DEFAULT_WEEK_START],
+        help="First day of the week for weekly granularity (default %(default)s)",
+    )
+    parser.add_argument(
+        "--fiscal-year-start",
+        type=int,
+        choices=range(1, 13),
+        metavar="MONTH",
+        default=DEFAULT_FISCAL_YEAR_START,
+        help="First month of the fiscal year for fiscal-yearly granularity (default %(default)s)",
+    )
+    parser.add_argument(
+        "--groups",
+        nargs="+",
+        metavar="DIMENSION",
+        help=(
+            "Group by any number of dimensions instead of --group1 and --group2, "
+            "e.g. 'accountname service Proj$'. Output is always flat. "
+            "Queries are filtered by the dimensions with the fewest values, "
+            "daily and monthly granularity only."
+        ),
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --groups print the query plan instead of running it",
+    )
+    parser.add_argument(
+        "--compare",
+        choices=COMPARE_PERIODS,
+        help=(
+            "Compare each group1/group2 cost with the previous period of the same "
+            "length, or the same period a week, month or year earlier, "
+            "biggest changes first. Both periods are fetched in one query if possible. "
+            "Output is a table in --format, or csv with --output csv."
+        ),
+    )
     parser.add_argument(
         "--output",
-        choices=["auto", "summary", "full", "csv", "flat"],
+        choices=["auto", "summary", "full", "csv", "flat"] + list(EXPORT_FORMATS),
         default="auto",
-        help="Type of message to output",
+        help=(
+            "Type of message to output. "
+            "ndjson, parquet and arrow are flat output with typed columns, "
+            "parquet and arrow require pyarrow."
+        ),
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        choices=METRICS,
+        help=(
+            f"Get these metrics in one query (default {DEFAULT_COST_TYPE}). "
+            "csv and flat output have columns for each metric, "
+            "other outputs only support one."
+        ),
+    )
+    parser.add_argument(
+        "--format",
+        choices=["md", "html"],
+        default="md",
+        help="Format of summary and full messages (default %(default)s)",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        default=DEFAULT_MAX_MESSAGE_BYTES,
+        help=(
+            "Size budget of auto output. The summary is shown, then breakdowns of the "
+            "highest cost group1 values until the budget is used, tables that don't fit "
+            "end with an 'Other' row (default %(default)s)"
+        ),
     )
+    parser.add_argument(
+        "--window-months",
+        type=int,
+        help="Split the time period into windows of this many months and query them concurrently",
+    )
+    parser.add_argument(
+        "--window-days",
+        type=int,
+        help="Split the time period into windows of this many days and query them concurrently (daily granularity only)",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Maximum number of concurrent Cost Explorer queries (default %(default)s)",
+    )
+    _add_cache_arguments(parser)
+    _add_profile_arguments(parser)
+    parser.add_argument(
+        "--ledger",
+        help="Get costs from this ledger (see 'aws-costs sync') instead of Cost Explorer",
+    )
+
+    args = parser.parse_args(argv)
+    cost_type = DEFAULT_COST_TYPE
+    plain_outputs = ("csv", "flat") + EXPORT_FORMATS
+    if args.metrics and args.output not in plain_outputs and not args.groups:
+        if len(args.metrics) > 1:
+            parser.error(f"--output {args.output} only supports one metric")
+        cost_type = args.metrics[0]
 
-    args = parser.parse_args()
+    if args.compare and (args.groups or args.output not in ("auto", "full", "csv")):
+        parser.error("--compare only supports --output auto, full or csv")
+    if args.window_months and args.granularity == "hourly":
+        parser.error("--window-months can't be used with hourly granularity")
+    if args.window_days and args.granularity == "monthly":
+        parser.error("--window-days can't be used with monthly granularity")
+
+    _configure_client_pool(args)
+    profiler = _start_profile(args)
+    cache = _get_cache(args)
+    ledger = None
+    if args.ledger:
+        ledger = CostLedger(args.ledger)
+    role_arn = _get_role_arns(args)
 
     time_period = get_time_period(startdate=args.start, enddate=args.end)
-    if args.output in ("csv", "flat"):
-        message = create_costs_plain_output(
-            role_arn=args.assume_role,
+    granularity = args.granularity.upper().replace("-", "_")
+    if args.groups:
+        _groups_main(parser, args, time_period, granularity, role_arn, cache)
+    elif args.compare:
+        _compare_main(args, time_period, role_arn, cost_type, cache, ledger)
+    elif args.output in plain_outputs:
+        create_costs_plain_output(
+            role_arn=role_arn,
             time_period=time_period,
-            cost_type=DEFAULT_COST_TYPE,
-            granularity=args.granularity.upper(),
+            cost_type=cost_type,
+            granularity=granularity,
             regions=None,
             group1=args.group1,
             group2=args.group2,
             exclude_types=args.exclude_types,
             include_types=args.include_types,
             output=args.output,
+            metrics=args.metrics,
+            cache=cache,
+            window_months=args.window_months,
+            window_days=args.window_days,
+            max_workers=args.max_workers,
+            ledger=ledger,
+            local_rollup=args.local_rollup,
+            week_start=parse_week_start(args.week_start),
+            fiscal_year_start=args.fiscal_year_start,
+            file=_output_file(args.output),
         )
     else:
-        message, title = create_costs_message(
-            role_arn=args.assume_role,
+        print(
+            costs_message_title(
+                title_prefix="Command line test",
+                time_period=time_period,
+                cost_type=cost_type,
+            )
+        )
+        create_costs_message(
+            role_arn=role_arn,
             time_period=time_period,
-            cost_type=DEFAULT_COST_TYPE,
-            granularity=args.granularity.upper(),
+            cost_type=cost_type,
+            granularity=granularity,
             regions=None,
             title_prefix="Command line test",
             group1=args.group1,
@@ -94,9 +786,22 @@ def main():
             exclude_types=args.exclude_types,
             include_types=args.include_types,
             output=args.output,
+            output_format=args.format,
+            cache=cache,
+            window_months=args.window_months,
+            window_days=args.window_days,
+            max_workers=args.max_workers,
+            ledger=ledger,
+            local_rollup=args.local_rollup,
+            week_start=parse_week_start(args.week_start),
+            fiscal_year_start=args.fiscal_year_start,
+            file=sys.stdout,
+            max_bytes=args.max_bytes,
         )
-        print(title)
-    print(message)
+
+    _print_cache_stats(cache)
+    _close_client_pool(args)
+    _finish_profile(args, profiler)
 
 
 if __name__ == "__main__":
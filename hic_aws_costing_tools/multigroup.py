@@ -0,0 +1,267 @@
+"""
+Group costs by more than two dimensions
+
+Cost Explorer only allows two GroupBy keys. To group by more, the two dimensions
+with the most values are used as GroupBy keys and the others are filtered, with a
+query for each combination of their values. Filtering the dimensions with the
+fewest values minimises the number of queries.
+"""
+
+import asyncio
+from itertools import product
+
+from .aws_costs import (
+    DEFAULT_COST_TYPE,
+    DEFAULT_MAX_WORKERS,
+    _cache_namespace,
+    _expected_unit,
+    _get_filter,
+    _get_group_by,
+    _group_by_definition,
+    _in_thread,
+    _is_account_name,
+    _sync,
+    iter_cost_and_usage,
+)
+from .catalogue import get_default_catalogue
+from .clients import get_default_client_pool
+from .instrument import timed
+
+# Cost Explorer limit
+MAX_GROUP_BY = 2
+
+
+def plan_grouping(cardinality, max_group_by=MAX_GROUP_BY):
+    """
+    Choose which dimensions to group by and which to filter
+
+    :param cardinality: Dict of dimension: number of values, in output order
+    :return: (group by dimensions, filter dimensions), both in output order
+    """
+    ranked = sorted(cardinality, key=lambda d: cardinality[d], reverse=True)
+    group_by = [d for d in cardinality if d in ranked[:max_group_by]]
+    filter_by = [d for d in cardinality if d not in group_by]
+    return group_by, filter_by
+
+
+def _value_filter(dimension, value):
+    definition = _group_by_definition(dimension)
+    if definition["Type"] == "TAG":
+        # Tag values are returned as key$value, untagged costs have an empty value
+        value = value.split("$", 1)[1]
+        if not value:
+            return {"Tags": {"Key": definition["Key"], "MatchOptions": ["ABSENT"]}}
+        return {"Tags": {"Key": definition["Key"], "Values": [value]}}
+    return {"Dimensions": {"Key": definition["Key"], "Values": [value]}}
+
+
+def _check_groups(groups):
+    keys = [tuple(_group_by_definition(g).values()) for g in groups]
+    if len(set(keys)) != len(keys):
+        raise ValueError(f"Duplicate dimensions: {groups}")
+
+
+async def _plan_async(*, time_period, groups, ce, catalogue, namespace):
+    outputs = await asyncio.gather(
+        *(
+            _in_thread(_get_group_by, ce, time_period, g, catalogue, namespace)
+            for g in groups
+        )
+    )
+    values = {}
+    value_maps = {}
+    for g, (_, all_values, value_map) in zip(groups, outputs):
+        all_values = set(all_values)
+        if g[-1] == "$":
+            # Include untagged costs, key$ with an empty value
+            all_values.add(g)
+        values[g] = sorted(all_values)
+        if _is_account_name(g):
+            value_maps[g] = value_map
+
+    group_by, filter_by = plan_grouping({g: len(v) for (g, v) in values.items()})
+    queries = 1
+    for g in filter_by:
+        queries *= len(values[g])
+    plan = {
+        "groups": list(groups),
+        "cardinality": {g: len(v) for (g, v) in values.items()},
+        "group_by": group_by,
+        "filter_by": filter_by,
+        "filter_values": {g: values[g] for g in filter_by},
+        "queries": queries,
+    }
+    return plan, value_maps
+
+
+async def _client(role_arn, cache, client_pool):
+    """
+    :return: (Cost Explorer client, namespace for the cache and catalogue)
+    """
+    if isinstance(role_arn, (list, tuple)):
+        raise ValueError("Only one role can be queried when grouping by dimensions")
+    pool = client_pool or get_default_client_pool()
+    ce = await _in_thread(pool.client, "ce", role_arn=role_arn)
+    namespace = await _in_thread(_cache_namespace, pool, role_arn)
+    if cache:
+        ce = cache.wrap(ce, namespace=namespace)
+    return ce, namespace
+
+
+async def plan_costs_by_groups_async(
+    *,
+    time_period,
+    groups,
+    role_arn=None,
+    cache=None,
+    client_pool=None,
+    catalogue=None,
+):
+    """
+    Plan the queries for costs_by_groups without running them
+
+    Only the dimension values are fetched.
+
+    :return: JSON serialisable dict of the cardinality of each dimension, the
+      group_by and filter_by dimensions, the filter_values for each combination,
+      and the number of cost queries
+    """
+    _check_groups(groups)
+    ce, namespace = await _client(role_arn, cache, client_pool)
+    plan, _ = await _plan_async(
+        time_period=time_period,
+        groups=groups,
+        ce=ce,
+        catalogue=catalogue or get_default_catalogue(),
+        namespace=namespace,
+    )
+    return plan
+
+
+plan_costs_by_groups = _sync(plan_costs_by_groups_async, "plan_costs_by_groups")
+
+
+def _iter_query_rows(ce, kwargs, labels, metrics, expected_units, amount_type):
+    """
+    :param labels: List of the output values for each group, None for the GroupBy
+      keys which are filled in from each result group
+    """
+    positions = [n for (n, v) in enumerate(labels) if v is None]
+    for result in iter_cost_and_usage(ce, **kwargs):
+        start = result["TimePeriod"]["Start"]
+        end = result["TimePeriod"]["End"]
+        for g in result["Groups"]:
+            row = list(labels)
+            for n, key in zip(positions, g["Keys"]):
+                row[n] = key
+            for metric, expected_unit in zip(metrics, expected_units):
+                m = g["Metrics"][metric]
+                if expected_unit and m["Unit"] != expected_unit:
+                    raise RuntimeError(f"Unexpected unit: {m['Unit']}")
+                row.append(amount_type(m["Amount"]))
+            yield (start, end) + tuple(row)
+
+
+@timed("fetch")
+def _fetch_rows(rows):
+    return list(rows)
+
+
+async def costs_by_groups_async(
+    *,
+    time_period,
+    granularity,
+    groups,
+    regions=None,
+    exclude_types,
+    include_types,
+    role_arn=None,
+    cache=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    client_pool=None,
+    catalogue=None,
+    metrics=None,
+    apply_value_mappings=True,
+    amount_type=float,
+):
+    """
+    Get costs grouped by any number of dimensions and tags
+
+    The filtered queries are run concurrently, up to max_workers at a time. See
+    plan_costs_by_groups for the queries.
+
+    :param granularity: DAILY or MONTHLY, rollups aren't supported
+    :param groups: Dimensions as in group1 and group2, e.g.
+      ["accountname", "service", "Proj$"]
+    :param metrics: Metrics to get, default [DEFAULT_COST_TYPE]
+    :param amount_type: Converts each Amount string, e.g. decimal.Decimal to keep
+      every digit
+    :return: (header, rows) where each row is
+      (start, end, value of each group..., value of each metric...)
+    """
+    if granularity not in ("DAILY", "MONTHLY"):
+        raise ValueError(f"Invalid granularity for grouping: {granularity}")
+    _check_groups(groups)
+    metrics = list(metrics or [DEFAULT_COST_TYPE])
+    ce, namespace = await _client(role_arn, cache, client_pool)
+    plan, value_maps = await _plan_async(
+        time_period=time_period,
+        groups=groups,
+        ce=ce,
+        catalogue=catalogue or get_default_catalogue(),
+        namespace=namespace,
+    )
+
+    base_filter = _get_filter(regions, exclude_types, include_types)
+    kwargs = dict(
+        Granularity=granularity,
+        GroupBy=[_group_by_definition(g) for g in plan["group_by"]],
+        Metrics=metrics,
+        TimePeriod=time_period,
+    )
+    expected_units = [_expected_unit(m) for m in metrics]
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def query(combination):
+        filters = [_value_filter(g, v) for (g, v) in combination]
+        if base_filter:
+            filters = base_filter.get("And", [base_filter]) + filters
+        query_kwargs = dict(kwargs)
+        if len(filters) > 1:
+            query_kwargs["Filter"] = {"And": filters}
+        elif filters:
+            query_kwargs["Filter"] = filters[0]
+        values = dict(combination)
+        labels = [values.get(g) for g in groups]
+        async with semaphore:
+            return await _in_thread(
+                _fetch_rows,
+                _iter_query_rows(
+                    ce, query_kwargs, labels, metrics, expected_units, amount_type
+                ),
+            )
+
+    filter_by = plan["filter_by"]
+    combinations = product(
+        *([(g, v) for v in plan["filter_values"][g]] for g in filter_by)
+    )
+    outputs = await asyncio.gather(*(query(c) for c in combinations))
+
+    rows = [row for output in outputs for row in output]
+    # Results are in query order, put them in period order
+    rows.sort(key=lambda r: r[0])
+    if apply_value_mappings and value_maps:
+        positions = [
+            (n + 2, value_maps[g]) for (n, g) in enumerate(groups) if g in value_maps
+        ]
+        for i, row in enumerate(rows):
+            row = list(row)
+            for n, value_map in positions:
+                row[n] = value_map.get(row[n], row[n])
+            rows[i] = tuple(row)
+
+    header = ["START", "END"] + list(groups) + metrics
+    return header, rows
+
+
+costs_by_groups = _sync(costs_by_groups_async, "costs_by_groups")
@@ -0,0 +1,158 @@
+"""
+Pivot Cost Explorer results into a group1 x group2 table
+"""
+
+# Number of groups to collect before adding them to a dense array
+DENSE_BATCH_SIZE = 1000000
+
+
+class CostPivot:
+    """
+    Costs indexed by (group1, group2) value
+
+    Values are mapped to row/column indices once, and results are accumulated in
+    a single pass over the returned groups. Cells are stored sparsely in a dict
+    unless dense=True, in which case a NumPy array is used.
+    Groups with values that aren't in all_values1 or all_values2 are ignored.
+    """
+
+    def __init__(self, all_values1, all_values2, *, dense=False):
+        self.values1 = sorted(all_values1)
+        self.values2 = sorted(all_values2)
+        self.index1 = {v: i for (i, v) in enumerate(self.values1)}
+        self.index2 = {v: i for (i, v) in enumerate(self.values2)}
+        self.dense = dense
+        if dense:
+            import numpy
+
+            self._array = numpy.zeros((len(self.values1), len(self.values2)))
+        else:
+            # Key is row * len(values2) + column
+            self._cells = {}
+
+    def add_results(self, results, cost_type, expected_unit):
+        """
+        Accumulate costs from ResultsByTime
+
+        :param expected_unit: Raise an error if a cost has a different unit, None to skip
+        """
+        index1 = self.index1
+        index2 = self.index2
+        ncols = len(self.values2)
+        if self.dense:
+            keys = []
+            amounts = []
+        else:
+            cells = self._cells
+            get = cells.get
+        for result in results:
+            for g in result["Groups"]:
+                metric = g["Metrics"][cost_type]
+                if expected_unit and metric["Unit"] != expected_unit:
+                    raise RuntimeError(f"Unexpected unit: {metric['Unit']}")
+                g1, g2 = g["Keys"]
+                i = index1.get(g1)
+                j = index2.get(g2)
+                if i is None or j is None:
+                    continue
+                key = i * ncols + j
+                if self.dense:
+                    keys.append(key)
+                    amounts.append(float(metric["Amount"]))
+                else:
+                    cells[key] = get(key, 0) + float(metric["Amount"])
+            if self.dense and len(keys) > DENSE_BATCH_SIZE:
+                self._add_dense(keys, amounts)
+                keys = []
+                amounts = []
+        if self.dense and keys:
+            self._add_dense(keys, amounts)
+
+    def add_frame(self, frame, cost_type, expected_unit):
+        """
+        Accumulate costs from a CostFrame
+
+        Each label is looked up once, rows are then mapped by their integer codes.
+        """
+        if expected_unit:
+            unit = frame.unit(cost_type)
+            if unit is not None and unit != expected_unit:
+                raise RuntimeError(f"Unexpected unit: {unit}")
+        ncols = len(self.values2)
+        # Relabelled frames may map several codes to the same label
+        rows = [self.index1.get(v, -1) for v in frame.labels1]
+        cols = [self.index2.get(v, -1) for v in frame.labels2]
+
+        if self.dense:
+            import numpy
+
+            if not len(frame):
+                return
+            i = numpy.array(rows, dtype=numpy.int64)[
+                numpy.frombuffer(frame.key1, dtype=frame.key1.typecode)
+            ]
+            j = numpy.array(cols, dtype=numpy.int64)[
+                numpy.frombuffer(frame.key2, dtype=frame.key2.typecode)
+            ]
+            amounts = numpy.fromiter(
+                frame.iter_amounts(cost_type), dtype=float, count=len(frame)
+            )
+            valid = (i >= 0) & (j >= 0)
+            self._add_dense(i[valid] * ncols + j[valid], amounts[valid])
+            return
+
+        cells = self._cells
+        get = cells.get
+        for k1, k2, amount in zip(
+            frame.key1, frame.key2, frame.iter_amounts(cost_type)
+        ):
+            i = rows[k1]
+            j = cols[k2]
+            if i < 0 or j < 0:
+                continue
+            key = i * ncols + j
+            cells[key] = get(key, 0) + amount
+
+    def _add_dense(self, keys, amounts):
+        import numpy
+
+        self._array += numpy.bincount(
+            keys, weights=amounts, minlength=self._array.size
+        ).reshape(self._array.shape)
+
+    def cells(self):
+        """
+        Iterate over non-empty cells
+        :return: Iterator of (group1 value, group2 value, cost)
+        """
+        if self.dense:
+            for i, j in zip(*self._array.nonzero()):
+                yield self.values1[i], self.values2[j], float(self._array[i, j])
+        else:
+            ncols = len(self.values2)
+            for key, cost in self._cells.items():
+                i, j = divmod(key, ncols)
+                yield self.values1[i], self.values2[j], cost
+
+    def to_table(self, group1):
+        """
+        Convert to a dense table
+        :return: (header, rows) where each row is [group1 value, costs..., total]
+        """
+        header = [group1] + self.values2 + ["TOTAL"]
+        if self.dense:
+            totals = self._array.sum(axis=1).tolist()
+            costs = [
+                [v] + row + [total]
+                for (v, row, total) in zip(self.values1, self._array.tolist(), totals)
+            ]
+            return header, costs
+
+        ncols = len(self.values2)
+        costs = [[v] + [0] * (ncols + 1) for v in self.values1]
+        for key, cost in self._cells.items():
+            i, j = divmod(key, ncols)
+            row = costs[i]
+            row[j + 1] = cost
+            row[-1] += cost
+        return header, costs
@@ -0,0 +1,263 @@
+"""
+Rate limiting and retries for AWS API calls
+
+A RateLimiter is shared by every thread (and so every async task, since API calls
+run in threads) calling a service. Calls take a token from a token bucket, and
+throttled calls are retried with exponential backoff and full jitter. Each
+throttle halves the rate and each success increases it again up to the maximum,
+so concurrent queries settle at the highest rate the service allows.
+"""
+
+import logging
+import random
+import threading
+import time
+from functools import partial
+
+from . import instrument
+
+# Requests per second
+DEFAULT_RATE = 5
+DEFAULT_MIN_RATE = 0.2
+DEFAULT_MAX_RETRIES = 8
+# Maximum retries in DEFAULT_RETRY_BUDGET_SECONDS, so a run that is throttled
+# continuously eventually fails instead of retrying every call. The budget
+# refills over time since a RateLimiter lives as long as a server or Lambda process.
+DEFAULT_RETRY_BUDGET = 200
+DEFAULT_RETRY_BUDGET_SECONDS = 600
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30
+
+THROTTLING_ERROR_CODES = {
+    "LimitExceededException",
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+}
+RATE_LIMITED_OPERATIONS = {
+    "assume_role",
+    "get_cost_and_usage",
+    "get_dimension_values",
+    "get_tags",
+}
+
+log = logging.getLogger(__name__)
+
+
+# botocore is imported by these functions instead of at module load, since they
+# are only called for errors raised by a client which has already imported it
+
+
+def is_throttling_error(e):
+    from botocore.exceptions import ClientError
+
+    return (
+        isinstance(e, ClientError)
+        and e.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    )
+
+
+def _is_transient_error(e):
+    from botocore.exceptions import ClientError
+    from botocore.exceptions import ConnectionError as BotocoreConnectionError
+    from botocore.exceptions import HTTPClientError
+
+    if isinstance(e, (BotocoreConnectionError, HTTPClientError)):
+        return True
+    if isinstance(e, ClientError):
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return status >= 500
+    return False
+
+
+def _emit_call(operation, start, response, error):
+    code = None
+    if error is not None:
+        from botocore.exceptions import ClientError
+
+        code = type(error).__name__
+        if isinstance(error, ClientError):
+            code = error.response.get("Error", {}).get("Code", code)
+    instrument.emit(
+        {
+            "event": "api_call",
+            "operation": operation,
+            "seconds": time.perf_counter() - start,
+            "bytes": 0 if response is None else instrument.response_size(response),
+            "error": code,
+        }
+    )
+
+
+class RateLimiter:
+    """
+    Thread-safe adaptive token bucket with retries
+    """
+
+    def __init__(
+        self,
+        *,
+        rate=DEFAULT_RATE,
+        burst=None,
+        min_rate=DEFAULT_MIN_RATE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        retry_budget=DEFAULT_RETRY_BUDGET,
+        retry_budget_seconds=DEFAULT_RETRY_BUDGET_SECONDS,
+        base_delay=DEFAULT_BASE_DELAY,
+        max_delay=DEFAULT_MAX_DELAY,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        """
+        :param rate: Maximum requests per second, None for no limit
+        :param burst: Maximum requests at once after being idle, default rate
+        :param min_rate: Throttling doesn't reduce the rate below this
+        :param max_retries: Maximum retries of each call
+        :param retry_budget: Maximum retries of all calls in retry_budget_seconds,
+          a token bucket which refills at retry_budget / retry_budget_seconds per second
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or rate or 1
+        self.min_rate = min(min_rate, rate) if rate else min_rate
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.retry_budget_seconds = retry_budget_seconds
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.burst
+        self._updated = clock()
+        self._retry_tokens = retry_budget
+        self._retry_updated = self._updated
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+
+    def acquire(self):
+        """
+        Wait for a token
+        """
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return
+                now = self._clock()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def _throttled(self):
+        with self._lock:
+            self.throttles += 1
+            if self.rate:
+                self.rate = max(self.min_rate, self.rate / 2)
+
+    def _succeeded(self):
+        with self._lock:
+            self.calls += 1
+            if self.rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def _retry(self, attempt):
+        with self._lock:
+            if attempt >= self.max_retries:
+                return False
+            now = self._clock()
+            self._retry_tokens = min(
+                self.retry_budget,
+                self._retry_tokens
+                + (now - self._retry_updated)
+                * self.retry_budget
+                / self.retry_budget_seconds,
+            )
+            self._retry_updated = now
+            if self._retry_tokens < 1:
+                return False
+            self._retry_tokens -= 1
+            self.retries += 1
+            return True
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func when a token is available, retrying throttling and transient errors
+        """
+        return self.call_operation(
+            getattr(func, "__name__", None), func, *args, **kwargs
+        )
+
+    def call_operation(self, operation, func, *args, **kwargs):
+        """
+        call() with the operation name for instrumentation
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if instrument.enabled():
+                    _emit_call(operation, start, None, e)
+                throttled = is_throttling_error(e)
+                if not throttled and not _is_transient_error(e):
+                    raise
+                if throttled:
+                    self._throttled()
+                if not self._retry(attempt):
+                    raise
+                if instrument.enabled():
+                    instrument.emit(
+                        {
+                            "event": "retry",
+                            "operation": operation,
+                            "throttled": throttled,
+                        }
+                    )
+                delay = random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2**attempt)
+                )
+                attempt += 1
+                log.debug(f"Retry {attempt} of {operation} in {delay:.2f}s: {e}")
+                self._sleep(delay)
+                continue
+            if instrument.enabled():
+                _emit_call(operation, start, result, None)
+            self._succeeded()
+            return result
+
+    def wrap(self, client):
+        return RateLimitedClient(client, self)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "throttles": self.throttles,
+            "retries": self.retries,
+            "rate": self.rate,
+        }
+
+
+class RateLimitedClient:
+    """
+    Wraps a boto3 client, calling RATE_LIMITED_OPERATIONS through a RateLimiter
+    """
+
+    def __init__(self, client, rate_limiter):
+        self._client = client
+        self._rate_limiter = rate_limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in RATE_LIMITED_OPERATIONS:
+            return partial(self._rate_limiter.call_operation, name, attr)
+        return attr
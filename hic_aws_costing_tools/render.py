@@ -0,0 +1,346 @@
+"""
+Streaming renderers for cost reports
+
+A report is traversed once by write_summary() or write_all(), which call a
+renderer to write tables to a file-like object as they go, so output size
+doesn't affect memory use and there's no repeated string concatenation.
+Markdown and HTML tables are formatted and written in one go, since many small
+writes are much slower.
+"""
+
+import csv
+import heapq
+from html import escape
+
+
+class Renderer:
+    """
+    Writes tables to a file-like object
+
+    Cells are passed as raw values, subclasses format them.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, s):
+        self.file.write(s)
+
+    def begin_table(self, title, columns, group=None):
+        """
+        :param title: Heading for the table
+        :param columns: Column names
+        :param group: Optional (column name, value) if this table is one of a
+          series grouped by a value, e.g. one table per account
+        """
+        raise NotImplementedError()
+
+    def row(self, cells):
+        raise NotImplementedError()
+
+    def end_table(self):
+        raise NotImplementedError()
+
+    def table(self, title, columns, rows, group=None):
+        """
+        Write a whole table
+
+        :param rows: Iterable of lists of cells
+        """
+        self.begin_table(title, columns, group)
+        for cells in rows:
+            self.row(cells)
+        self.end_table()
+
+    def separator(self):
+        """
+        Separate two reports written to the same file
+        """
+        raise NotImplementedError()
+
+
+def _format_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def _md_cell(value):
+    if isinstance(value, str):
+        return value.replace("|", "\\|")
+    return _format_cell(value).replace("|", "\\|")
+
+
+class MarkdownRenderer(Renderer):
+    def _cells(self, cells):
+        return "|".join(map(_md_cell, cells))
+
+    def begin_table(self, title, columns, group=None):
+        self._grouped = group is not None
+        self.write(f"## {title}\n\n|{self._cells(columns)}|\n")
+        self.write("|" + "|".join("-" * len(columns)) + "|\n")
+
+    def row(self, cells):
+        self.write(f"|{self._cells(cells)}|\n")
+
+    def end_table(self):
+        # Grouped tables follow each other so they need a blank line between them
+        if self._grouped:
+            self.write("\n")
+
+    def table(self, title, columns, rows, group=None):
+        lines = [
+            f"## {title}\n\n|{self._cells(columns)}|\n",
+            "|" + "|".join("-" * len(columns)) + "|\n",
+        ]
+        lines.extend(f"|{self._cells(cells)}|\n" for cells in rows)
+        if group is not None:
+            lines.append("\n")
+        self.write("".join(lines))
+
+    def separator(self):
+        self.write("\n---\n")
+
+
+class HtmlRenderer(Renderer):
+    def _cells(self, tag, cells):
+        return "".join(f"<{tag}>{escape(_format_cell(c))}</{tag}>" for c in cells)
+
+    def begin_table(self, title, columns, group=None):
+        self.write(f"<h2>{escape(str(title))}</h2>\n<table>\n")
+        self.write(f"<tr>{self._cells('th', columns)}</tr>\n")
+
+    def row(self, cells):
+        self.write(f"<tr>{self._cells('td', cells)}</tr>\n")
+
+    def end_table(self):
+        self.write("</table>\n")
+
+    def table(self, title, columns, rows, group=None):
+        lines = [
+            f"<h2>{escape(str(title))}</h2>\n<table>\n",
+            f"<tr>{self._cells('th', columns)}</tr>\n",
+        ]
+        lines.extend(f"<tr>{self._cells('td', cells)}</tr>\n" for cells in rows)
+        lines.append("</table>\n")
+        self.write("".join(lines))
+
+    def separator(self):
+        self.write("\n---\n")
+
+
+class CsvRenderer(Renderer):
+    """
+    Writes grouped tables as a single CSV table with the group as the first column
+
+    Titles are omitted, and the header is only written when the columns change.
+    """
+
+    def __init__(self, file):
+        super().__init__(file)
+        self.writer = csv.writer(file)
+        self._header = None
+        self._prefix = ()
+
+    def begin_table(self, title, columns, group=None):
+        header = list(columns)
+        self._prefix = ()
+        if group is not None:
+            header.insert(0, group[0])
+            self._prefix = (group[1],)
+        if header != self._header:
+            self.writer.writerow(header)
+            self._header = header
+
+    def row(self, cells):
+        self.writer.writerow(self._prefix + tuple(cells))
+
+    def end_table(self):
+        pass
+
+    def separator(self):
+        # A new header starts a new table
+        self._header = None
+
+
+RENDERERS = {
+    "md": MarkdownRenderer,
+    "html": HtmlRenderer,
+    "csv": CsvRenderer,
+}
+
+
+def get_renderer(output_format, file):
+    try:
+        cls = RENDERERS[output_format]
+    except KeyError:
+        raise ValueError(f"Invalid output type: {output_format}")
+    return cls(file)
+
+
+def _other_label(count):
+    return f"Other ({count} item{'' if count == 1 else 's'})"
+
+
+class _ByteCounter:
+    """
+    File-like object that counts the UTF-8 bytes written to it
+    """
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, s):
+        self.size += len(s.encode())
+
+
+def _table_size(renderer, title, columns, rows, group=None):
+    counter = _ByteCounter()
+    type(renderer)(counter).table(title, columns, rows, group)
+    return counter.size
+
+
+def fit_rows(renderer, title, columns, cells, max_bytes, group=None):
+    """
+    Select the highest cost rows of a table that fit in a byte budget
+
+    Rows are popped from a heap so only the rows that fit are ordered, and the
+    rows that don't fit are folded into an "Other (k items)" row. Each row is
+    measured as it's selected, nothing is rendered and thrown away.
+
+    :param renderer: Renderer the table will be written with, the table is
+      measured with a new renderer of the same type
+    :param cells: List of (name, cost)
+    :return: (rows, size in bytes), or (None, 0) if the table doesn't fit
+    """
+    counter = _ByteCounter()
+    measure = type(renderer)(counter)
+    measure.begin_table(title, columns, group)
+    measure.end_table()
+    size = counter.size
+
+    def row_size(row):
+        counter.size = 0
+        measure.row(row)
+        return counter.size
+
+    heap = [(-cost, name) for (name, cost) in cells]
+    heapq.heapify(heap)
+    total = sum(cost for (_, cost) in cells)
+    rows = []
+    sizes = []
+    selected = 0.0
+    while heap:
+        row = [heap[0][1], -heap[0][0]]
+        needed = row_size(row)
+        if len(heap) > 1:
+            # Leave room for the Other row
+            needed += row_size([_other_label(len(heap) - 1), total - selected - row[1]])
+        if size + needed > max_bytes:
+            break
+        heapq.heappop(heap)
+        rows.append(row)
+        sizes.append(row_size(row))
+        size += sizes[-1]
+        selected += row[1]
+
+    if heap:
+        other = [_other_label(len(heap)), -sum(cost for (cost, _) in heap)]
+        # The Other amount may be wider than the one room was left for
+        while rows and size + row_size(other) > max_bytes:
+            row = rows.pop()
+            size -= sizes.pop()
+            heapq.heappush(heap, (-row[1], row[0]))
+            other = [_other_label(len(heap)), -sum(cost for (cost, _) in heap)]
+        rows.append(other)
+        size += row_size(other)
+    if size > max_bytes:
+        return None, 0
+    return rows, size
+
+
+def write_summary(renderer, header, group1, costs, unit, max_bytes=None):
+    """
+    Write the total cost for each group1 value, highest first
+
+    :param costs: Rows of [group1 value, costs..., total]
+    :param max_bytes: If set only write the highest totals that fit in this many
+      bytes, see fit_rows(). If even the Other row doesn't fit it's written anyway.
+    :return: Size in bytes if max_bytes is set
+    """
+    if max_bytes is None:
+        costs_dsc = sorted(costs, key=lambda r: r[-1], reverse=True)
+        sum_total = sum(row[-1] for row in costs_dsc)
+        renderer.table(
+            f"Totals: {unit} {sum_total:.2f}",
+            [group1, "Total"],
+            ([row[0], row[-1]] for row in costs_dsc),
+        )
+        return None
+    title = f"Totals: {unit} {sum(row[-1] for row in costs):.2f}"
+    rows, size = fit_rows(
+        renderer,
+        title,
+        [group1, "Total"],
+        [(row[0], row[-1]) for row in costs],
+        max_bytes,
+    )
+    if rows is None:
+        rows = [[_other_label(len(costs)), sum(row[-1] for row in costs)]]
+        size = _table_size(renderer, title, [group1, "Total"], rows)
+    renderer.table(title, [group1, "Total"], rows)
+    return size
+
+
+def write_all(renderer, header, costs, group1, group2, exclude_zero):
+    """
+    Write a table of group2 costs for each group1 value
+
+    :param costs: Rows of [group1 value, costs..., total]
+    """
+    columns = header[1:-1]
+    for row in sorted(costs, key=lambda r: r[0]):
+        cells = zip(columns, row[1:-1])
+        if exclude_zero:
+            cells = (c for c in cells if c[1] != 0)
+        renderer.table(row[0], [group2, "Cost"], cells, group=(group1, row[0]))
+
+
+def write_budgeted(renderer, header, costs, group1, group2, unit, max_bytes):
+    """
+    Write the summary, then the non-zero group2 costs of the highest cost group1
+    values until max_bytes is used
+
+    Tables that don't fit are cut short with an "Other (k items)" row, see fit_rows().
+
+    :param costs: Rows of [group1 value, costs..., total]
+    """
+    costs = list(costs)
+    size = write_summary(renderer, header, group1, costs, unit, max_bytes)
+
+    counter = _ByteCounter()
+    type(renderer)(counter).separator()
+    remaining = max_bytes - size - counter.size
+    # No table is smaller than one with no title or rows
+    min_size = _table_size(renderer, "", [group2, "Cost"], [], (group1, ""))
+    columns = header[1:-1]
+    heap = [(-row[-1], row[0], n) for (n, row) in enumerate(costs)]
+    heapq.heapify(heap)
+    separated = False
+    while heap and remaining >= min_size:
+        _, name, n = heapq.heappop(heap)
+        cells = [c for c in zip(columns, costs[n][1:-1]) if c[1] != 0]
+        if not cells:
+            continue
+        group = (group1, name)
+        rows, size = fit_rows(
+            renderer, name, [group2, "Cost"], cells, remaining, group=group
+        )
+        if rows is None:
+            # A smaller table may still fit
+            continue
+        if not separated:
+            renderer.separator()
+            separated = True
+        renderer.table(name, [group2, "Cost"], rows, group=group)
+        remaining -= size
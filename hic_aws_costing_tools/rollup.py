@@ -0,0 +1,129 @@
+"""
+Aggregate daily costs into coarser periods locally
+
+Cost Explorer only returns DAILY or MONTHLY costs. Weekly, quarterly, yearly and
+fiscal year costs are calculated from daily costs, and monthly costs can be too
+so that one daily query (or cached response) gives every view.
+"""
+
+from datetime import date, datetime, timedelta
+
+from .frame import CostFrame
+from .instrument import timed
+
+# Granularities that can only be calculated locally
+ROLLUP_GRANULARITIES = ("WEEKLY", "QUARTERLY", "YEARLY", "FISCAL_YEARLY")
+# Monday
+DEFAULT_WEEK_START = 0
+# UK financial year
+DEFAULT_FISCAL_YEAR_START = 4
+
+
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+
+def parse_week_start(value):
+    """
+    :param value: Day name or number (0 is Monday)
+    :return: Day number
+    """
+    if isinstance(value, str) and not value.isdigit():
+        try:
+            return WEEKDAYS.index(value.lower())
+        except ValueError:
+            raise ValueError(f"Invalid week start: {value}")
+    value = int(value)
+    if not 0 <= value <= 6:
+        raise ValueError(f"Invalid week start: {value}")
+    return value
+
+
+def _add_months(d, months):
+    month = d.month - 1 + months
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+
+def bucket(
+    day,
+    granularity,
+    *,
+    week_start=DEFAULT_WEEK_START,
+    fiscal_year_start=DEFAULT_FISCAL_YEAR_START,
+):
+    """
+    Get the period containing a day
+
+    :param granularity: WEEKLY, MONTHLY, QUARTERLY, YEARLY or FISCAL_YEARLY
+    :param week_start: First day of the week for WEEKLY, 0 is Monday and 6 is Sunday
+    :param fiscal_year_start: First month of the fiscal year for FISCAL_YEARLY
+    :return: (start, end) dates, end is exclusive
+    """
+    if granularity == "WEEKLY":
+        start = day - timedelta(days=(day.weekday() - week_start) % 7)
+        return start, start + timedelta(days=7)
+    if granularity == "MONTHLY":
+        months = 1
+        start = day.replace(day=1)
+    elif granularity == "QUARTERLY":
+        months = 3
+        start = date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+    elif granularity == "YEARLY":
+        months = 12
+        start = date(day.year, 1, 1)
+    elif granularity == "FISCAL_YEARLY":
+        months = 12
+        year = day.year if day.month >= fiscal_year_start else day.year - 1
+        start = date(year, fiscal_year_start, 1)
+    else:
+        raise ValueError(f"Invalid rollup granularity: {granularity}")
+    return start, _add_months(start, months)
+
+
+@timed("rollup")
+def rollup(
+    results,
+    granularity,
+    *,
+    week_start=DEFAULT_WEEK_START,
+    fiscal_year_start=DEFAULT_FISCAL_YEAR_START,
+):
+    """
+    Sum daily costs into coarser periods
+
+    Like Cost Explorer the first and last periods are truncated to the time
+    period of the results.
+
+    :param results: DAILY ResultsByTime or a CostFrame
+    :param granularity: WEEKLY, MONTHLY, QUARTERLY, YEARLY or FISCAL_YEARLY
+    :return: CostFrame
+    """
+    if not isinstance(results, CostFrame):
+        results = CostFrame.from_results(results)
+    periods = [
+        (datetime.fromisoformat(s).date(), datetime.fromisoformat(e).date())
+        for (s, e) in results.periods
+    ]
+    if not periods:
+        return results
+    first = min(s for (s, _) in periods)
+    last = max(e for (_, e) in periods)
+
+    period_map = []
+    for s, e in periods:
+        start, end = bucket(
+            s, granularity, week_start=week_start, fiscal_year_start=fiscal_year_start
+        )
+        if e > end:
+            raise ValueError(
+                f"Period {s} - {e} spans more than one {granularity} period"
+            )
+        period_map.append((max(start, first).isoformat(), min(end, last).isoformat()))
+    return results.aggregate_periods(period_map)
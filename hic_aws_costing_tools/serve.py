@@ -0,0 +1,421 @@
+"""
+Local HTTP/JSON server for cost reports
+
+Tools that create reports from the same costs (the bot, dashboards, scripts) can
+share one server instead of each querying Cost Explorer. Query results are held
+in a bounded in-memory LRU cache with a TTL, as CostFrames so that any output
+can be rendered from them, and concurrent identical queries are coalesced so
+only one of them fetches. Yesterday's and month to date costs can be fetched
+in the background every morning.
+
+    POST /costs  {"start": "2023-06-01", "output": "summary", ...}
+    GET  /stats
+    GET  /health
+
+/costs takes the options of create_costs_message, or "compare" for a comparison,
+and returns {"title": title, "message": message, "cache": "hit", "miss" or
+"coalesced"}. Options that aren't given default to the server's options.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+from .aws_costs import (
+    DEFAULT_COST_TYPE,
+    DEFAULT_EXCLUDE_RECORD_TYPES,
+    DEFAULT_GRANULARITY,
+    DEFAULT_INCLUDE_RECORD_TYPES,
+    DEFAULT_MAX_MESSAGE_BYTES,
+    DEFAULT_MAX_WORKERS,
+    MESSAGE_OUTPUTS,
+    _expected_unit,
+    costs_message_title,
+    costs_to_csv,
+    costs_to_flat,
+    get_raw_cost_data,
+    get_time_period,
+    write_costs_message,
+)
+from .cache import DEFAULT_RECENT_TTL_SECONDS
+from .compare import (
+    COMPARE_PERIODS,
+    compare_costs,
+    comparison_title,
+    get_previous_period,
+    write_comparison,
+)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8040
+DEFAULT_MAX_ENTRIES = 128
+DEFAULT_TTL_SECONDS = DEFAULT_RECENT_TTL_SECONDS
+DEFAULT_PREWARM_TIME = "06:00"
+DEFAULT_TITLE_PREFIX = "AWS costs"
+SERVE_OUTPUTS = MESSAGE_OUTPUTS + ("flat",)
+
+log = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with a TTL that coalesces concurrent fetches of a key
+    """
+
+    def __init__(
+        self, *, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS, clock=None
+    ):
+        """
+        :param max_entries: Least recently used entries are evicted above this
+        :param ttl: Seconds until an entry expires
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock or time.monotonic
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, fetch, *, refresh=False):
+        """
+        Get a cached value, or call fetch() to get it
+
+        If another thread is already fetching key this waits for its result.
+
+        :param refresh: Fetch even if there's a cached value
+        :return: (value, "hit", "miss" or "coalesced")
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not refresh and entry[0] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], "hit"
+            future = self._pending.get(key)
+            fetching = future is None
+            if fetching:
+                future = self._pending[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not fetching:
+            return future.result(), "coalesced"
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._pending[key]
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(value)
+        return value, "miss"
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+def _cache_key(query):
+    return json.dumps(query, sort_keys=True)
+
+
+class CostService:
+    """
+    Creates reports from cached query results
+    """
+
+    def __init__(
+        self,
+        *,
+        defaults=None,
+        cache=None,
+        client_pool=None,
+        max_workers=DEFAULT_MAX_WORKERS,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        ttl=DEFAULT_TTL_SECONDS,
+        clock=None,
+    ):
+        """
+        :param defaults: Default request options, e.g. {"group2": "Proj$"}
+        :param cache: Optional cache.ResponseCache for Cost Explorer responses
+        :param client_pool: clients.ClientPool, default is the shared pool
+        """
+        self.defaults = dict(defaults or {})
+        self.cache = cache
+        self.client_pool = client_pool
+        self.max_workers = max_workers
+        self.results = ResultCache(max_entries=max_entries, ttl=ttl, clock=clock)
+        self.prewarms = 0
+
+    def _option(self, request, name, default=None):
+        value = request.get(name)
+        if value is None:
+            value = self.defaults.get(name, default)
+        return value
+
+    def _query(self, request):
+        """
+        :return: Dict of the options that determine the query results
+        """
+        role_arn = self._option(request, "role_arn")
+        if isinstance(role_arn, list) and len(role_arn) == 1:
+            role_arn = role_arn[0]
+        compare = self._option(request, "compare")
+        if compare and compare not in COMPARE_PERIODS:
+            raise ValueError(f"Invalid comparison: {compare}")
+        return {
+            "time_period": get_time_period(
+                startdate=self._option(request, "start"),
+                enddate=self._option(request, "end"),
+            ),
+            "granularity": self._option(request, "granularity", DEFAULT_GRANULARITY)
+            .upper()
+            .replace("-", "_"),
+            "role_arn": role_arn,
+            "group1": self._option(request, "group1", "accountname"),
+            "group2": self._option(request, "group2", "service"),
+            "exclude_types": list(
+                self._option(request, "exclude_types", DEFAULT_EXCLUDE_RECORD_TYPES)
+            ),
+            "include_types": list(
+                self._option(request, "include_types", DEFAULT_INCLUDE_RECORD_TYPES)
+            ),
+            "cost_type": self._option(request, "cost_type", DEFAULT_COST_TYPE),
+            "compare": compare,
+        }
+
+    def _fetch(self, query):
+        if query["compare"]:
+            return compare_costs(
+                time_period=query["time_period"],
+                previous_period=get_previous_period(
+                    query["time_period"], query["compare"]
+                ),
+                role_arn=query["role_arn"],
+                regions=None,
+                group1=query["group1"],
+                group2=query["group2"],
+                exclude_types=query["exclude_types"],
+                include_types=query["include_types"],
+                cost_type=query["cost_type"],
+                cache=self.cache,
+                max_workers=self.max_workers,
+                client_pool=self.client_pool,
+            )
+        return get_raw_cost_data(
+            time_period=query["time_period"],
+            granularity=query["granularity"],
+            role_arn=query["role_arn"],
+            regions=None,
+            group1=query["group1"],
+            group2=query["group2"],
+            exclude_types=query["exclude_types"],
+            include_types=query["include_types"],
+            apply_value_mappings=True,
+            cache=self.cache,
+            max_workers=self.max_workers,
+            client_pool=self.client_pool,
+            frame=True,
+            metrics=[query["cost_type"]],
+        )
+
+    def get(self, query, *, refresh=False):
+        """
+        :return: (query results, cache status)
+        """
+        return self.results.get(
+            _cache_key(query), lambda: self._fetch(query), refresh=refresh
+        )
+
+    def costs(self, request):
+        """
+        Create a report
+
+        :param request: Dict of options
+        :return: {"title": title, "message": message, "cache": cache status}
+        """
+        query = self._query(request)
+        output = self._option(request, "output", "auto")
+        output_format = self._option(request, "format", "md")
+        title_prefix = self._option(request, "title_prefix", DEFAULT_TITLE_PREFIX)
+        if output not in SERVE_OUTPUTS:
+            raise ValueError(f"Invalid output: {output}")
+        if output_format not in ("md", "html"):
+            raise ValueError(f"Invalid format: {output_format}")
+        if query["compare"] and output not in ("auto", "full", "csv"):
+            raise ValueError("compare only supports auto, full or csv output")
+
+        data, status = self.get(query)
+        s = StringIO()
+        if query["compare"]:
+            previous_period = get_previous_period(
+                query["time_period"], query["compare"]
+            )
+            header, rows = data
+            write_comparison(
+                s,
+                header,
+                rows,
+                "csv" if output == "csv" else output_format,
+                _expected_unit(query["cost_type"]) or query["cost_type"],
+            )
+            title = comparison_title(
+                title_prefix=title_prefix,
+                time_period=query["time_period"],
+                previous_period=previous_period,
+                cost_type=query["cost_type"],
+            )
+        else:
+            results, all_values1, all_values2, _, _ = data
+            if output == "flat":
+                header, rows = costs_to_flat(
+                    results=results,
+                    group1=query["group1"],
+                    group2=query["group2"],
+                    cost_type=query["cost_type"],
+                    lazy=True,
+                )
+                costs_to_csv(header, rows, s)
+            else:
+                write_costs_message(
+                    s,
+                    results=results,
+                    group1=query["group1"],
+                    group2=query["group2"],
+                    all_values1=all_values1,
+                    all_values2=all_values2,
+                    cost_type=query["cost_type"],
+                    output=output,
+                    output_format=output_format,
+                    max_bytes=self._option(
+                        request, "max_bytes", DEFAULT_MAX_MESSAGE_BYTES
+                    ),
+                )
+            title = costs_message_title(
+                title_prefix=title_prefix,
+                time_period=query["time_period"],
+                cost_type=query["cost_type"],
+            )
+        return {"title": title, "message": s.getvalue(), "cache": status}
+
+    def prewarm(self, today=None):
+        """
+        Fetch yesterday's and month to date costs with the default options
+
+        On the first of the month month to date is the previous month.
+        """
+        today = today or date.today()
+        month_start = (today - timedelta(days=1)).replace(day=1)
+        for start, end in ((today - timedelta(days=1), today), (month_start, today)):
+            query = self._query({"start": start.isoformat(), "end": end.isoformat()})
+            self.get(query, refresh=True)
+        self.prewarms += 1
+
+    def stats(self):
+        stats = self.results.stats()
+        stats["prewarms"] = self.prewarms
+        if self.cache:
+            stats["response_cache"] = self.cache.stats()
+        return stats
+
+
+def _seconds_until(at, now):
+    """
+    :param at: Time of day, HH:MM
+    :return: Seconds from now until the next at
+    """
+    hour, minute = map(int, at.split(":"))
+    next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+def prewarm_daily(service, at=DEFAULT_PREWARM_TIME, stop=None):
+    """
+    Call service.prewarm() now and every day at a time until stop is set
+
+    :param at: Local time of day, HH:MM
+    :param stop: threading.Event
+    """
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            service.prewarm()
+        except Exception:
+            log.exception("Prewarm failed")
+        stop.wait(_seconds_until(at, datetime.now()))
+
+
+class CostRequestHandler(BaseHTTPRequestHandler):
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self._send(200, self.server.service.stats())
+        else:
+            self._send(404, {"error": f"Not found: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/costs":
+            self._send(404, {"error": f"Not found: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+            response = self.server.service.costs(request)
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            log.exception("Request failed")
+            self._send(500, {"error": str(e)})
+        else:
+            self._send(200, response)
+
+    def log_message(self, format, *args):
+        log.info(f"{self.address_string()} {format % args}")
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    :return: ThreadingHTTPServer for service, call serve_forever() to run it
+    """
+    server = ThreadingHTTPServer((host, port), CostRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
@@ -0,0 +1,344 @@
+"""
+Deterministic synthetic Cost Explorer data for benchmarks and tests
+
+SyntheticCostExplorer implements the subset of the boto3 Cost Explorer client
+used by this package, returning responses shaped like the real API.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+# Each metric is the generated cost multiplied by a factor, (factor, unit)
+METRICS = {
+    "AmortizedCost": (1.05, "USD"),
+    "BlendedCost": (1, "USD"),
+    "NetAmortizedCost": (0.95, "USD"),
+    "NetUnblendedCost": (0.9, "USD"),
+    "NormalizedUsageAmount": (80, "N/A"),
+    "UnblendedCost": (1, "USD"),
+    "UsageQuantity": (10, "Hrs"),
+}
+
+
+HOUR_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def account_id(i):
+    return f"{i + 1:012d}"
+
+
+class SyntheticCostExplorer:
+    """
+    Fake Cost Explorer client with generated accounts and services or tag values
+
+    Each day a fraction density of the (account, service or tag value) cells have a
+    cost. Each cell is also in one of regions. The same arguments always produce
+    the same costs.
+
+    Without GroupBy groups are (account, service or tag value). GroupBy and
+    simple Filters on LINKED_ACCOUNT, SERVICE, REGION and the tag are supported.
+    """
+
+    def __init__(
+        self,
+        *,
+        cardinality1=10,
+        cardinality2=20,
+        density=0.2,
+        seed=0,
+        page_size=None,
+        tag_key=None,
+        regions=("eu-west-2", "us-east-1"),
+        record_calls=False,
+    ):
+        """
+        :param cardinality1: Number of accounts
+        :param cardinality2: Number of services, or tag values if tag_key is set
+        :param density: Fraction of cells with a cost each day
+        :param page_size: Maximum number of groups per get_cost_and_usage page (default unlimited)
+        :param tag_key: Group 2 values are tag values of this key instead of services
+        :param regions: Region names, cells are assigned to them in turn
+        :param record_calls: Append (operation, TimePeriod) to calls for each call,
+          e.g. in tests. Off by default since calls grows without limit.
+        """
+        self.accounts = [account_id(i) for i in range(cardinality1)]
+        self.tag_key = tag_key
+        if tag_key:
+            self.values2 = [f"{tag_key}$value-{i}" for i in range(cardinality2)]
+        else:
+            self.values2 = [f"Service {i}" for i in range(cardinality2)]
+        self.regions = list(regions)
+        self.density = density
+        self.seed = seed
+        self.page_size = page_size
+        self.calls = [] if record_calls else None
+
+    def _record(self, operation, time_period):
+        if self.calls is not None:
+            self.calls.append((operation, time_period))
+
+    def _day_groups(self, day):
+        rng = random.Random(self.seed * 1000003 + day.toordinal())
+        ncols = len(self.values2)
+        ncells = len(self.accounts) * ncols
+        groups = []
+        for cell in sorted(rng.sample(range(ncells), round(ncells * self.density))):
+            a, v = divmod(cell, ncols)
+            keys = (self.accounts[a], self.values2[v])
+            groups.append((keys, round(rng.uniform(0, 100), 10)))
+        return groups
+
+    def _attributes(self, keys):
+        account, value2 = keys
+        i = self.accounts.index(account) + self.values2.index(value2)
+        attributes = {
+            ("DIMENSION", "LINKED_ACCOUNT"): account,
+            ("DIMENSION", "REGION"): self.regions[i % len(self.regions)],
+            ("DIMENSION", "RECORD_TYPE"): "Usage",
+        }
+        if self.tag_key:
+            attributes[("TAG", self.tag_key)] = value2.split("$", 1)[1]
+            attributes[("DIMENSION", "SERVICE")] = "Synthetic service"
+        else:
+            attributes[("DIMENSION", "SERVICE")] = value2
+        return attributes
+
+    def _match(self, filter, attributes):
+        if "And" in filter:
+            return all(self._match(f, attributes) for f in filter["And"])
+        if "Or" in filter:
+            return any(self._match(f, attributes) for f in filter["Or"])
+        if "Not" in filter:
+            return not self._match(filter["Not"], attributes)
+        if "Dimensions" in filter:
+            d = filter["Dimensions"]
+            return attributes.get(("DIMENSION", d["Key"])) in d["Values"]
+        t = filter["Tags"]
+        value = attributes.get(("TAG", t["Key"]))
+        if "ABSENT" in t.get("MatchOptions", []):
+            return value is None
+        return value in t["Values"]
+
+    def _group_keys(self, keys, group_by, filter):
+        # Map generated keys to GroupBy keys, None if filtered out
+        if not group_by and not filter:
+            return keys
+        attributes = self._attributes(keys)
+        if filter and not self._match(filter, attributes):
+            return None
+        if not group_by:
+            return keys
+        group_keys = []
+        for g in group_by:
+            value = attributes.get((g["Type"], g["Key"]))
+            if g["Type"] == "TAG":
+                value = f"{g['Key']}${value or ''}"
+            group_keys.append(value)
+        return tuple(group_keys)
+
+    def _periods(self, time_period, granularity):
+        start = datetime.fromisoformat(time_period["Start"]).date()
+        end = datetime.fromisoformat(time_period["End"]).date()
+        while start < end:
+            if granularity == "MONTHLY":
+                period_end = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+            else:
+                period_end = start + timedelta(days=1)
+            period_end = min(period_end, end)
+            yield start, period_end
+            start = period_end
+
+    def _result(self, time_period, totals, metrics):
+        groups = [
+            {
+                "Keys": list(keys),
+                "Metrics": {
+                    m: {
+                        "Amount": str(round(cost * METRICS[m][0], 10)),
+                        "Unit": METRICS[m][1],
+                    }
+                    for m in metrics
+                },
+            }
+            for (keys, cost) in sorted(totals.items())
+        ]
+        return {
+            "TimePeriod": time_period,
+            "Total": {},
+            "Groups": groups,
+            "Estimated": False,
+        }
+
+    def _hourly_results(self, time_period, metrics, group_by, filter):
+        # Each day's costs are spread evenly over its hours
+        start = datetime.strptime(time_period["Start"], HOUR_FORMAT)
+        end = datetime.strptime(time_period["End"], HOUR_FORMAT)
+        if end - start > timedelta(days=14):
+            raise ValueError("HOURLY time period can't be longer than 14 days")
+        results = []
+        hour = start
+        while hour < end:
+            totals = {}
+            for keys, cost in self._day_groups(hour.date()):
+                keys = self._group_keys(keys, group_by, filter)
+                if keys is not None:
+                    totals[keys] = totals.get(keys, 0) + cost / 24
+            period = {
+                "Start": hour.strftime(HOUR_FORMAT),
+                "End": (hour + timedelta(hours=1)).strftime(HOUR_FORMAT),
+            }
+            results.append(self._result(period, totals, metrics))
+            hour += timedelta(hours=1)
+        return results
+
+    def _results(self, time_period, granularity, metrics, group_by=None, filter=None):
+        if granularity == "HOURLY":
+            return self._hourly_results(time_period, metrics, group_by, filter)
+        results = []
+        for start, end in self._periods(time_period, granularity):
+            totals = {}
+            day = start
+            while day < end:
+                for keys, cost in self._day_groups(day):
+                    keys = self._group_keys(keys, group_by, filter)
+                    if keys is not None:
+                        totals[keys] = totals.get(keys, 0) + cost
+                day += timedelta(days=1)
+            period = {"Start": start.isoformat(), "End": end.isoformat()}
+            results.append(self._result(period, totals, metrics))
+        return results
+
+    def get_cost_and_usage(
+        self,
+        *,
+        TimePeriod,
+        Granularity,
+        Metrics,
+        GroupBy=None,
+        Filter=None,
+        NextPageToken=None,
+        **kwargs,
+    ):
+        self._record("get_cost_and_usage", TimePeriod)
+        results = self._results(TimePeriod, Granularity, Metrics, GroupBy, Filter)
+        if not self.page_size:
+            return {"ResultsByTime": results}
+
+        # Page on groups, a period may be split across pages like the real API
+        offset = int(NextPageToken or 0)
+        page = []
+        position = 0
+        remaining = self.page_size
+        for result in results:
+            groups = result["Groups"]
+            if position + len(groups) <= offset:
+                position += len(groups)
+                continue
+            skip = max(0, offset - position)
+            chunk_end = skip + remaining
+            chunk = groups[skip:chunk_end]
+            page.append(dict(result, Groups=chunk))
+            remaining -= len(chunk)
+            position += len(groups)
+            if remaining == 0:
+                break
+        response = {"ResultsByTime": page}
+        next_offset = offset + self.page_size
+        if next_offset < sum(len(r["Groups"]) for r in results):
+            response["NextPageToken"] = str(next_offset)
+        return response
+
+    def get_dimension_values(
+        self, *, TimePeriod, Dimension, NextPageToken=None, **kwargs
+    ):
+        self._record("get_dimension_values", TimePeriod)
+        if Dimension == "LINKED_ACCOUNT":
+            values = [
+                {"Value": a, "Attributes": {"description": f"account-{int(a)}"}}
+                for a in self.accounts
+            ]
+        elif Dimension == "SERVICE" and not self.tag_key:
+            values = [{"Value": v, "Attributes": {}} for v in self.values2]
+        elif Dimension == "SERVICE":
+            values = [{"Value": "Synthetic service", "Attributes": {}}]
+        elif Dimension == "REGION":
+            values = [{"Value": r, "Attributes": {}} for r in self.regions]
+        else:
+            values = []
+        return {
+            "DimensionValues": values,
+            "ReturnSize": len(values),
+            "TotalSize": len(values),
+        }
+
+    def get_tags(self, *, TimePeriod, TagKey, NextPageToken=None, **kwargs):
+        self._record("get_tags", TimePeriod)
+        if TagKey != self.tag_key:
+            return {"Tags": [], "ReturnSize": 0, "TotalSize": 0}
+        tags = [v.split("$", 1)[1] for v in self.values2]
+        return {"Tags": tags, "ReturnSize": len(tags), "TotalSize": len(tags)}
+
+    def get_caller_identity(self):
+        """
+        STS GetCallerIdentity, so this can also replace boto3.client("sts")
+        """
+        self._record("get_caller_identity", None)
+        return {"Account": self.accounts[0]}
+
+
+def generate_results(*, start="2023-01-01", periods=30, granularity="DAILY", **kwargs):
+    """
+    Generate ResultsByTime for a number of days or months
+
+    :param kwargs: Arguments for SyntheticCostExplorer
+    :return: (results, all_values1, all_values2, value_map1) like costs_for_regions
+    """
+    ce = SyntheticCostExplorer(**kwargs)
+    start_date = datetime.fromisoformat(start).date()
+    if granularity == "MONTHLY":
+        end = start_date
+        for _ in range(periods):
+            end = (end.replace(day=1) + timedelta(days=32)).replace(day=1)
+    else:
+        end = start_date + timedelta(days=periods)
+    time_period = {"Start": start_date.isoformat(), "End": end.isoformat()}
+    results = ce.get_cost_and_usage(
+        TimePeriod=time_period, Granularity=granularity, Metrics=["UnblendedCost"]
+    )["ResultsByTime"]
+    value_map1 = {
+        dv["Value"]: dv["Attributes"]["description"]
+        for dv in ce.get_dimension_values(
+            TimePeriod=time_period, Dimension="LINKED_ACCOUNT"
+        )["DimensionValues"]
+    }
+    return results, set(ce.accounts), set(ce.values2), value_map1
+
+
+class SyntheticClientPool:
+    """
+    Replacement for clients.ClientPool that returns a SyntheticCostExplorer,
+    e.g. to try out reports without AWS access
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: SyntheticCostExplorer arguments
+        """
+        self.ce = SyntheticCostExplorer(**kwargs)
+
+    def client(self, service, *, role_arn=None, region=None):
+        if service != "ce":
+            raise ValueError(f"Unsupported service: {service}")
+        return self.ce
+
+    def account_id(self):
+        return None
+
+    def rate_limit_stats(self):
+        return {}
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,15 @@
+import pytest
+
+from hic_aws_costing_tools.catalogue import set_default_catalogue
+from hic_aws_costing_tools.clients import ClientPool, set_default_client_pool
+
+
+@pytest.fixture(autouse=True)
+def reset_defaults():
+    # The shared pool and catalogue would otherwise keep mocked clients and
+    # responses between tests. Mocked clients don't need rate limiting.
+    set_default_client_pool(ClientPool(rate=None))
+    set_default_catalogue(None)
+    yield
+    set_default_client_pool(None)
+    set_default_catalogue(None)
@@ -0,0 +1,134 @@
+import json
+
+import pytest
+
+from hic_aws_costing_tools.batch import (
+    load_config,
+    plan_queries,
+    report_specs,
+    run_batch,
+)
+from hic_aws_costing_tools.main import main
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+CONFIG = {
+    "defaults": {
+        "start": "2023-01-01",
+        "end": "2023-01-08",
+        "granularity": "daily",
+        "title_prefix": "Test",
+    },
+    "reports": [
+        {"name": "summary", "output": "summary"},
+        {"name": "full", "output": "full", "format": "html"},
+        {"name": "ids", "group1": "account", "output": "csv"},
+        {"name": "proj", "group2": "Proj$", "output": "summary"},
+        {"name": "flat", "group2": "Proj$", "output": "flat"},
+    ],
+}
+
+
+def test_plan_queries():
+    specs = report_specs(CONFIG)
+    assert [s["name"] for s in specs] == ["summary", "full", "ids", "proj", "flat"]
+    assert specs[0]["time_period"] == {"Start": "2023-01-01", "End": "2023-01-08"}
+
+    queries = plan_queries(specs)
+    assert [indices for (_, indices) in queries] == [[0, 1, 2], [3, 4]]
+    assert queries[0][0]["group1"] == "accountname"
+    assert queries[1][0]["group2"] == "Proj$"
+
+    # Ledger datasets are stored by group name
+    queries = plan_queries(specs, merge_accounts=False)
+    assert [indices for (_, indices) in queries] == [[0, 1], [2], [3, 4]]
+
+
+def test_report_specs_invalid():
+    with pytest.raises(ValueError, match=r"Unknown report keys: \['colour'\]"):
+        report_specs([{"colour": "red"}])
+    with pytest.raises(ValueError, match="Invalid output for report-1: pdf"):
+        report_specs([{"output": "pdf"}])
+    with pytest.raises(ValueError, match="parquet output requires a file: report-1"):
+        report_specs([{"output": "parquet"}])
+
+
+def test_run_batch(mocker, tmp_path):
+    ce = SyntheticCostExplorer(
+        cardinality1=3, cardinality2=4, density=0.5, record_calls=True
+    )
+    mocker.patch("boto3.client", return_value=ce)
+
+    config = json.loads(json.dumps(CONFIG))
+    config["reports"][4]["file"] = str(tmp_path / "flat.csv")
+    reports = run_batch(config)
+
+    assert len([c for c in ce.calls if c[0] == "get_cost_and_usage"]) == 2
+    assert [r["title"] for r in reports] == [
+        "Test 2023-01-01 - 2023-01-08 UnblendedCost"
+    ] * 5
+
+    summary = reports[0]["message"]
+    assert summary.startswith("## Totals: USD ")
+    assert "|account-1|" in summary
+    assert reports[1]["message"].startswith("<h2>account-1</h2>\n<table>\n")
+    assert reports[2]["message"].startswith("account,Service 0,")
+    assert "\r\n000000000001," in reports[2]["message"]
+    # There are no Proj tag values so the table has no columns
+    assert reports[3]["message"].startswith("## Totals: USD 0.00\n")
+
+    assert reports[4]["message"] is None
+    with open(tmp_path / "flat.csv") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "START,END,accountname,Proj$,COST"
+    assert lines[1].startswith("2023-01-01,2023-01-02,account-")
+
+
+def test_batch_main(mocker, tmp_path, capsys):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=2, record_calls=True)
+    mocker.patch("boto3.client", return_value=ce)
+    path = tmp_path / "batch.yaml"
+    path.write_text(
+        "defaults:\n"
+        "  start: 2023-01-01\n"
+        "  end: 2023-01-02\n"
+        "reports:\n"
+        "  - output: summary\n"
+        "  - output: full\n"
+    )
+    pytest.importorskip("yaml")
+    assert load_config(str(path))["reports"][1] == {"output": "full"}
+
+    main(["batch", str(path), "--dry-run"])
+    assert ce.calls == []
+    out = capsys.readouterr().out.splitlines()
+    assert len(out) == 3
+    assert out[1:] == ["  report-1", "  report-2"]
+
+    main(["batch", str(path), "--no-cache"])
+    out = capsys.readouterr().out
+    assert out.startswith("AWS costs 2023-01-01 (Sunday) UnblendedCost\n## Totals")
+    assert "## account-2\n" in out
+
+
+def test_run_batch_report_error(mocker, tmp_path):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=2)
+    mocker.patch("boto3.client", return_value=ce)
+
+    def fail(header, costs, file):
+        file.write("START,END\n")
+        raise OSError("No space left on device")
+
+    mocker.patch("hic_aws_costing_tools.batch.costs_to_csv", side_effect=fail)
+    path = tmp_path / "flat.csv"
+    config = {
+        "defaults": CONFIG["defaults"],
+        "reports": [
+            {"name": "flat", "output": "flat", "file": str(path)},
+            {"name": "summary", "output": "summary"},
+        ],
+    }
+    flat, summary = run_batch(config)
+    assert str(flat["error"]) == "No space left on device"
+    assert summary["message"].startswith("## Totals: USD ")
+    # The failed report isn't left half-written
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,70 @@
+import gzip
+
+import pytest
+
+from hic_aws_costing_tools.bundle import Bundle, BundleRecorder
+from hic_aws_costing_tools.main import main
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+ARGS = ["--start", "2023-01-01", "--end", "2023-01-08", "--granularity", "daily"]
+
+
+@pytest.mark.parametrize("output", ["full", "flat"])
+def test_record_replay(mocker, tmp_path, capsys, output):
+    ce = SyntheticCostExplorer(cardinality1=3, cardinality2=5, density=1, page_size=10)
+    mocker.patch("boto3.client", return_value=ce)
+    path = str(tmp_path / "bundle.ndjson.gz")
+    cache_dir = str(tmp_path / "cache")
+    args = ARGS + ["--output", output, "--cache-dir", cache_dir, "--max-rate", "0"]
+
+    # Cached responses are fetched again when recording
+    main(args)
+    capsys.readouterr()
+    main(args + ["--record", path])
+    recorded = capsys.readouterr()
+    assert "Cache: 0 hits" in recorded.err
+    assert f"Recorded AWS API calls to {path}" in recorded.err
+
+    mocker.patch("boto3.client", side_effect=AssertionError("boto3 called"))
+    main(args + ["--replay", path])
+    assert capsys.readouterr().out == recorded.out
+
+    # 7 days x 15 groups in pages of 10, and 2 dimension lookups
+    assert len(Bundle(path)) == 13
+
+
+def test_bundle(tmp_path):
+    path = str(tmp_path / "bundle.gz")
+    recorder = BundleRecorder(path)
+    client = recorder.wrap(
+        SyntheticCostExplorer(), service="ce", role_arn="arn:aws:iam::1:role/a"
+    )
+    request = dict(
+        TimePeriod={"Start": "2023-01-01", "End": "2023-01-02"},
+        Dimension="LINKED_ACCOUNT",
+    )
+    expected = client.get_dimension_values(**request)
+    recorder.close()
+
+    bundle = Bundle(path)
+    replay = bundle.client("ce", role_arn="arn:aws:iam::1:role/a")
+    assert replay.get_dimension_values(**request) == expected
+    # Responses are copies since they may be modified
+    assert replay.get_dimension_values(**request) is not expected
+    with pytest.raises(LookupError, match="get_dimension_values not recorded"):
+        bundle.client("ce").get_dimension_values(**request)
+    with pytest.raises(AttributeError):
+        replay.describe_report_definitions
+    assert (bundle.hits, bundle.misses) == (2, 1)
+
+    # An interrupted recording is loaded up to the last complete call
+    with gzip.open(path, "rt") as f:
+        data = f.read()
+    with gzip.open(path, "wt") as f:
+        f.write(data[:-10])
+    assert len(Bundle(path)) == 0
+
+    with gzip.open(path, "wt") as f:
+        f.write("{}\n")
+    with pytest.raises(ValueError, match="Not a bundle file"):
+        Bundle(path)
@@ -0,0 +1,148 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.cache import ResponseCache
+from hic_aws_costing_tools.catalogue import DimensionCatalogue
+from hic_aws_costing_tools.clients import ClientPool
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+from .test_costbot import get_test_data
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path))
+
+
+def test_cache_hit_miss(mocker, cache):
+    client_mock = mocker.Mock()
+    client_mock.get_tags.return_value = {"Tags": ["a"], "ResponseMetadata": {}}
+    ce = cache.wrap(client_mock, namespace="role")
+
+    time_period = {"Start": "2022-01-01", "End": "2022-01-02"}
+    # ResponseMetadata is removed from misses as well as hits
+    assert ce.get_tags(TimePeriod=time_period, TagKey="Proj") == {"Tags": ["a"]}
+    assert ce.get_tags(TimePeriod=time_period, TagKey="Proj") == {"Tags": ["a"]}
+    assert client_mock.get_tags.call_count == 1
+
+    # Different request or namespace
+    ce.get_tags(TimePeriod=time_period, TagKey="Other")
+    cache.wrap(client_mock, namespace="other").get_tags(
+        TimePeriod=time_period, TagKey="Proj"
+    )
+    assert client_mock.get_tags.call_count == 3
+    assert cache.stats() == {"hits": 1, "misses": 3}
+
+
+def test_cache_shared_and_refresh(mocker, tmp_path):
+    client_mock = mocker.Mock()
+    client_mock.get_tags.return_value = {"Tags": ["a"]}
+    time_period = {"Start": "2022-01-01", "End": "2022-01-02"}
+
+    ResponseCache(str(tmp_path)).wrap(client_mock).get_tags(TimePeriod=time_period)
+    ResponseCache(str(tmp_path)).wrap(client_mock).get_tags(TimePeriod=time_period)
+    assert client_mock.get_tags.call_count == 1
+
+    refresh = ResponseCache(str(tmp_path), refresh=True)
+    refresh.wrap(client_mock).get_tags(TimePeriod=time_period)
+    assert client_mock.get_tags.call_count == 2
+    assert refresh.stats() == {"hits": 0, "misses": 1}
+
+
+def test_cache_recent_expires(mocker, cache):
+    client_mock = mocker.Mock()
+    client_mock.get_tags.return_value = {"Tags": ["a"]}
+    today = datetime.now().date()
+    recent = {"Start": str(today - timedelta(days=2)), "End": str(today)}
+    closed = {"Start": "2022-01-01", "End": "2022-02-01"}
+
+    time_mock = mocker.patch("hic_aws_costing_tools.cache.time")
+    time_mock.time.return_value = 1000
+    ce = cache.wrap(client_mock)
+    ce.get_tags(TimePeriod=recent)
+    ce.get_tags(TimePeriod=closed)
+
+    time_mock.time.return_value = 1000 + cache.recent_ttl + 1
+    ce.get_tags(TimePeriod=recent)
+    ce.get_tags(TimePeriod=closed)
+    assert cache.stats() == {"hits": 1, "misses": 3}
+
+
+@pytest.mark.parametrize(
+    "time_period, today, permanent",
+    [
+        # Open billing month
+        (("2026-10-01", "2026-10-10"), date(2026, 10, 17), False),
+        (("2026-09-01", "2026-10-01"), date(2026, 10, 17), True),
+        # The previous month isn't closed until restatement_days after it ends
+        (("2026-09-01", "2026-10-01"), date(2026, 10, 2), False),
+        (("2026-09-01", "2026-09-20"), date(2026, 10, 4), True),
+    ],
+)
+def test_cache_expires(cache, time_period, today, permanent):
+    request = {"TimePeriod": {"Start": time_period[0], "End": time_period[1]}}
+    expires = cache._expires(request, 1000, today)
+    assert expires == (None if permanent else 1000 + cache.recent_ttl)
+
+
+def test_costs_for_regions_cached(mocker, cache):
+    scenario = "dummy-services"
+    client_mock = mocker.Mock()
+    client_mock.get_dimension_values.side_effect = lambda **kwargs: get_test_data(
+        scenario, f"get_dimension_values-{kwargs['Dimension']}"
+    )
+    client_mock.get_cost_and_usage.return_value = get_test_data(
+        scenario, "get_cost_and_usage"
+    )
+    mocker.patch("boto3.client", return_value=client_mock)
+
+    kwargs = dict(
+        time_period={"Start": "2022-01-01", "End": "2022-01-02"},
+        granularity="DAILY",
+        regions=None,
+        session=None,
+        group1="accountname",
+        group2="service",
+        exclude_types=[],
+        include_types=["Usage"],
+        cache=cache,
+    )
+    first = aws_costs.costs_for_regions(**kwargs)
+    second = aws_costs.costs_for_regions(**kwargs)
+
+    assert first == second
+    assert client_mock.get_cost_and_usage.call_count == 1
+    assert client_mock.get_dimension_values.call_count == 2
+    assert cache.stats() == {"hits": 3, "misses": 3}
+
+
+def test_cache_namespaced_by_account(mocker, cache):
+    kwargs = dict(
+        time_period={"Start": "2022-01-01", "End": "2022-01-02"},
+        granularity="DAILY",
+        role_arn=None,
+        regions=None,
+        group1="accountname",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        apply_value_mappings=True,
+        cache=cache,
+    )
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3, record_calls=True)
+    sts = mocker.Mock()
+    mocker.patch(
+        "boto3.client",
+        side_effect=lambda service, **kwargs: sts if service == "sts" else ce,
+    )
+
+    # Default credentials for different accounts don't share cached responses
+    for account in ["111111111111", "222222222222", "111111111111"]:
+        sts.get_caller_identity.return_value = {"Account": account}
+        aws_costs.get_raw_cost_data(
+            client_pool=ClientPool(rate=None), catalogue=DimensionCatalogue(), **kwargs
+        )
+    assert len([c for c in ce.calls if c[0] == "get_cost_and_usage"]) == 2
+    assert sts.get_caller_identity.call_count == 3
@@ -0,0 +1,29 @@
+import pytest
+
+from hic_aws_costing_tools.catalogue import DimensionCatalogue
+
+
+def test_catalogue_lru_ttl():
+    now = [0]
+    catalogue = DimensionCatalogue(10, max_entries=2, clock=lambda: now[0])
+    assert catalogue.get("a", lambda: 1) == 1
+    assert catalogue.get("b", lambda: 2) == 2
+    assert catalogue.get("a", lambda: -1) == 1
+    # b is the least recently used
+    assert catalogue.get("c", lambda: 3) == 3
+    assert catalogue.stats()["entries"] == 2
+    assert catalogue.get("b", lambda: 4) == 4
+    assert catalogue.get("c", lambda: -1) == 3
+
+    # Expired entries are dropped when they're read
+    now[0] = 10
+    assert catalogue.get("c", lambda: 5) == 5
+    assert catalogue.get("c", lambda: -1) == 5
+    assert catalogue.stats() == {"entries": 2, "hits": 3, "misses": 5}
+
+    def fail():
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        catalogue.get("b", fail)
+    assert catalogue.stats()["entries"] == 1
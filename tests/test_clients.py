@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from hic_aws_costing_tools.clients import ClientPool, CredentialCache
+
+
+def _sts_mock(mocker, expires_in):
+    sts = mocker.Mock()
+
+    def assume_role(RoleArn, RoleSessionName):
+        return {
+            "Credentials": {
+                "AccessKeyId": f"key-{sts.assume_role.call_count}",
+                "SecretAccessKey": "secret",
+                "SessionToken": "token",
+                "Expiration": datetime.now(timezone.utc) + expires_in,
+            }
+        }
+
+    sts.assume_role.side_effect = assume_role
+    return sts
+
+
+def test_credential_cache(mocker):
+    sts = _sts_mock(mocker, timedelta(hours=1))
+    credentials = CredentialCache(sts=sts)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        keys = set(
+            executor.map(lambda _: credentials.get("role-a")["AccessKeyId"], range(8))
+        )
+    assert keys == {"key-1"}
+    assert credentials.get("role-b")["AccessKeyId"] == "key-2"
+    assert sts.assume_role.call_count == 2
+
+
+def test_credential_cache_refresh(mocker):
+    sts = _sts_mock(mocker, timedelta(minutes=2))
+    credentials = CredentialCache(sts=sts)
+    assert credentials.get("role-a")["AccessKeyId"] == "key-1"
+    # Expires within the refresh margin
+    assert credentials.get("role-a")["AccessKeyId"] == "key-2"
+
+
+def test_credential_cache_disk(mocker, tmp_path):
+    sts = _sts_mock(mocker, timedelta(hours=1))
+    CredentialCache(str(tmp_path), sts=sts).get("role-a")
+
+    other_sts = _sts_mock(mocker, timedelta(hours=1))
+    credentials = CredentialCache(str(tmp_path), sts=other_sts).get("role-a")
+    assert credentials["AccessKeyId"] == "key-1"
+    assert isinstance(credentials["Expiration"], datetime)
+    assert other_sts.assume_role.call_count == 0
+
+
+def test_client_pool(mocker):
+    client_mock = mocker.patch("boto3.client")
+    session_mock = mocker.patch("boto3.Session")
+    sts = _sts_mock(mocker, timedelta(minutes=2))
+    pool = ClientPool(credentials=CredentialCache(sts=sts), max_pool_connections=5)
+
+    ce = pool.client("ce")
+    assert pool.client("ce") is ce
+    assert client_mock.call_count == 1
+    assert client_mock.call_args.kwargs["config"].max_pool_connections == 5
+
+    pool.client("ce", role_arn="role-a")
+    pool.client("ce", role_arn="role-a", region="us-east-1")
+    assert session_mock.call_count == 2
+    assert [c.kwargs["aws_access_key_id"] for c in session_mock.call_args_list] == [
+        "key-1",
+        "key-2",
+    ]
+
+
+def test_client_pool_account_id(mocker):
+    sts = mocker.Mock()
+    sts.get_caller_identity.return_value = {"Account": "111111111111"}
+    client_mock = mocker.patch("boto3.client", return_value=sts)
+    pool = ClientPool()
+    assert pool.account_id() == "111111111111"
+    assert pool.account_id() == "111111111111"
+    assert sts.get_caller_identity.call_count == 1
+    assert client_mock.call_args.args == ("sts",)
@@ -0,0 +1,168 @@
+import pytest
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.compare import (
+    compare_costs,
+    create_comparison_message,
+    get_previous_period,
+    plan_comparison,
+)
+from hic_aws_costing_tools.main import main
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+KWARGS = dict(
+    role_arn=None,
+    regions=None,
+    group1="accountname",
+    group2="service",
+    exclude_types=[],
+    include_types=[],
+)
+
+
+def _tp(start, end):
+    return {"Start": start, "End": end}
+
+
+@pytest.mark.parametrize(
+    "time_period, compare, expected",
+    [
+        (_tp("2023-01-09", "2023-01-10"), "previous", _tp("2023-01-08", "2023-01-09")),
+        (_tp("2023-01-09", "2023-01-10"), "week", _tp("2023-01-02", "2023-01-03")),
+        (_tp("2023-03-01", "2023-04-01"), "month", _tp("2023-02-01", "2023-03-01")),
+        (_tp("2023-03-31", "2023-04-01"), "month", _tp("2023-02-28", "2023-03-01")),
+        (_tp("2024-02-29", "2024-03-01"), "year", _tp("2023-02-28", "2023-03-01")),
+    ],
+)
+def test_get_previous_period(time_period, compare, expected):
+    assert get_previous_period(time_period, compare) == expected
+
+
+def test_plan_comparison():
+    day = _tp("2023-01-09", "2023-01-10")
+    assert plan_comparison(day, get_previous_period(day, "week")) == [
+        (_tp("2023-01-02", "2023-01-10"), "DAILY")
+    ]
+    month = _tp("2023-03-01", "2023-04-01")
+    assert plan_comparison(month, get_previous_period(month, "year")) == [
+        (_tp("2022-03-01", "2023-04-01"), "MONTHLY")
+    ]
+    # Month to date and the previous month to date span more than MAX_SPAN_DAYS,
+    # but they're most of the span
+    mtd = _tp("2026-10-01", "2026-10-17")
+    assert plan_comparison(mtd, get_previous_period(mtd, "month")) == [
+        (_tp("2026-09-01", "2026-10-17"), "DAILY")
+    ]
+    # Fetching every day in between would be slower than two queries
+    last_year = get_previous_period(day, "year")
+    assert plan_comparison(day, last_year) == [(day, "DAILY"), (last_year, "DAILY")]
+
+
+def _cells(time_period):
+    results, _, _, _, _ = aws_costs.get_raw_cost_data(
+        time_period=time_period,
+        granularity="DAILY",
+        apply_value_mappings=True,
+        frame=True,
+        **KWARGS,
+    )
+    header, rows = aws_costs.costs_to_flat(
+        results=results,
+        group1="accountname",
+        group2="service",
+        cost_type="UnblendedCost",
+    )
+    cells = {}
+    for row in rows:
+        cells[row[2], row[3]] = cells.get((row[2], row[3]), 0) + row[4]
+    return cells
+
+
+def test_compare_costs(mocker):
+    ce = SyntheticCostExplorer(
+        cardinality1=3, cardinality2=4, density=0.5, record_calls=True
+    )
+    mocker.patch("boto3.client", return_value=ce)
+    current = _tp("2023-01-09", "2023-01-11")
+    previous = get_previous_period(current, "week")
+
+    header, rows = compare_costs(
+        time_period=current, previous_period=previous, **KWARGS
+    )
+    assert ce.calls == [
+        ("get_caller_identity", None),
+        ("get_dimension_values", _tp("2023-01-02", "2023-01-11")),
+        ("get_dimension_values", _tp("2023-01-02", "2023-01-11")),
+        ("get_cost_and_usage", _tp("2023-01-02", "2023-01-11")),
+    ]
+    assert header == [
+        "accountname",
+        "service",
+        "Previous",
+        "Current",
+        "Change",
+        "Change %",
+    ]
+    changes = [abs(r[4]) for r in rows]
+    assert changes == sorted(changes, reverse=True)
+
+    expected_previous = _cells(previous)
+    expected_current = _cells(current)
+    assert len(rows) == len(set(expected_previous) | set(expected_current))
+    for g1, g2, before, after, change, percent in rows:
+        assert before == pytest.approx(expected_previous.get((g1, g2), 0))
+        assert after == pytest.approx(expected_current.get((g1, g2), 0))
+        assert change == pytest.approx(after - before)
+        if before:
+            assert percent == pytest.approx(change / before * 100, abs=0.01)
+        else:
+            assert percent is None
+
+
+def test_compare_month_to_date(mocker):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=2, record_calls=True)
+    mocker.patch("boto3.client", return_value=ce)
+    current = _tp("2026-10-01", "2026-10-17")
+    compare_costs(
+        time_period=current,
+        previous_period=get_previous_period(current, "month"),
+        **KWARGS,
+    )
+    assert [c for c in ce.calls if c[0] == "get_cost_and_usage"] == [
+        ("get_cost_and_usage", _tp("2026-09-01", "2026-10-17"))
+    ]
+
+
+def test_create_comparison_message(mocker):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=2, density=1)
+    mocker.patch("boto3.client", return_value=ce)
+    message, title = create_comparison_message(
+        time_period=_tp("2023-01-09", "2023-01-10"),
+        previous_period=_tp("2023-01-02", "2023-01-03"),
+        title_prefix="Test",
+        output_format="md",
+        **KWARGS,
+    )
+    assert title == "Test 2023-01-09 (Monday) vs 2023-01-02 (Monday) UnblendedCost"
+    lines = message.splitlines()
+    assert lines[0].startswith("## Totals: USD ")
+    assert lines[2] == "|accountname|service|Previous|Current|Change|Change %|"
+    assert len(lines) == 4 + 4
+    assert lines[4].endswith("%|")
+
+
+def test_main_compare_csv(mocker, capsys):
+    ce = SyntheticCostExplorer(
+        cardinality1=2, cardinality2=2, density=1, record_calls=True
+    )
+    mocker.patch("boto3.client", return_value=ce)
+    main(
+        ["--start", "2023-01-09", "--compare", "week", "--output", "csv", "--no-cache"]
+    )
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "accountname,service,Previous,Current,Change,Change %"
+    assert len(lines) == 5
+    assert len([c for c in ce.calls if c[0] == "get_cost_and_usage"]) == 1
+
+    with pytest.raises(SystemExit):
+        main(["--compare", "week", "--output", "flat"])
@@ -1,10 +1,16 @@
+import asyncio
 import json
 import os.path
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta, timezone
+from io import StringIO
 
 import pytest
 
 from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.catalogue import DimensionCatalogue
+from hic_aws_costing_tools.main import main
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
 
 
 def get_test_data(scenario, method, format="json"):
@@ -406,3 +412,504 @@ def test_get_time_period_now(mocker):
         "Start": "2012-05-02",
         "End": "2012-05-03",
     }
+
+
+@pytest.mark.parametrize(
+    "start, end, months, days, expected",
+    [
+        (
+            "2022-01-15",
+            "2022-03-10",
+            1,
+            None,
+            [
+                ("2022-01-15", "2022-02-01"),
+                ("2022-02-01", "2022-03-01"),
+                ("2022-03-01", "2022-03-10"),
+            ],
+        ),
+        (
+            "2022-11-01",
+            "2023-05-01",
+            3,
+            None,
+            [("2022-11-01", "2023-02-01"), ("2023-02-01", "2023-05-01")],
+        ),
+        (
+            "2022-01-01",
+            "2022-01-08",
+            None,
+            3,
+            [
+                ("2022-01-01", "2022-01-04"),
+                ("2022-01-04", "2022-01-07"),
+                ("2022-01-07", "2022-01-08"),
+            ],
+        ),
+        ("2022-01-01", "2022-01-02", 1, None, [("2022-01-01", "2022-01-02")]),
+    ],
+)
+def test_split_time_period(start, end, months, days, expected):
+    windows = aws_costs.split_time_period(
+        {"Start": start, "End": end}, months=months, days=days
+    )
+    assert windows == [{"Start": s, "End": e} for (s, e) in expected]
+
+
+def _daily_cost_and_usage(**kwargs):
+    # Deterministic daily costs for any time period
+    start = datetime.fromisoformat(kwargs["TimePeriod"]["Start"]).date()
+    end = datetime.fromisoformat(kwargs["TimePeriod"]["End"]).date()
+    results = []
+    while start < end:
+        next_day = start + timedelta(days=1)
+        groups = [
+            {
+                "Keys": [f"00000000000{a}", f"Service {s}"],
+                "Metrics": {
+                    "UnblendedCost": {
+                        "Amount": str(start.toordinal() % 17 + a * s),
+                        "Unit": "USD",
+                    }
+                },
+            }
+            for a in range(1, 3)
+            for s in range(1, 4)
+        ]
+        results.append(
+            {
+                "TimePeriod": {"Start": str(start), "End": str(next_day)},
+                "Groups": groups,
+                "Estimated": False,
+            }
+        )
+        start = next_day
+    return {"ResultsByTime": results}
+
+
+@pytest.mark.parametrize("window_months, window_days", [(1, None), (None, 7)])
+def test_costs_for_regions_windows(mocker, window_months, window_days):
+    client_mock = mocker.Mock()
+    client_mock.get_dimension_values.return_value = {"DimensionValues": []}
+    client_mock.get_cost_and_usage.side_effect = _daily_cost_and_usage
+    mocker.patch("boto3.client", return_value=client_mock)
+
+    kwargs = dict(
+        time_period={"Start": "2022-01-10", "End": "2022-04-20"},
+        granularity="DAILY",
+        regions=None,
+        session=None,
+        group1="account",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+    )
+    expected = aws_costs.costs_for_regions(**kwargs)
+    assert client_mock.get_cost_and_usage.call_count == 1
+
+    results = aws_costs.costs_for_regions(
+        window_months=window_months, window_days=window_days, **kwargs
+    )
+    assert results == expected
+    assert client_mock.get_cost_and_usage.call_count > 2
+
+
+def test_costs_for_regions_window_days_monthly():
+    with pytest.raises(ValueError):
+        aws_costs.costs_for_regions(
+            time_period={"Start": "2022-01-10", "End": "2022-04-20"},
+            granularity="MONTHLY",
+            regions=None,
+            session=None,
+            group1="account",
+            group2="service",
+            exclude_types=[],
+            include_types=[],
+            window_days=7,
+        )
+
+
+def test_costs_for_regions_hourly():
+    ce = SyntheticCostExplorer(
+        cardinality1=2, cardinality2=3, density=0.5, record_calls=True
+    )
+    kwargs = dict(
+        regions=None,
+        session=None,
+        group1="account",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        ce=ce,
+    )
+    results, _, _, _, _ = aws_costs.costs_for_regions(
+        time_period={"Start": "2023-01-01", "End": "2023-01-21"},
+        granularity="HOURLY",
+        **kwargs,
+    )
+    assert [c[1] for c in ce.calls if c[0] == "get_cost_and_usage"] == [
+        {"Start": "2023-01-01T00:00:00Z", "End": "2023-01-15T00:00:00Z"},
+        {"Start": "2023-01-15T00:00:00Z", "End": "2023-01-21T00:00:00Z"},
+    ]
+    assert len(results) == 20 * 24
+    assert results[-1]["TimePeriod"] == {
+        "Start": "2023-01-20T23:00:00Z",
+        "End": "2023-01-21T00:00:00Z",
+    }
+
+    daily, _, _, _, _ = aws_costs.costs_for_regions(
+        time_period={"Start": "2023-01-01", "End": "2023-01-21"},
+        granularity="DAILY",
+        **kwargs,
+    )
+    assert sum(
+        c
+        for (*_, c) in aws_costs.iter_costs_flat(
+            results=results, cost_type="UnblendedCost"
+        )
+    ) == pytest.approx(
+        sum(
+            c
+            for (*_, c) in aws_costs.iter_costs_flat(
+                results=daily, cost_type="UnblendedCost"
+            )
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--granularity", "hourly", "--window-months", "1"],
+        ["--granularity", "monthly", "--window-days", "7"],
+    ],
+)
+def test_main_window_granularity(capsys, args):
+    with pytest.raises(SystemExit):
+        main(["--start", "2023-01-01", "--end", "2023-01-08"] + args)
+    assert "can't be used with" in capsys.readouterr().err
+
+
+def test_iter_cost_and_usage(mocker):
+    pages = [
+        {"ResultsByTime": [{"n": 1}, {"n": 2}], "NextPageToken": "token-1"},
+        {"ResultsByTime": [{"n": 3}], "NextPageToken": "token-2"},
+        {"ResultsByTime": [{"n": 4}]},
+    ]
+    client_mock = mocker.Mock()
+    client_mock.get_cost_and_usage.side_effect = pages
+
+    results = aws_costs.iter_cost_and_usage(client_mock, Granularity="DAILY")
+    assert next(results) == {"n": 1}
+    assert client_mock.get_cost_and_usage.call_count == 1
+    assert list(results) == [{"n": 2}, {"n": 3}, {"n": 4}]
+
+    assert [c.kwargs for c in client_mock.get_cost_and_usage.call_args_list] == [
+        {"Granularity": "DAILY"},
+        {"Granularity": "DAILY", "NextPageToken": "token-1"},
+        {"Granularity": "DAILY", "NextPageToken": "token-2"},
+    ]
+
+
+@pytest.mark.parametrize("scenario", ["dummy-services", "dummy-proj"])
+def test_costs_to_csv_file(scenario):
+    results = get_test_data(scenario, "get_cost_and_usage")["ResultsByTime"]
+    header, costs = aws_costs.costs_to_flat(
+        results=iter(results),
+        group1="Account",
+        group2="Service",
+        cost_type="UnblendedCost",
+        lazy=True,
+    )
+    expected = aws_costs.costs_to_csv(header, list(costs))
+
+    header, costs = aws_costs.costs_to_flat(
+        results=iter(results),
+        group1="Account",
+        group2="Service",
+        cost_type="UnblendedCost",
+        lazy=True,
+    )
+    f = StringIO()
+    assert aws_costs.costs_to_csv(header, costs, f) is None
+    assert f.getvalue() == expected
+    assert expected.startswith("START,END,Account,Service,COST\r\n")
+
+
+def test_get_raw_cost_data_multiple_roles(mocker, caplog):
+    client_mock = mocker.Mock()
+
+    def assume_role(RoleArn, RoleSessionName):
+        if "bad" in RoleArn:
+            raise RuntimeError("Access denied")
+        return {
+            "Credentials": {
+                "AccessKeyId": RoleArn,
+                "SecretAccessKey": "secret",
+                "SessionToken": "token",
+                "Expiration": datetime.now(timezone.utc) + timedelta(hours=1),
+            }
+        }
+
+    client_mock.assume_role.side_effect = assume_role
+    client_mock.get_dimension_values.return_value = {"DimensionValues": []}
+    client_mock.get_cost_and_usage.side_effect = _daily_cost_and_usage
+    mocker.patch("boto3.client", return_value=client_mock)
+    session_mock = mocker.patch("boto3.Session")
+    session_mock.return_value.client.return_value = client_mock
+
+    role_arns = [
+        "arn:aws:iam::111111111111:role/costs",
+        "arn:aws:iam::222222222222:role/costs",
+        "arn:aws:iam::333333333333:role/bad",
+    ]
+    kwargs = dict(
+        time_period={"Start": "2022-01-01", "End": "2022-01-03"},
+        granularity="DAILY",
+        regions=None,
+        group1="account",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        apply_value_mappings=True,
+    )
+    results, _, _, _, _ = aws_costs.get_raw_cost_data(role_arn=role_arns, **kwargs)
+    assert "Failed to get costs for arn:aws:iam::333333333333:role/bad" in caplog.text
+    assert [r["Payer"] for r in results] == ["111111111111"] * 2 + ["222222222222"] * 2
+    header, costs = aws_costs.costs_to_flat(
+        results=results,
+        group1="Account",
+        group2="Service",
+        cost_type="UnblendedCost",
+        payer=True,
+    )
+    assert header == ["PAYER", "START", "END", "Account", "Service", "COST"]
+    assert len(costs) == 2 * 2 * 6
+    assert costs[0][:4] == ("111111111111", "2022-01-01", "2022-01-02", "000000000001")
+
+    with pytest.raises(RuntimeError, match="Access denied"):
+        aws_costs.get_raw_cost_data(role_arn=role_arns[2:], **kwargs)
+
+
+def test_costs_for_regions_concurrent(mocker):
+    # The dimension lookups and cost query must all be in progress at once
+    barrier = threading.Barrier(3, timeout=5)
+    scenario = "dummy-proj"
+
+    def get_dimension_values(**kwargs):
+        barrier.wait()
+        return get_test_data(scenario, f"get_dimension_values-{kwargs['Dimension']}")
+
+    def get_tags(**kwargs):
+        barrier.wait()
+        return get_test_data(scenario, "get_tags")
+
+    def get_cost_and_usage(**kwargs):
+        barrier.wait()
+        return get_test_data(scenario, "get_cost_and_usage")
+
+    client_mock = mocker.Mock()
+    client_mock.get_dimension_values.side_effect = get_dimension_values
+    client_mock.get_tags.side_effect = get_tags
+    client_mock.get_cost_and_usage.side_effect = get_cost_and_usage
+
+    results, all_values1, all_values2, _, _ = aws_costs.costs_for_regions(
+        time_period={"Start": "2022-01-01", "End": "2022-01-02"},
+        granularity="DAILY",
+        regions=None,
+        session=None,
+        ce=client_mock,
+        group1="accountname",
+        group2="Proj$",
+        exclude_types=[],
+        include_types=[],
+    )
+    assert results == get_test_data(scenario, "get_cost_and_usage")["ResultsByTime"]
+    assert all_values1 == {"000000000001", "000000000002"}
+
+
+def test_create_costs_message_async(mocker):
+    scenario = "dummy-services"
+    client_mock = mocker.Mock()
+    client_mock.get_dimension_values.side_effect = lambda **kwargs: get_test_data(
+        scenario, f"get_dimension_values-{kwargs['Dimension']}"
+    )
+    client_mock.get_caller_identity.return_value = {"Account": "111111111111"}
+    client_mock.get_cost_and_usage.side_effect = lambda **kwargs: get_test_data(
+        scenario, "get_cost_and_usage"
+    )
+    mocker.patch("boto3.client", return_value=client_mock)
+
+    kwargs = dict(
+        time_period={"Start": "2022-01-01", "End": "2022-01-02"},
+        cost_type="UnblendedCost",
+        granularity="DAILY",
+        role_arn=None,
+        regions=None,
+        title_prefix="Test",
+        group1="AccountName",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        output="summary",
+        output_format="md",
+    )
+
+    async def create_reports():
+        messages = await asyncio.gather(
+            *(aws_costs.create_costs_message_async(**kwargs) for _ in range(3))
+        )
+        # The sync API also works inside a running event loop
+        messages.append(aws_costs.create_costs_message(**kwargs))
+        return messages
+
+    messages = asyncio.run(create_reports())
+    assert len(set(messages)) == 1
+    message, title = messages[0]
+    assert title == "Test 2022-01-01 (Saturday) UnblendedCost"
+    assert message == get_test_data(scenario, "test-format_message_summarise", "md")
+
+    f = StringIO()
+    kwargs.update(group2="Service", output="full", output_format="html", file=f)
+    assert aws_costs.create_costs_message(**kwargs) == (None, title)
+    assert f.getvalue() == get_test_data(
+        scenario, "test-format_message_all-True", "html"
+    )
+
+
+def test_get_group_by_paginated(mocker):
+    client_mock = mocker.Mock()
+    client_mock.get_dimension_values.side_effect = [
+        {
+            "DimensionValues": [
+                {"Value": "1", "Attributes": {"description": "one"}},
+                {"Value": "2", "Attributes": {"description": "two"}},
+            ],
+            "NextPageToken": "token",
+        },
+        {"DimensionValues": [{"Value": "3", "Attributes": {"description": "three"}}]},
+    ]
+    client_mock.get_tags.side_effect = [
+        {"Tags": ["a"], "NextPageToken": "token"},
+        {"Tags": ["b"]},
+    ]
+    time_period = {"Start": "2022-01-01", "End": "2022-01-02"}
+
+    _, all_values, value_map = aws_costs._get_group_by(
+        client_mock, time_period, "accountname"
+    )
+    assert all_values == {"1", "2", "3"}
+    assert value_map == {"1": "one", "2": "two", "3": "three"}
+    assert client_mock.get_dimension_values.call_args.kwargs == {
+        "TimePeriod": time_period,
+        "Dimension": "LINKED_ACCOUNT",
+        "NextPageToken": "token",
+    }
+
+    _, all_values, _ = aws_costs._get_group_by(client_mock, time_period, "Proj$")
+    assert all_values == {"Proj$a", "Proj$b"}
+
+
+def test_get_group_by_catalogue(mocker):
+    client_mock = mocker.Mock()
+    client_mock.get_dimension_values.side_effect = lambda **kwargs: get_test_data(
+        "dummy-services", f"get_dimension_values-{kwargs['Dimension']}"
+    )
+    catalogue = DimensionCatalogue()
+    time_period = {"Start": "2022-01-01", "End": "2022-01-02"}
+
+    account = aws_costs._get_group_by(
+        client_mock, time_period, "account", catalogue, "role"
+    )
+    accountname = aws_costs._get_group_by(
+        client_mock, time_period, "accountname", catalogue, "role"
+    )
+    assert account[1] == accountname[1] == {"000000000001", "000000000002"}
+    assert accountname[2] == {
+        "000000000001": "researchers-1",
+        "000000000002": "researchers-2",
+    }
+    assert client_mock.get_dimension_values.call_count == 1
+
+    # Different namespace or time period
+    aws_costs._get_group_by(client_mock, time_period, "account", catalogue, "other")
+    aws_costs._get_group_by(
+        client_mock,
+        {"Start": "2022-01-01", "End": "2022-01-03"},
+        "account",
+        catalogue,
+        "role",
+    )
+    assert client_mock.get_dimension_values.call_count == 3
+    assert (catalogue.hits, catalogue.misses) == (1, 3)
+
+    catalogue.ttl = 0
+    aws_costs._get_group_by(client_mock, time_period, "account", catalogue, "x")
+    aws_costs._get_group_by(client_mock, time_period, "account", catalogue, "x")
+    assert client_mock.get_dimension_values.call_count == 5
+
+
+@pytest.mark.parametrize("output", ["csv", "flat"])
+def test_create_costs_plain_output_metrics(mocker, output):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3, density=1)
+    spy = mocker.spy(ce, "get_cost_and_usage")
+    mocker.patch("boto3.client", return_value=ce)
+
+    metrics = ["UnblendedCost", "AmortizedCost", "UsageQuantity"]
+    csv = aws_costs.create_costs_plain_output(
+        time_period={"Start": "2023-01-01", "End": "2023-01-03"},
+        cost_type="UnblendedCost",
+        granularity="DAILY",
+        role_arn=None,
+        regions=None,
+        group1="account",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        output=output,
+        metrics=metrics,
+    )
+    assert spy.call_count == 1
+    assert spy.call_args.kwargs["Metrics"] == metrics
+
+    rows = [r.split(",") for r in csv.splitlines()]
+    if output == "flat":
+        assert rows[0] == ["START", "END", "account", "service"] + metrics
+        assert len(rows) == 1 + 2 * 2 * 3
+        unblended, amortized, usage = map(float, rows[1][4:])
+    else:
+        assert rows[0][:3] == [
+            "account",
+            "Service 0 (UnblendedCost)",
+            "Service 1 (UnblendedCost)",
+        ]
+        assert rows[0][4:6] == ["TOTAL (UnblendedCost)", "Service 0 (AmortizedCost)"]
+        assert rows[0][-1] == "TOTAL (UsageQuantity)"
+        assert len(rows) == 3
+        unblended, amortized, usage = map(float, rows[1][4::4])
+    assert amortized == pytest.approx(unblended * 1.05)
+    assert usage == pytest.approx(unblended * 10)
+
+
+def test_create_costs_message_cost_type(mocker):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3)
+    spy = mocker.spy(ce, "get_cost_and_usage")
+    mocker.patch("boto3.client", return_value=ce)
+
+    message, title = aws_costs.create_costs_message(
+        time_period={"Start": "2023-01-01", "End": "2023-01-03"},
+        cost_type="NetUnblendedCost",
+        granularity="DAILY",
+        role_arn=None,
+        regions=None,
+        title_prefix="Test",
+        group1="account",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        output="summary",
+        output_format="md",
+    )
+    assert spy.call_args.kwargs["Metrics"] == ["NetUnblendedCost"]
+    assert title.endswith(" NetUnblendedCost")
+    assert message.startswith("## Totals: USD ")
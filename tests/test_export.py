@@ -0,0 +1,155 @@
+import json
+from decimal import Decimal
+from io import BytesIO
+
+import pytest
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.export import write_export
+from hic_aws_costing_tools.main import main
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+HEADER = ["START", "END", "accountname", "service", "UnblendedCost"]
+ROWS = [
+    ("2023-01-01", "2023-01-02", "account-1", "Service 0", 1.25),
+    ("2023-01-01", "2023-01-02", "account-2", "Service 0", 0.1234567891),
+    ("2023-01-02", "2023-01-03", "account-1", "Service 1", 3.0),
+]
+
+
+def test_ndjson():
+    ndjson = write_export(None, HEADER, iter(ROWS), "ndjson", row_group_size=2)
+    lines = ndjson.splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[1]) == dict(zip(HEADER, ROWS[1]))
+
+
+def test_invalid_format():
+    with pytest.raises(ValueError, match="Invalid export format: xlsx"):
+        write_export(None, HEADER, ROWS, "xlsx")
+
+
+def test_parquet():
+    pq = pytest.importorskip("pyarrow.parquet")
+    data = write_export(None, HEADER, iter(ROWS), "parquet", row_group_size=2)
+    f = pq.ParquetFile(BytesIO(data))
+    assert f.metadata.num_row_groups == 2
+
+    table = f.read()
+    assert str(table.schema.field("START").type) == "date32[day]"
+    assert str(table.schema.field("service").type) == (
+        "dictionary<values=string, indices=int32, ordered=0>"
+    )
+    assert str(table.schema.field("UnblendedCost").type) == "decimal128(38, 18)"
+    assert table.column("UnblendedCost").to_pylist() == [
+        Decimal("1.25"),
+        Decimal("0.1234567891"),
+        Decimal("3"),
+    ]
+    assert str(table.column("END")[2]) == "2023-01-03"
+
+
+def test_arrow():
+    pa = pytest.importorskip("pyarrow")
+    data = write_export(None, HEADER, iter(ROWS), "arrow", row_group_size=2)
+    batches = list(pa.ipc.open_stream(data))
+    assert [b.num_rows for b in batches] == [2, 1]
+    assert batches[1].column("accountname").to_pylist() == ["account-1"]
+
+
+def test_parquet_decimal_amounts(mocker):
+    pq = pytest.importorskip("pyarrow.parquet")
+    amounts = ["123456789.123456789012", "0.000000000001"]
+    ce = mocker.Mock()
+    ce.get_cost_and_usage.return_value = {
+        "ResultsByTime": [
+            {
+                "TimePeriod": {"Start": "2023-01-01", "End": "2023-01-02"},
+                "Groups": [
+                    {
+                        "Keys": ["111111111111", f"Service {n}"],
+                        "Metrics": {"UnblendedCost": {"Amount": a, "Unit": "USD"}},
+                    }
+                    for (n, a) in enumerate(amounts)
+                ],
+            }
+        ]
+    }
+    ce.get_dimension_values.return_value = {"DimensionValues": []}
+    ce.get_caller_identity.return_value = {"Account": "111111111111"}
+    mocker.patch("boto3.client", return_value=ce)
+    data = aws_costs.create_costs_plain_output(
+        time_period={"Start": "2023-01-01", "End": "2023-01-02"},
+        cost_type="UnblendedCost",
+        granularity="DAILY",
+        role_arn=None,
+        regions=None,
+        group1="account",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        output="parquet",
+    )
+    # More significant digits than a float holds, and a very small amount
+    table = pq.read_table(BytesIO(data))
+    assert table.column("COST").to_pylist() == [Decimal(a) for a in amounts]
+
+
+def test_create_costs_plain_output_parquet(mocker):
+    pq = pytest.importorskip("pyarrow.parquet")
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3, density=1)
+    mocker.patch("boto3.client", return_value=ce)
+    kwargs = dict(
+        time_period={"Start": "2023-01-01", "End": "2023-01-03"},
+        cost_type="UnblendedCost",
+        granularity="DAILY",
+        role_arn=None,
+        regions=None,
+        group1="accountname",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        metrics=["UnblendedCost", "UsageQuantity"],
+    )
+    flat = aws_costs.create_costs_plain_output(output="flat", **kwargs)
+    data = aws_costs.create_costs_plain_output(output="parquet", **kwargs)
+    table = pq.read_table(BytesIO(data))
+    assert table.column_names == flat.splitlines()[0].split(",")
+    assert table.num_rows == 2 * 2 * 3
+
+
+def test_main_ndjson(mocker, capsys):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=2, density=1)
+    mocker.patch("boto3.client", return_value=ce)
+    main(["--start", "2023-01-01", "--output", "ndjson", "--no-cache"])
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(rows) == 4
+    assert rows[0]["START"] == "2023-01-01"
+    assert sorted(rows[0]) == ["COST", "END", "START", "accountname", "service"]
+
+
+def test_parquet_hourly(mocker):
+    pq = pytest.importorskip("pyarrow.parquet")
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=2, density=1)
+    mocker.patch("boto3.client", return_value=ce)
+    data = aws_costs.create_costs_plain_output(
+        time_period={"Start": "2023-01-01", "End": "2023-01-02"},
+        cost_type="UnblendedCost",
+        granularity="HOURLY",
+        role_arn=None,
+        regions=None,
+        group1="accountname",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        output="parquet",
+    )
+    table = pq.read_table(BytesIO(data))
+    assert table.num_rows == 24 * 4
+    # Parquet stores seconds as milliseconds
+    assert str(table.schema.field("START").type) == "timestamp[ms, tz=UTC]"
+
+    row = ("payer", "2023-01-01T05:00:00Z", "2023-01-01T06:00:00Z", "a", "b", 1.0)
+    data = write_export(None, ["PAYER"] + HEADER, [row], "parquet")
+    table = pq.read_table(BytesIO(data))
+    assert str(table.column("END")[0]) == "2023-01-01 06:00:00+00:00"
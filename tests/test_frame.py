@@ -0,0 +1,146 @@
+import pytest
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.frame import CostFrame
+from hic_aws_costing_tools.synthetic import generate_results
+
+from .test_costbot import assert_2d_costs_equal, get_test_data
+
+
+@pytest.mark.parametrize("decimals", [None, 6])
+@pytest.mark.parametrize("scenario", ["dummy-services", "dummy-proj"])
+def test_cost_frame_flat(scenario, decimals):
+    results = get_test_data(scenario, "get_cost_and_usage")["ResultsByTime"]
+    frame = CostFrame.from_results(iter(results), decimals=decimals)
+    assert len(frame) == sum(len(r["Groups"]) for r in results)
+    assert frame.unit("UnblendedCost") == "USD"
+    assert len(frame.labels1) == 2
+
+    kwargs = dict(group1="Account", group2="Service", cost_type="UnblendedCost")
+    expected = aws_costs.costs_to_flat(results=results, **kwargs)
+    header, costs = aws_costs.costs_to_flat(results=frame, **kwargs)
+    assert header == expected[0]
+    assert_2d_costs_equal(expected[1], costs, 6)
+
+
+@pytest.mark.parametrize("dense", [False, True])
+def test_cost_frame_table_relabel(dense):
+    if dense:
+        pytest.importorskip("numpy")
+    results, all_values1, all_values2, value_map1 = generate_results(
+        periods=10, cardinality1=5, cardinality2=8, density=0.3
+    )
+    frame = CostFrame.from_results(results)
+    mapped_frame, mapped_values1, _ = aws_costs._apply_value_mappings(
+        results=frame,
+        all_values1=all_values1,
+        all_values2=all_values2,
+        value_map1=value_map1,
+        value_map2={},
+    )
+    # Only the labels are rewritten
+    assert mapped_frame.key1 is frame.key1
+    assert mapped_frame.labels1 == [value_map1[v] for v in frame.labels1]
+    assert frame.labels1[0] == "000000000001"
+
+    mapped_results, _, _ = aws_costs._apply_value_mappings(
+        results=results,
+        all_values1=all_values1,
+        all_values2=all_values2,
+        value_map1=value_map1,
+        value_map2={},
+    )
+    kwargs = dict(
+        group1="AccountName",
+        all_values1=mapped_values1,
+        all_values2=all_values2,
+        cost_type="UnblendedCost",
+    )
+    expected = aws_costs.costs_to_table(results=mapped_results, **kwargs)
+    header, costs = aws_costs.costs_to_table(
+        results=mapped_frame, dense=dense, **kwargs
+    )
+    assert header == expected[0]
+    assert_2d_costs_equal(expected[1], costs, 8)
+
+
+@pytest.mark.parametrize("output_format", ["html", "md"])
+def test_cost_frame_format_message(output_format):
+    results = get_test_data("dummy-services", "get_cost_and_usage")["ResultsByTime"]
+    frame = CostFrame.from_results(results)
+    header, costs = aws_costs.costs_to_table(
+        results=results,
+        group1="AccountName",
+        all_values1=set(frame.labels1),
+        all_values2=set(frame.labels2),
+        cost_type="UnblendedCost",
+    )
+
+    assert aws_costs.format_message_summarise(
+        None, "AccountName", frame, output_format
+    ) == aws_costs.format_message_summarise(header, "AccountName", costs, output_format)
+    assert aws_costs.format_message_all(
+        None, frame, "AccountName", "Service", True, output_format
+    ) == aws_costs.format_message_all(
+        header, costs, "AccountName", "Service", True, output_format
+    )
+    assert aws_costs.costs_to_csv(["AccountName"], frame) == aws_costs.costs_to_csv(
+        header, costs
+    )
+
+
+def test_cost_frame_merge():
+    data = {}
+    for i, role_arn in enumerate(
+        ["arn:aws:iam::111111111111:role/a", "arn:aws:iam::222222222222:role/b"]
+    ):
+        results, all_values1, all_values2, value_map1 = generate_results(
+            periods=2, cardinality1=2, cardinality2=3, density=0.5, seed=i
+        )
+        data[role_arn] = (
+            CostFrame.from_results(results),
+            all_values1,
+            all_values2,
+            value_map1,
+            {},
+        )
+
+    frame, _, _, _, _ = aws_costs.merge_raw_cost_data(data)
+    assert isinstance(frame, CostFrame)
+    assert frame.payers == ["111111111111", "222222222222"]
+    assert len(frame) == 2 * 2 * 3
+    assert frame.labels1 == ["000000000001", "000000000002"]
+
+    rows = list(
+        aws_costs.iter_costs_flat(results=frame, cost_type="UnblendedCost", payer=True)
+    )
+    assert [r[0] for r in rows] == ["111111111111"] * 6 + ["222222222222"] * 6
+    assert rows[0][1:3] == ("2023-01-01", "2023-01-02")
+
+
+def test_cost_frame_mixed_units():
+    results = get_test_data("dummy-services", "get_cost_and_usage")["ResultsByTime"]
+    results[1]["Groups"][0]["Metrics"]["UnblendedCost"]["Unit"] = "GBP"
+    frame = CostFrame.from_results(results)
+    with pytest.raises(RuntimeError, match="Mixed units for UnblendedCost: GBP USD"):
+        frame.unit("UnblendedCost")
+    with pytest.raises(RuntimeError, match="Mixed units for UnblendedCost"):
+        aws_costs.costs_to_flat(
+            results=frame, group1="A", group2="B", cost_type="UnblendedCost"
+        )
+
+
+def test_cost_frame_empty():
+    frame = CostFrame.from_results(
+        [{"TimePeriod": {"Start": "2023-01-01", "End": "2023-01-02"}, "Groups": []}]
+    )
+    assert len(frame) == 0
+    assert frame.periods == [("2023-01-01", "2023-01-02")]
+    header, costs = aws_costs.costs_to_table(
+        results=frame,
+        group1="G1",
+        all_values1={"a"},
+        all_values2={"x"},
+        cost_type="UnblendedCost",
+    )
+    assert costs == [["a", 0, 0]]
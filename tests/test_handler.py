@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+
+from hic_aws_costing_tools import handler
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+EVENT = {
+    "start": "2023-01-01",
+    "end": "2023-01-03",
+    "granularity": "daily",
+    "output": "full",
+}
+
+
+def test_import_without_boto3():
+    code = (
+        "import sys, hic_aws_costing_tools.main, hic_aws_costing_tools.handler; "
+        "print(sorted(m for m in ('boto3', 'botocore') if m in sys.modules))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    assert output.strip() == "[]"
+
+
+def test_import_prewarm_fails():
+    # A failed prewarm is logged, the module is still loaded
+    code = (
+        "import boto3\n"
+        "def fail(*args, **kwargs): raise RuntimeError('No network')\n"
+        "boto3.client = fail\n"
+        "import hic_aws_costing_tools.handler\n"
+        "print('loaded')"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env=dict(os.environ, AWS_LAMBDA_FUNCTION_NAME="costs"),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "loaded"
+    assert "Prewarm failed" in result.stderr
+
+
+def test_handler_warm(mocker, monkeypatch, tmp_path):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3)
+    client = mocker.patch("boto3.client", return_value=ce)
+    monkeypatch.setattr(handler, "_invocations", 0)
+    monkeypatch.setattr(handler, "_cache", (None, None))
+    monkeypatch.setenv(handler.CACHE_DIR_ENV, str(tmp_path))
+
+    # Cost Explorer and STS, for the account that cached responses are stored under
+    handler.prewarm()
+    assert client.call_count == 2
+
+    first = handler.handler(EVENT, None)
+    second = handler.handler(dict(EVENT, title_prefix="Warm"), None)
+    assert first["cold"] and not second["cold"]
+    assert first["title"] == "AWS costs 2023-01-01 - 2023-01-03 UnblendedCost"
+    assert second["title"].startswith("Warm ")
+    assert first["message"] == second["message"]
+    assert "account-1" in first["message"]
+
+    # The clients are reused and the second query is served from the cache
+    assert client.call_count == 2
+    assert handler._get_cache().hits > 0
+
+
+def test_handler_compare(mocker):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3, record_calls=True)
+    mocker.patch("boto3.client", return_value=ce)
+    result = handler.handler({"start": "2023-01-09", "compare": "week"})
+    assert result["title"] == (
+        "AWS costs 2023-01-09 (Monday) vs 2023-01-02 (Monday) UnblendedCost"
+    )
+    assert "|Previous|Current|Change|Change %|" in result["message"]
+    assert len([c for c in ce.calls if c[0] == "get_cost_and_usage"]) == 1
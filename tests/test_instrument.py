@@ -0,0 +1,94 @@
+import json
+
+from hic_aws_costing_tools import aws_costs, instrument
+from hic_aws_costing_tools.cache import ResponseCache
+from hic_aws_costing_tools.instrument import Profiler
+from hic_aws_costing_tools.main import main
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+KWARGS = dict(
+    time_period={"Start": "2023-01-01", "End": "2023-01-03"},
+    granularity="DAILY",
+    role_arn=None,
+    regions=None,
+    group1="accountname",
+    group2="service",
+    exclude_types=[],
+    include_types=[],
+)
+
+
+def test_hooks(mocker):
+    events = []
+    instrument.add_hook(events.append)
+    try:
+        with instrument.stage("test"):
+            pass
+    finally:
+        instrument.remove_hook(events.append)
+    with instrument.stage("ignored"):
+        pass
+    assert [e["name"] for e in events] == ["test"]
+    assert not instrument.enabled()
+
+
+def test_profiler(mocker, tmp_path):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3, density=1, page_size=4)
+    mocker.patch("boto3.client", return_value=ce)
+    cache = ResponseCache(str(tmp_path))
+
+    with Profiler() as profiler:
+        for _ in range(2):
+            aws_costs.create_costs_message(
+                cost_type="UnblendedCost",
+                title_prefix="Test",
+                output="full",
+                output_format="md",
+                cache=cache,
+                **KWARGS,
+            )
+    summary = profiler.summary()
+    assert not instrument.enabled()
+
+    # 2 days x 6 groups in pages of 4, and 2 dimension lookups. The second message
+    # reads the pages from the cache, and dimension values from the catalogue.
+    api_calls = summary["api_calls"]
+    assert api_calls["get_cost_and_usage"]["calls"] == 3
+    assert api_calls["get_dimension_values"]["calls"] == 2
+    assert api_calls["get_cost_and_usage"]["bytes"] > 0
+    assert summary["cache"] == {"hits": 3, "misses": 5}
+    assert summary["ce_requests"] == 5
+    assert summary["estimated_cost_usd"] == 0.05
+    assert set(summary["stages"]) == {
+        "apply_value_mappings",
+        "fetch",
+        "get_group_by",
+        "pivot",
+        "render",
+    }
+    assert summary["stages"]["render"]["calls"] == 2
+    assert "Estimated Cost Explorer charge: $0.05" in profiler.format_summary()
+
+
+def test_main_profile(mocker, tmp_path, capsys):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=2)
+    mocker.patch("boto3.client", return_value=ce)
+    path = tmp_path / "profile.json"
+    main(
+        [
+            "--start",
+            "2023-01-01",
+            "--output",
+            "flat",
+            "--no-cache",
+            "--profile",
+            "--profile-json",
+            str(path),
+        ]
+    )
+    assert "API calls:\n  get_cost_and_usage: 1 calls" in capsys.readouterr().err
+    with open(path) as f:
+        profile = json.load(f)
+    assert profile["ce_requests"] == 3
+    assert "write_csv" in profile["stages"]
+    assert not instrument.enabled()
@@ -0,0 +1,164 @@
+import sqlite3
+from contextlib import closing
+from datetime import date
+
+import pytest
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.ledger import CostLedger, sync, sync_time_period
+
+from .test_costbot import _daily_cost_and_usage
+
+QUERY = dict(
+    role_arn=None,
+    regions=None,
+    group1="account",
+    group2="service",
+    exclude_types=[],
+    include_types=["Usage"],
+)
+
+
+@pytest.mark.parametrize(
+    "synced_range, today, expected",
+    [
+        # First sync
+        (None, date(2022, 3, 10), ("2022-02-01", "2022-03-10")),
+        # Restatement window
+        (
+            (date(2022, 2, 1), date(2022, 3, 10)),
+            date(2022, 3, 12),
+            ("2022-03-07", "2022-03-12"),
+        ),
+        # Previous month isn't final
+        (
+            (date(2022, 2, 1), date(2022, 4, 2)),
+            date(2022, 4, 3),
+            ("2022-03-01", "2022-04-03"),
+        ),
+        # Don't go before the first sync
+        (
+            (date(2022, 4, 1), date(2022, 4, 2)),
+            date(2022, 4, 3),
+            ("2022-04-01", "2022-04-03"),
+        ),
+    ],
+)
+def test_sync_time_period(synced_range, today, expected):
+    assert sync_time_period(synced_range, today=today) == {
+        "Start": expected[0],
+        "End": expected[1],
+    }
+
+
+def test_sync_and_query(mocker, tmp_path):
+    client_mock = mocker.Mock()
+    client_mock.get_caller_identity.return_value = {"Account": "111111111111"}
+    client_mock.get_dimension_values.return_value = {"DimensionValues": []}
+    client_mock.get_cost_and_usage.side_effect = _daily_cost_and_usage
+    mocker.patch("boto3.client", return_value=client_mock)
+    ledger = CostLedger(str(tmp_path / "ledger.sqlite3"))
+
+    assert sync(
+        ledger=ledger, start="2022-01-20", today=date(2022, 3, 10), **QUERY
+    ) == {
+        "Start": "2022-01-20",
+        "End": "2022-03-10",
+    }
+    assert sync(ledger=ledger, today=date(2022, 3, 11), **QUERY) == {
+        "Start": "2022-03-07",
+        "End": "2022-03-11",
+    }
+    assert client_mock.get_cost_and_usage.call_args.kwargs["TimePeriod"] == {
+        "Start": "2022-03-07",
+        "End": "2022-03-11",
+    }
+    calls = client_mock.get_cost_and_usage.call_count
+
+    time_period = {"Start": "2022-01-25", "End": "2022-03-05"}
+    expected, _, _, _, _ = aws_costs.costs_for_regions(
+        time_period=time_period,
+        granularity="DAILY",
+        regions=None,
+        session=None,
+        group1="account",
+        group2="service",
+        exclude_types=[],
+        include_types=["Usage"],
+    )
+
+    results, all_values1, all_values2, _, _ = aws_costs.get_raw_cost_data(
+        time_period=time_period,
+        granularity="DAILY",
+        apply_value_mappings=True,
+        ledger=ledger,
+        **QUERY,
+    )
+    assert list(
+        aws_costs.iter_costs_flat(results=results, cost_type="UnblendedCost")
+    ) == list(aws_costs.iter_costs_flat(results=expected, cost_type="UnblendedCost"))
+    assert all_values1 == {"000000000001", "000000000002"}
+    assert all_values2 == {"Service 1", "Service 2", "Service 3"}
+
+    results, _, _, _, _ = aws_costs.get_raw_cost_data(
+        time_period=time_period,
+        granularity="MONTHLY",
+        apply_value_mappings=True,
+        ledger=ledger,
+        **QUERY,
+    )
+    assert [r["TimePeriod"] for r in results] == [
+        {"Start": "2022-01-25", "End": "2022-02-01"},
+        {"Start": "2022-02-01", "End": "2022-03-01"},
+        {"Start": "2022-03-01", "End": "2022-03-05"},
+    ]
+    assert sum(
+        float(g["Metrics"]["UnblendedCost"]["Amount"])
+        for r in results
+        for g in r["Groups"]
+    ) == pytest.approx(
+        sum(
+            cost
+            for (_, _, _, _, cost) in aws_costs.iter_costs_flat(
+                results=expected, cost_type="UnblendedCost"
+            )
+        )
+    )
+    # Only the costs_for_regions call above
+    assert client_mock.get_cost_and_usage.call_count == calls + 1
+
+    with pytest.raises(ValueError, match="Ledger doesn't contain"):
+        aws_costs.get_raw_cost_data(
+            time_period={"Start": "2022-01-01", "End": "2022-02-01"},
+            granularity="DAILY",
+            apply_value_mappings=True,
+            ledger=ledger,
+            **QUERY,
+        )
+
+
+def test_update_stages_rows(tmp_path):
+    path = str(tmp_path / "ledger.sqlite3")
+    ledger = CostLedger(path)
+    time_period = {"Start": "2022-01-01", "End": "2022-01-03"}
+    kwargs = dict(time_period=time_period, value_map1={}, value_map2={}, **QUERY)
+    ledger.update(
+        rows=[
+            ("2022-01-01", "2022-01-02", "a", "s", 1.0),
+            ("2022-01-02", "2022-01-03", "b", "s", 2.0),
+        ],
+        **kwargs,
+    )
+
+    def rows():
+        # The ledger isn't locked while the rows are fetched
+        with closing(sqlite3.connect(path, timeout=0)) as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.rollback()
+        yield ("2022-01-02", "2022-01-03", "a", "s", 3.0)
+
+    ledger.update(rows=rows(), **kwargs)
+    with closing(sqlite3.connect(path)) as db:
+        assert db.execute("SELECT start, group1, cost FROM costs").fetchall() == [
+            ("2022-01-02", "a", 3.0)
+        ]
@@ -0,0 +1,149 @@
+import json
+from collections import Counter
+
+import pytest
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.main import main
+from hic_aws_costing_tools.multigroup import (
+    _value_filter,
+    costs_by_groups,
+    plan_costs_by_groups,
+    plan_grouping,
+)
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+TIME_PERIOD = {"Start": "2023-01-01", "End": "2023-01-05"}
+
+
+def test_plan_grouping():
+    assert plan_grouping({"a": 3, "b": 1, "c": 10, "d": 2}) == (
+        ["a", "c"],
+        ["b", "d"],
+    )
+    assert plan_grouping({"a": 1, "b": 1}) == (["a", "b"], [])
+    assert plan_grouping({"a": 1, "b": 2, "c": 2}) == (["b", "c"], ["a"])
+
+
+def test_value_filter():
+    assert _value_filter("region", "eu-west-2") == {
+        "Dimensions": {"Key": "REGION", "Values": ["eu-west-2"]}
+    }
+    assert _value_filter("Proj$", "Proj$x") == {
+        "Tags": {"Key": "Proj", "Values": ["x"]}
+    }
+    assert _value_filter("Proj$", "Proj$") == {
+        "Tags": {"Key": "Proj", "MatchOptions": ["ABSENT"]}
+    }
+
+
+def test_costs_by_groups(mocker):
+    ce = SyntheticCostExplorer(
+        cardinality1=3,
+        cardinality2=4,
+        density=0.5,
+        tag_key="Proj",
+        regions=["eu-west-2", "us-east-1", "us-west-2"],
+    )
+    spy = mocker.spy(ce, "get_cost_and_usage")
+    mocker.patch("boto3.client", return_value=ce)
+    groups = ["accountname", "Proj$", "region", "service"]
+
+    plan = plan_costs_by_groups(time_period=TIME_PERIOD, groups=groups)
+    assert plan["cardinality"] == {
+        "accountname": 3,
+        "Proj$": 5,
+        "region": 3,
+        "service": 1,
+    }
+    assert plan["group_by"] == ["accountname", "Proj$"]
+    assert plan["filter_by"] == ["region", "service"]
+    assert plan["queries"] == 3
+    assert spy.call_count == 0
+
+    header, rows = costs_by_groups(
+        time_period=TIME_PERIOD,
+        granularity="DAILY",
+        groups=groups,
+        exclude_types=[],
+        include_types=["Usage"],
+        max_workers=2,
+    )
+    assert spy.call_count == 3
+    assert spy.call_args.kwargs["Filter"]["And"][0] == {
+        "Dimensions": {"Key": "RECORD_TYPE", "Values": ["Usage"]}
+    }
+    assert header == ["START", "END"] + groups + ["UnblendedCost"]
+    assert [r[0] for r in rows] == sorted(r[0] for r in rows)
+    assert {r[2] for r in rows} == {"account-1", "account-2", "account-3"}
+    assert {r[4] for r in rows} <= set(plan["filter_values"]["region"])
+    # Each cell is in one region so no group is repeated
+    assert max(Counter(r[:4] for r in rows).values()) == 1
+
+    expected = aws_costs.costs_for_regions(
+        ce=SyntheticCostExplorer(cardinality1=3, cardinality2=4, density=0.5),
+        time_period=TIME_PERIOD,
+        granularity="DAILY",
+        regions=None,
+        session=None,
+        group1="accountname",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+    )[0]
+    assert sum(r[-1] for r in rows) == pytest.approx(
+        sum(
+            float(g["Metrics"]["UnblendedCost"]["Amount"])
+            for r in expected
+            for g in r["Groups"]
+        )
+    )
+
+
+def test_plan_shares_catalogue(mocker):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3, record_calls=True)
+    mocker.patch("boto3.client", return_value=ce)
+    aws_costs.get_raw_cost_data(
+        time_period=TIME_PERIOD,
+        granularity="DAILY",
+        role_arn=None,
+        regions=None,
+        group1="accountname",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        apply_value_mappings=True,
+    )
+    calls = len(ce.calls)
+    # Dimension values are stored under the same account
+    plan_costs_by_groups(time_period=TIME_PERIOD, groups=["accountname", "service"])
+    assert len(ce.calls) == calls
+
+
+def test_costs_by_groups_duplicate():
+    with pytest.raises(ValueError, match="Duplicate dimensions"):
+        costs_by_groups(
+            time_period=TIME_PERIOD,
+            granularity="DAILY",
+            groups=["account", "accountname", "service"],
+            exclude_types=[],
+            include_types=[],
+        )
+
+
+def test_groups_main(mocker, capsys):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3, density=1)
+    mocker.patch("boto3.client", return_value=ce)
+    argv = ["--start", "2023-01-01", "--end", "2023-01-02", "--no-cache"]
+    argv += ["--groups", "service", "region", "accountname"]
+
+    main(argv + ["--dry-run"])
+    plan = json.loads(capsys.readouterr().out)
+    # accountname and region both have 2 values, the first is grouped by
+    assert plan["filter_by"] == ["accountname"]
+    assert plan["queries"] == 2
+
+    main(argv)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "START,END,service,region,accountname,UnblendedCost"
+    assert len(lines) == 1 + 2 * 3
@@ -0,0 +1,83 @@
+import pytest
+
+from hic_aws_costing_tools.pivot import CostPivot
+
+from .test_costbot import assert_2d_costs_equal, get_test_data
+
+
+def _results():
+    return [
+        {
+            "Groups": [
+                {
+                    "Keys": ["a", "x"],
+                    "Metrics": {"UnblendedCost": {"Amount": "1.5", "Unit": "USD"}},
+                },
+                {
+                    "Keys": ["b", "y"],
+                    "Metrics": {"UnblendedCost": {"Amount": "2", "Unit": "USD"}},
+                },
+                {
+                    "Keys": ["unknown", "y"],
+                    "Metrics": {"UnblendedCost": {"Amount": "100", "Unit": "USD"}},
+                },
+            ]
+        },
+        {
+            "Groups": [
+                {
+                    "Keys": ["a", "x"],
+                    "Metrics": {"UnblendedCost": {"Amount": "0.25", "Unit": "USD"}},
+                },
+            ]
+        },
+    ]
+
+
+@pytest.mark.parametrize("dense", [False, True])
+def test_cost_pivot(dense):
+    if dense:
+        pytest.importorskip("numpy")
+    pivot = CostPivot({"b", "a", "c"}, {"y", "x"}, dense=dense)
+    pivot.add_results(_results(), "UnblendedCost", "USD")
+
+    assert sorted(pivot.cells()) == [("a", "x", 1.75), ("b", "y", 2.0)]
+    header, costs = pivot.to_table("G1")
+    assert header == ["G1", "x", "y", "TOTAL"]
+    assert costs == [["a", 1.75, 0, 1.75], ["b", 0, 2.0, 2.0], ["c", 0, 0, 0]]
+
+
+def test_cost_pivot_unit():
+    pivot = CostPivot({"a"}, {"x"})
+    results = _results()
+    results[1]["Groups"][0]["Metrics"]["UnblendedCost"]["Unit"] = "GBP"
+    with pytest.raises(RuntimeError, match="Unexpected unit: GBP"):
+        pivot.add_results(results, "UnblendedCost", "USD")
+
+
+@pytest.mark.parametrize("scenario", ["dummy-services", "dummy-proj"])
+def test_cost_pivot_dense(scenario):
+    pytest.importorskip("numpy")
+    expected = get_test_data(scenario, "test-costs_to_table")
+    results = get_test_data(scenario, "get_cost_and_usage")["ResultsByTime"]
+    values1 = {g["Keys"][0] for r in results for g in r["Groups"]}
+    values2 = set(expected["header"][1:-1])
+
+    sparse = CostPivot(values1, values2)
+    sparse.add_results(results, "UnblendedCost", "USD")
+    dense = CostPivot(values1, values2, dense=True)
+    dense.add_results(results, "UnblendedCost", "USD")
+
+    header, costs = sparse.to_table("AccountName")
+    assert header == expected["header"]
+    dense_header, dense_costs = dense.to_table("AccountName")
+    assert dense_header == header
+    assert_2d_costs_equal(costs, dense_costs, 8)
+    assert_2d_costs_equal(
+        [
+            [r[0].replace("researchers-", "00000000000")] + r[1:]
+            for r in expected["costs"]
+        ],
+        costs,
+        4,
+    )
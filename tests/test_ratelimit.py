@@ -0,0 +1,112 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from hic_aws_costing_tools.clients import ClientPool
+from hic_aws_costing_tools.ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _error(code, status=400):
+    return ClientError(
+        {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        "GetCostAndUsage",
+    )
+
+
+def _limiter(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    limiter = _limiter(clock, rate=2)
+    for _ in range(6):
+        limiter.acquire()
+    # Two tokens are available immediately, then one every 0.5s
+    assert clock.now == pytest.approx(2)
+
+    limiter = _limiter(clock, rate=None)
+    for _ in range(100):
+        limiter.acquire()
+    assert clock.now == pytest.approx(2)
+
+
+def test_retry_throttling(mocker):
+    clock = FakeClock()
+    limiter = _limiter(clock, rate=10, base_delay=1)
+    func = mocker.Mock(
+        side_effect=[_error("ThrottlingException"), _error("Internal", 500), "ok"]
+    )
+    assert limiter.call(func, 1, a=2) == "ok"
+    func.assert_called_with(1, a=2)
+    # The first two tokens are free, the first retry waits up to 1s and the second 2s
+    assert len(clock.sleeps) == 2
+    assert 0 <= clock.sleeps[0] <= 1 and 0 <= clock.sleeps[1] <= 2
+    assert limiter.stats() == {"calls": 1, "throttles": 1, "retries": 2, "rate": 5.5}
+
+
+def test_retry_limits(mocker):
+    clock = FakeClock()
+    limiter = _limiter(clock, rate=None, max_retries=2, retry_budget=3)
+    func = mocker.Mock(side_effect=_error("LimitExceededException"))
+    with pytest.raises(ClientError):
+        limiter.call(func)
+    assert func.call_count == 3
+    # Only one retry is left in the budget
+    with pytest.raises(ClientError):
+        limiter.call(func)
+    assert func.call_count == 5
+    assert limiter.retries == 3
+
+    func = mocker.Mock(side_effect=_error("AccessDeniedException"))
+    with pytest.raises(ClientError):
+        limiter.call(func)
+    assert func.call_count == 1
+
+
+def test_retry_budget_refills(mocker):
+    clock = FakeClock()
+    limiter = _limiter(
+        clock, rate=None, max_retries=1, retry_budget=2, retry_budget_seconds=60
+    )
+    func = mocker.Mock(side_effect=_error("ThrottlingException"))
+    for _ in range(2):
+        with pytest.raises(ClientError):
+            limiter.call(func)
+    assert func.call_count == 4
+    # The budget is used up so the next throttle isn't retried
+    with pytest.raises(ClientError):
+        limiter.call(func)
+    assert func.call_count == 5
+
+    # One retry is refilled every 30s
+    clock.now += 30
+    func = mocker.Mock(side_effect=[_error("ThrottlingException"), "ok"])
+    assert limiter.call(func) == "ok"
+    assert limiter.retries == 3
+
+
+def test_client_pool_rate_limited(mocker):
+    ce = mocker.Mock()
+    ce.get_cost_and_usage.side_effect = [_error("ThrottlingException"), {"r": 1}]
+    mocker.patch("boto3.client", return_value=ce)
+    pool = ClientPool(rate=None)
+
+    client = pool.client("ce")
+    assert client.get_cost_and_usage(TimePeriod={}) == {"r": 1}
+    assert ce.get_cost_and_usage.call_count == 2
+    # Other attributes aren't wrapped
+    assert client.meta is ce.meta
+    assert pool.rate_limit_stats()["ce"]["throttles"] == 1
@@ -0,0 +1,215 @@
+from io import StringIO
+
+import pytest
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.render import (
+    CsvRenderer,
+    HtmlRenderer,
+    MarkdownRenderer,
+    fit_rows,
+    write_all,
+    write_budgeted,
+    write_summary,
+)
+from hic_aws_costing_tools.synthetic import generate_results
+
+from .test_costbot import get_test_data
+
+HEADER = ["Account", "<script>", "a|b", "TOTAL"]
+COSTS = [["Tom & Jerry's", 1, 2.5, 3.5], ["x", 0, 4, 4]]
+
+
+def _render(cls, write, *args):
+    f = StringIO()
+    write(cls(f), *args)
+    return f.getvalue()
+
+
+def test_html_escaped():
+    html = _render(HtmlRenderer, write_all, HEADER, COSTS, "Account", "Service", False)
+    assert "<h2>Tom &amp; Jerry&#x27;s</h2>" in html
+    assert "<tr><td>&lt;script&gt;</td><td>1.00</td></tr>" in html
+    assert "<script>" not in html
+
+    html = _render(HtmlRenderer, write_summary, HEADER, "<G1>", COSTS, "USD")
+    assert html.startswith(
+        "<h2>Totals: USD 7.50</h2>\n<table>\n<tr><th>&lt;G1&gt;</th><th>Total</th></tr>\n"
+    )
+
+
+def test_markdown_escaped():
+    md = _render(MarkdownRenderer, write_all, HEADER, COSTS, "Account", "Service", True)
+    assert "|a\\|b|2.50|\n" in md
+    assert md.endswith("## x\n\n|Service|Cost|\n|-|-|\n|a\\|b|4.00|\n\n")
+
+
+def test_csv_renderer():
+    csv = _render(CsvRenderer, write_all, HEADER, COSTS, "Account", "Service", True)
+    assert csv.splitlines() == [
+        "Account,Service,Cost",
+        "Tom & Jerry's,<script>,1",
+        "Tom & Jerry's,a|b,2.5",
+        "x,a|b,4",
+    ]
+    csv = _render(CsvRenderer, write_summary, HEADER, "Account", COSTS, "USD")
+    assert csv.splitlines() == ["Account,Total", "x,4", "Tom & Jerry's,3.5"]
+
+
+@pytest.mark.parametrize("output_format", ["html", "md"])
+def test_write_message_all_file(output_format):
+    test_data = get_test_data("dummy-services", "test-costs_to_table")
+    f = StringIO()
+    assert (
+        aws_costs.write_message_all(
+            f,
+            test_data["header"],
+            test_data["costs"],
+            "AccountName",
+            "Service",
+            True,
+            output_format,
+        )
+        is None
+    )
+    assert f.getvalue() == get_test_data(
+        "dummy-services", "test-format_message_all-True", output_format
+    )
+
+
+def test_invalid_output_format():
+    with pytest.raises(ValueError, match="Invalid output type: txt"):
+        aws_costs.format_message_summarise(HEADER, "Account", COSTS, "txt")
+
+
+def test_fit_rows():
+    cells = [(f"s{i}", float(i)) for i in range(10)]
+    columns = ["Service", "Cost"]
+    full = _render(
+        MarkdownRenderer,
+        write_all,
+        ["A"] + [c[0] for c in cells] + ["TOTAL"],
+        [["t"] + [c[1] for c in cells] + [45.0]],
+        "A",
+        "Service",
+        False,
+    )
+
+    rows, size = fit_rows(MarkdownRenderer(None), "t", columns, cells, 1000, ("A", "t"))
+    assert rows == sorted(([n, c] for (n, c) in cells), key=lambda r: -r[1])
+    assert size == len(full)
+
+    rows, size = fit_rows(MarkdownRenderer(None), "t", columns, cells, 80, ("A", "t"))
+    assert rows == [["s9", 9.0], ["s8", 8.0], ["Other (8 items)", 28.0]]
+    assert size <= 80
+    f = StringIO()
+    MarkdownRenderer(f).table("t", columns, rows, ("A", "t"))
+    assert len(f.getvalue()) == size
+
+    rows, _ = fit_rows(MarkdownRenderer(None), "t", columns, cells, 60, ("A", "t"))
+    assert rows == [["Other (10 items)", 45.0]]
+    assert fit_rows(MarkdownRenderer(None), "t", columns, cells, 50) == (None, 0)
+
+
+@pytest.mark.parametrize("cls", [MarkdownRenderer, HtmlRenderer, CsvRenderer])
+@pytest.mark.parametrize("max_bytes", [500, 2000, 10000, 100000])
+def test_write_budgeted(cls, max_bytes):
+    results, all_values1, all_values2, _ = generate_results(
+        periods=3, cardinality1=40, cardinality2=30, density=0.3
+    )
+    header, costs = aws_costs.costs_to_table(
+        results=results,
+        group1="Account",
+        all_values1=all_values1,
+        all_values2=all_values2,
+        cost_type="UnblendedCost",
+    )
+    out = _render(
+        cls, write_budgeted, header, costs, "Account", "Service", "USD", max_bytes
+    )
+    assert len(out.encode()) <= max_bytes
+    unlimited = _render(
+        cls, write_budgeted, header, costs, "Account", "Service", "USD", 10**9
+    )
+    if len(unlimited) <= max_bytes:
+        assert out == unlimited
+    else:
+        # Either a table is cut short, or the following tables are left out
+        assert "Other (" in out or unlimited.startswith(out)
+
+    # Too small for any summary row, so everything is in the Other row
+    out = _render(cls, write_budgeted, header, costs, "Account", "Service", "USD", 10)
+    assert "Other (40 items)" in out
+    assert out == _render(cls, write_summary, header, "Account", costs, "USD", 10)
+
+
+def test_write_budgeted_order():
+    md = _render(
+        MarkdownRenderer,
+        write_budgeted,
+        HEADER,
+        COSTS,
+        "Account",
+        "Service",
+        "USD",
+        1000,
+    )
+    assert md == (
+        "## Totals: USD 7.50\n\n|Account|Total|\n|-|-|\n|x|4.00|\n|Tom & Jerry's|3.50|\n"
+        "\n---\n"
+        "## x\n\n|Service|Cost|\n|-|-|\n|a\\|b|4.00|\n\n"
+        "## Tom & Jerry's\n\n|Service|Cost|\n|-|-|\n|a\\|b|2.50|\n|<script>|1.00|\n\n"
+    )
+    summary = aws_costs.format_message_summarise(HEADER, "Account", COSTS, "md", 72)
+    assert summary.endswith("|-|-|\n|Other (2 items)|7.50|\n")
+
+
+def test_write_budgeted_skips_large_table():
+    header = ["Account", "a", "b", "c", "Total"]
+    costs = [["big", 4.0, 3.0, 2.0, 9.0], ["small", 0, 0, 1.0, 1.0]]
+    unlimited = _render(
+        MarkdownRenderer,
+        write_budgeted,
+        header,
+        costs,
+        "Account",
+        "Service",
+        "USD",
+        1000,
+    )
+    summary = _render(MarkdownRenderer, write_summary, header, "Account", costs, "USD")
+    small = "## small\n\n|Service|Cost|\n|-|-|\n|c|1.00|\n\n"
+    assert unlimited.endswith(small)
+    # Room for the small table but not the big one, even cut short
+    max_bytes = len(summary) + len("\n---\n") + len(small)
+    md = _render(
+        MarkdownRenderer,
+        write_budgeted,
+        header,
+        costs,
+        "Account",
+        "Service",
+        "USD",
+        max_bytes,
+    )
+    assert md == summary + "\n---\n" + small
+
+
+def test_write_costs_message_tiny_budget():
+    results, all_values1, all_values2, _ = generate_results(
+        periods=2, cardinality1=5, cardinality2=4, density=1
+    )
+    f = StringIO()
+    aws_costs.write_costs_message(
+        f,
+        results=results,
+        group1="Account",
+        group2="Service",
+        all_values1=all_values1,
+        all_values2=all_values2,
+        cost_type="UnblendedCost",
+        output="auto",
+        output_format="md",
+        max_bytes=50,
+    )
+    assert "|Other (5 items)|" in f.getvalue()
@@ -0,0 +1,121 @@
+from datetime import date
+
+import pytest
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.batch import plan_queries, report_specs
+from hic_aws_costing_tools.rollup import bucket, parse_week_start, rollup
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+from .test_costbot import assert_2d_costs_equal
+
+
+@pytest.mark.parametrize(
+    "granularity,kwargs,expected",
+    [
+        ("WEEKLY", {}, (date(2023, 5, 15), date(2023, 5, 22))),
+        ("WEEKLY", {"week_start": 6}, (date(2023, 5, 14), date(2023, 5, 21))),
+        ("MONTHLY", {}, (date(2023, 5, 1), date(2023, 6, 1))),
+        ("QUARTERLY", {}, (date(2023, 4, 1), date(2023, 7, 1))),
+        ("YEARLY", {}, (date(2023, 1, 1), date(2024, 1, 1))),
+        ("FISCAL_YEARLY", {}, (date(2023, 4, 1), date(2024, 4, 1))),
+        (
+            "FISCAL_YEARLY",
+            {"fiscal_year_start": 7},
+            (date(2022, 7, 1), date(2023, 7, 1)),
+        ),
+    ],
+)
+def test_bucket(granularity, kwargs, expected):
+    # Wednesday
+    assert bucket(date(2023, 5, 17), granularity, **kwargs) == expected
+
+
+def test_parse_week_start():
+    assert parse_week_start("Sunday") == 6
+    assert parse_week_start("2") == 2
+    with pytest.raises(ValueError, match="Invalid week start: 7"):
+        parse_week_start(7)
+
+
+def _flat(results):
+    return sorted(aws_costs.iter_costs_flat(results=results, cost_type="UnblendedCost"))
+
+
+def test_rollup_monthly_matches_cost_explorer():
+    ce = SyntheticCostExplorer(cardinality1=3, cardinality2=4, density=0.5)
+    time_period = {"Start": "2023-01-20", "End": "2023-03-05"}
+    kwargs = dict(TimePeriod=time_period, Metrics=["UnblendedCost"])
+    daily = ce.get_cost_and_usage(Granularity="DAILY", **kwargs)["ResultsByTime"]
+    monthly = ce.get_cost_and_usage(Granularity="MONTHLY", **kwargs)["ResultsByTime"]
+
+    frame = rollup(daily, "MONTHLY")
+    assert frame.periods == [
+        ("2023-01-20", "2023-02-01"),
+        ("2023-02-01", "2023-03-01"),
+        ("2023-03-01", "2023-03-05"),
+    ]
+    assert len(frame) == sum(len(r["Groups"]) for r in monthly)
+    assert_2d_costs_equal(_flat(monthly), _flat(frame), 6)
+
+    weekly = rollup(daily, "WEEKLY")
+    assert weekly.periods[0] == ("2023-01-20", "2023-01-23")
+    assert weekly.periods[-1] == ("2023-02-27", "2023-03-05")
+    assert sum(weekly.iter_amounts("UnblendedCost")) == pytest.approx(
+        sum(frame.iter_amounts("UnblendedCost"))
+    )
+
+    with pytest.raises(ValueError, match="spans more than one WEEKLY period"):
+        rollup(frame, "WEEKLY")
+
+
+def test_get_raw_cost_data_rollup(mocker):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=2, density=1)
+    spy = mocker.spy(ce, "get_cost_and_usage")
+    mocker.patch("boto3.client", return_value=ce)
+    kwargs = dict(
+        time_period={"Start": "2023-01-01", "End": "2023-07-01"},
+        role_arn=None,
+        regions=None,
+        group1="accountname",
+        group2="service",
+        exclude_types=[],
+        include_types=[],
+        apply_value_mappings=True,
+    )
+
+    results, _, _, _, _ = aws_costs.get_raw_cost_data(granularity="QUARTERLY", **kwargs)
+    assert spy.call_args.kwargs["Granularity"] == "DAILY"
+    assert results.periods == [
+        ("2023-01-01", "2023-04-01"),
+        ("2023-04-01", "2023-07-01"),
+    ]
+    assert results.labels1 == ["account-1", "account-2"]
+    assert len(results) == 2 * 2 * 2
+
+    results, _, _, _, _ = aws_costs.get_raw_cost_data(
+        granularity="MONTHLY", local_rollup=True, **kwargs
+    )
+    assert spy.call_args.kwargs["Granularity"] == "DAILY"
+    assert len(results.periods) == 6
+
+
+def test_plan_queries_rollup():
+    defaults = {"start": "2023-01-01", "end": "2023-02-01", "output": "flat"}
+    specs = report_specs(
+        {
+            "defaults": defaults,
+            "reports": [
+                {"granularity": "monthly"},
+                {"granularity": "fiscal-yearly"},
+                {"granularity": "weekly", "week_start": "sunday"},
+                {"granularity": "monthly", "group2": "Proj$"},
+            ],
+        }
+    )
+    assert specs[2]["week_start"] == 6
+    queries = plan_queries(specs)
+    assert [(q["granularity"], indices) for (q, indices) in queries] == [
+        ("DAILY", [0, 1, 2]),
+        ("MONTHLY", [3]),
+    ]
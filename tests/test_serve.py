@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+from datetime import date, datetime
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from hic_aws_costing_tools.serve import (
+    CostService,
+    ResultCache,
+    _seconds_until,
+    make_server,
+)
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer
+
+
+def _cost_queries(ce):
+    return [c for c in ce.calls if c[0] == "get_cost_and_usage"]
+
+
+def test_result_cache_lru_ttl():
+    now = [0]
+    cache = ResultCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    assert cache.get("a", lambda: 1) == (1, "miss")
+    assert cache.get("b", lambda: 2) == (2, "miss")
+    assert cache.get("a", lambda: -1) == (1, "hit")
+    # b is the least recently used
+    assert cache.get("c", lambda: 3) == (3, "miss")
+    assert cache.get("b", lambda: 4) == (4, "miss")
+    assert cache.get("c", lambda: -1) == (3, "hit")
+
+    now[0] = 10
+    assert cache.get("c", lambda: 5) == (5, "miss")
+    assert cache.get("c", lambda: 6, refresh=True) == (6, "miss")
+    assert cache.stats() == {"entries": 2, "hits": 2, "misses": 6, "coalesced": 0}
+
+
+def test_result_cache_coalesce():
+    cache = ResultCache()
+    release = threading.Event()
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        release.wait(5)
+        return "value"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get("k", fetch)))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    while cache.stats()["coalesced"] < 7:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(fetches) == 1
+    assert sorted(results) == [("value", "coalesced")] * 7 + [("value", "miss")]
+
+    # Waiting callers get the exception, and the next call fetches again
+    def fail():
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        cache.get("x", fail)
+    assert cache.get("x", lambda: 1) == (1, "miss")
+
+
+def test_cost_service(mocker):
+    ce = SyntheticCostExplorer(
+        cardinality1=2, cardinality2=3, density=1, record_calls=True
+    )
+    mocker.patch("boto3.client", return_value=ce)
+    service = CostService(defaults={"granularity": "daily"})
+
+    request = {"start": "2023-01-09", "output": "full"}
+    response = service.costs(request)
+    assert response["title"] == "AWS costs 2023-01-09 (Monday) UnblendedCost"
+    assert response["cache"] == "miss"
+    assert service.costs(dict(request, format="html"))["cache"] == "hit"
+    assert service.costs(dict(request, output="flat"))["message"].startswith(
+        "START,END,accountname,service,COST"
+    )
+    assert len(_cost_queries(ce)) == 1
+
+    response = service.costs({"start": "2023-01-09", "compare": "week"})
+    assert response["title"].endswith("vs 2023-01-02 (Monday) UnblendedCost")
+    assert response["message"].startswith("## Totals: USD ")
+
+    with pytest.raises(ValueError, match="Invalid output"):
+        service.costs({"output": "ndjson"})
+
+
+def test_prewarm(mocker):
+    ce = SyntheticCostExplorer(cardinality1=2, cardinality2=3, record_calls=True)
+    mocker.patch("boto3.client", return_value=ce)
+    service = CostService()
+    service.prewarm(today=date(2023, 6, 1))
+    assert _cost_queries(ce) == [
+        ("get_cost_and_usage", {"Start": "2023-05-31", "End": "2023-06-01"}),
+        ("get_cost_and_usage", {"Start": "2023-05-01", "End": "2023-06-01"}),
+    ]
+    response = service.costs({"start": "2023-05-01", "end": "2023-06-01"})
+    assert response["cache"] == "hit"
+    assert service.stats()["prewarms"] == 1
+
+
+def test_seconds_until():
+    now = datetime(2023, 6, 1, 7, 30)
+    assert _seconds_until("08:00", now) == 1800
+    assert _seconds_until("06:00", now) == 22.5 * 3600
+
+
+def _post(url, body):
+    request = Request(
+        url,
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urlopen(request) as r:
+        return json.load(r)
+
+
+def test_server(mocker):
+    ce = SyntheticCostExplorer(
+        cardinality1=3, cardinality2=4, density=0.5, record_calls=True
+    )
+    mocker.patch("boto3.client", return_value=ce)
+    server = make_server(CostService(), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        body = {"start": "2023-01-01", "end": "2023-02-01", "output": "summary"}
+        responses = []
+        threads = [
+            threading.Thread(
+                target=lambda: responses.append(_post(f"{url}/costs", body))
+            )
+            for _ in range(6)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len({r["message"] for r in responses}) == 1
+        assert len(_cost_queries(ce)) == 1
+
+        with urlopen(f"{url}/stats") as r:
+            stats = json.load(r)
+        assert stats["entries"] == 1
+        assert stats["hits"] + stats["misses"] + stats["coalesced"] == 6
+
+        with pytest.raises(HTTPError) as e:
+            _post(f"{url}/costs", {"compare": "decade"})
+        assert e.value.code == 400
+        assert json.load(e.value) == {"error": "Invalid comparison: decade"}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,47 @@
+import pytest
+
+from hic_aws_costing_tools import aws_costs
+from hic_aws_costing_tools.synthetic import SyntheticCostExplorer, generate_results
+
+
+def test_generate_results_deterministic():
+    a = generate_results(periods=5, cardinality1=3, cardinality2=4, density=0.5)
+    b = generate_results(periods=5, cardinality1=3, cardinality2=4, density=0.5)
+    c = generate_results(periods=5, cardinality1=3, cardinality2=4, seed=1)
+    assert a == b
+    assert a[0] != c[0]
+
+    results, all_values1, all_values2, value_map1 = a
+    assert len(results) == 5
+    assert [len(r["Groups"]) for r in results] == [6] * 5
+    assert all_values1 == {"000000000001", "000000000002", "000000000003"}
+    assert value_map1["000000000002"] == "account-2"
+
+
+@pytest.mark.parametrize("granularity", ["DAILY", "MONTHLY"])
+def test_synthetic_pagination(granularity):
+    kwargs = dict(
+        time_period={"Start": "2023-01-20", "End": "2023-03-05"},
+        granularity=granularity,
+        regions=None,
+        session=None,
+        group1="accountname",
+        group2="Proj$",
+        exclude_types=[],
+        include_types=[],
+    )
+    ce = SyntheticCostExplorer(
+        cardinality1=4, cardinality2=5, tag_key="Proj", record_calls=True
+    )
+    expected = aws_costs.costs_for_regions(ce=ce, **kwargs)
+
+    paged_ce = SyntheticCostExplorer(
+        cardinality1=4, cardinality2=5, tag_key="Proj", page_size=7, record_calls=True
+    )
+    results = aws_costs.costs_for_regions(ce=paged_ce, **kwargs)
+    assert len(paged_ce.calls) > len(ce.calls)
+
+    assert results[1:] == expected[1:]
+    assert list(
+        aws_costs.iter_costs_flat(results=results[0], cost_type="UnblendedCost")
+    ) == list(aws_costs.iter_costs_flat(results=expected[0], cost_type="UnblendedCost"))